@@ -0,0 +1,587 @@
+"""
+Camada Silver: inferência de tipos das tabelas staging_* e carga tipada em silver_*.
+Versão vetorizada das funções do notebook (infer_column_type_final, is_date_series, looks_like_text):
+uma conversão para texto por coluna e um passe vetorizado (regex / to_datetime(errors="coerce"))
+por formato candidato, parando no primeiro que atinge o limiar.
+
+Por padrão o perfil é calculado no próprio Postgres (SILVER_PROFILER=sql): uma consulta agregada
+por bloco de colunas conta os valores que casam com cada regra e só esses contadores voltam para o
+Python. A decisão (classify_profile) é a mesma do caminho pandas (infer_column_type).
+
+Uso: TypeInferenceEngine(engine=engine, schema="useall").process_tables()
+Benchmark: python type_analytics.py [linhas] [colunas]
+"""
+
+import os
+import sys
+import json
+import time
+import hashlib
+import logging
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np # type: ignore
+import pandas as pd # type: ignore
+from sqlalchemy import text # type: ignore
+
+from useall_extract import executar_em_paralelo
+from useall_gold import views_externas, recriar_view, copiar_privilegios
+from useall_manifest import ensure_manifest, manifest_upsert
+from useall_metrics import ensure_metrics, metrica_insert, metrica_params
+
+logger = logging.getLogger("useall_pipeline")
+
+SCHEMA_FILE = Path(os.getenv("SCHEMA_SILVER_FILE", Path(__file__).with_name("schema_silver.json")))
+SAMPLE_LIMIT = 100000
+# "sql" (perfil agregado no Postgres) ou "pandas" (amostra trazida para o Python)
+PROFILER = os.getenv("SILVER_PROFILER", "sql").lower()
+# Percentual do TABLESAMPLE SYSTEM no perfil SQL; vazio = mesmas linhas que o pandas leria
+TABLESAMPLE = os.getenv("SILVER_TABLESAMPLE") or None
+# Colunas por consulta de perfil (cada coluna gera 16 agregados; o Postgres aceita até 1664)
+PROFILE_CHUNK = 60
+# Tabelas silver carregadas ao mesmo tempo (uma conexão do pool cada)
+SILVER_WORKERS = int(os.getenv("SILVER_WORKERS", "4"))
+# Linhas com valor que não converte para o tipo inferido (o valor vira NULL na silver).
+# Fora do padrão silver_* de propósito: a gold genérica copia toda silver_*.
+REJECTS_TABLE = "rejects_silver"
+# Amostra usada nas heurísticas de data/texto (igual ao notebook: head(100) dos não nulos)
+DATE_SAMPLE = 100
+DATE_THRESHOLD = 0.9
+
+BOOLEAN_VALUES = ["0", "1", "true", "false", "True", "False"]
+RE_TEXT = r"[A-Za-zÇç]"
+RE_INT = r"-?\d+"
+RE_DECIMAL = r"-?\d+(?:\.\d+)?"
+
+# (formato python, forma em regex, formato to_timestamp do Postgres), na ordem de preferência.
+# Dia, mês e hora com 1 ou 2 dígitos: o strptime (e o to_timestamp) aceitam "2024-1-5" e "5/1/2024"
+DATE_FORMATS = [
+    ("%Y-%m-%d", r"\d{4}-\d{1,2}-\d{1,2}", "YYYY-MM-DD"),
+    ("%Y-%m-%d %H:%M:%S", r"\d{4}-\d{1,2}-\d{1,2} \d{1,2}:\d{1,2}:\d{1,2}", "YYYY-MM-DD HH24:MI:SS"),
+    ("%Y-%m-%dT%H:%M:%S", r"\d{4}-\d{1,2}-\d{1,2}T\d{1,2}:\d{1,2}:\d{1,2}", 'YYYY-MM-DD"T"HH24:MI:SS'),
+    ("%d/%m/%Y", r"\d{1,2}/\d{1,2}/\d{4}", "DD/MM/YYYY"),
+    ("%d/%m/%Y %H:%M:%S", r"\d{1,2}/\d{1,2}/\d{4} \d{1,2}:\d{1,2}:\d{1,2}", "DD/MM/YYYY HH24:MI:SS"),
+]
+# Posição (split_part, separadores trocados por "-") de cada parte da data; a hora fica sempre em 4/5/6
+_ISO = {"y": 1, "m": 2, "d": 3}
+_BR = {"y": 3, "m": 2, "d": 1}
+_HORA = {"H": 4, "M": 5, "S": 6}
+DATE_PARTS = {
+    "%Y-%m-%d": _ISO,
+    "%Y-%m-%d %H:%M:%S": {**_ISO, **_HORA},
+    "%Y-%m-%dT%H:%M:%S": {**_ISO, **_HORA},
+    "%d/%m/%Y": _BR,
+    "%d/%m/%Y %H:%M:%S": {**_BR, **_HORA},
+}
+
+
+# ================= INFERÊNCIA =================
+def detect_date_format(txt, threshold=DATE_THRESHOLD):
+    """Primeiro formato em que >= threshold da amostra (já texto, sem nulos) é data válida."""
+    sample = txt.head(DATE_SAMPLE)
+    if sample.empty:
+        return None
+    for fmt, forma, _ in DATE_FORMATS:
+        candidatos = sample[sample.str.fullmatch(forma)]
+        # Corte barato: nem a forma bate na proporção mínima
+        if len(candidatos) / len(sample) < threshold:
+            continue
+        validos = pd.to_datetime(candidatos, format=fmt, errors="coerce").notna().sum()
+        if validos / len(sample) >= threshold:
+            return fmt
+    return None
+
+
+def _todos(txt, padrao):
+    """fullmatch em todos os valores, testando antes a amostra curta (saída cedo para colunas de texto)."""
+    return txt.head(DATE_SAMPLE).str.fullmatch(padrao).all() and txt.str.fullmatch(padrao).all()
+
+
+def infer_column_type(series):
+    """Mesma regra do notebook: boolean > timestamp (se não parece texto) > bigint > numeric > text."""
+    txt = series.dropna().astype(str)
+    if txt.empty:
+        return {"type": "text"}
+
+    if txt.isin(BOOLEAN_VALUES).all():
+        return {"type": "boolean"}
+
+    if not txt.head(DATE_SAMPLE).str.contains(RE_TEXT).any():
+        fmt = detect_date_format(txt)
+        if fmt:
+            return {"type": "timestamp", "format": fmt}
+
+    if _todos(txt, RE_INT):
+        return {"type": "bigint"}
+
+    if _todos(txt, RE_DECIMAL):
+        return {"type": "numeric(18,4)"}
+
+    return {"type": "text"}
+
+
+# ================= PERFIL NO POSTGRES =================
+def _data_valida_sql(v, fmt, forma, ano_min=None):
+    """Equivalente SQL de to_datetime(format=fmt) não ser NaT (sem exceção: tudo guardado por CASE)."""
+    partes = DATE_PARTS[fmt]
+    num = {k: f"split_part(translate({v}, '/T: ', '----'), '-', {i})::int" for k, i in partes.items()}
+    # O parser ISO do pandas aceita o ano 0000 (proleptico); o strptime (formatos BR) não
+    if ano_min is None:
+        ano_min = 0 if fmt.startswith("%Y") else 1
+    conds = [f"{num['y']} >= {ano_min}", f"{num['m']} BETWEEN 1 AND 12", f"{num['d']} >= 1"]
+    if "H" in num:
+        conds += [f"{num['H']} <= 23", f"{num['M']} <= 59", f"{num['S']} <= 59"]
+    y = num["y"]
+    bissexto = f"(mod({y}, 4) = 0 AND mod({y}, 100) <> 0 OR mod({y}, 400) = 0)"
+    ultimo_dia = (
+        f"CASE WHEN {num['m']} IN (4, 6, 9, 11) THEN 30 "
+        f"WHEN {num['m']} = 2 THEN CASE WHEN {bissexto} THEN 29 ELSE 28 END ELSE 31 END"
+    )
+    return (
+        f"CASE WHEN {v} ~ '^{forma}$' THEN CASE WHEN {' AND '.join(conds)} "
+        f"THEN {num['d']} <= {ultimo_dia} ELSE false END ELSE false END"
+    )
+
+
+def profile_sql(schema, table, columns, sample_limit=SAMPLE_LIMIT, tablesample=None):
+    """
+    Uma consulta com os contadores de cada coluna. "Cabeça" = os DATE_SAMPLE primeiros não nulos
+    na ordem da amostra (o head(100) do pandas), marcada por count() acumulado.
+    """
+    cols = ", ".join(f'"{c}"' for c in columns)
+    amostragem = f" TABLESAMPLE SYSTEM ({float(tablesample)})" if tablesample else ""
+    janelas = ", ".join(f'count("{c}") OVER w AS "_h{i}"' for i, c in enumerate(columns))
+    bools = ", ".join(f"'{b}'" for b in BOOLEAN_VALUES)
+    aggs = []
+    for i, c in enumerate(columns):
+        v = f'"{c}"::text'
+        cabeca = f'{v} IS NOT NULL AND "_h{i}" <= {DATE_SAMPLE}'
+        aggs += [
+            f"count({v})",
+            f"count(*) FILTER (WHERE {v} IN ({bools}))",
+            f"count(*) FILTER (WHERE {cabeca})",
+            f"count(*) FILTER (WHERE {cabeca} AND {v} ~ '{RE_TEXT}')",
+        ]
+        for fmt, forma, _ in DATE_FORMATS:
+            aggs += [
+                f"count(*) FILTER (WHERE {cabeca} AND {v} ~ '^{forma}$')",
+                f"count(*) FILTER (WHERE {cabeca} AND {_data_valida_sql(v, fmt, forma)})",
+            ]
+        aggs += [
+            f"count(*) FILTER (WHERE {v} ~ '^{RE_INT}$')",
+            f"count(*) FILTER (WHERE {v} ~ '^{RE_DECIMAL}$')",
+        ]
+    return (
+        f"WITH amostra AS (SELECT {cols} FROM {schema}.\"{table}\"{amostragem} LIMIT {int(sample_limit)}), "
+        f"numerada AS (SELECT *, row_number() OVER () AS _rn FROM amostra), "
+        f"marcada AS (SELECT *, {janelas} FROM numerada WINDOW w AS (ORDER BY _rn)) "
+        f"SELECT {', '.join(aggs)} FROM marcada"
+    )
+
+
+def _unpack_profile(row, columns):
+    """Linha de contadores -> {coluna: perfil}."""
+    n_formatos = len(DATE_FORMATS)
+    largura = 6 + 2 * n_formatos
+    perfis = {}
+    for i, c in enumerate(columns):
+        r = row[i * largura:(i + 1) * largura]
+        datas = r[4:4 + 2 * n_formatos]
+        perfis[c] = {
+            "n": r[0], "bool": r[1], "head": r[2], "letras": r[3],
+            "formas": list(datas[0::2]), "validas": list(datas[1::2]),
+            "ints": r[-2], "decs": r[-1],
+        }
+    return perfis
+
+
+def classify_profile(p, threshold=DATE_THRESHOLD):
+    """Mesmas regras (e mesma ordem) de infer_column_type, a partir dos contadores do perfil."""
+    if p["n"] == 0:
+        return {"type": "text"}
+    if p["bool"] == p["n"]:
+        return {"type": "boolean"}
+    if p["letras"] == 0:
+        for (fmt, _, _), formas, validas in zip(DATE_FORMATS, p["formas"], p["validas"]):
+            if formas / p["head"] < threshold:
+                continue
+            if validas / p["head"] >= threshold:
+                return {"type": "timestamp", "format": fmt}
+    if p["ints"] == p["n"]:
+        return {"type": "bigint"}
+    if p["decs"] == p["n"]:
+        return {"type": "numeric(18,4)"}
+    return {"type": "text"}
+
+
+# ================= SQL =================
+BOOL_TRUE = "'1','true','sim','s','y','yes'"
+BOOL_FALSE = "'0','false','nao','n','no'"
+
+
+def _cast_valido_sql(col_txt, meta):
+    """Predicado: o valor converte sem erro para o tipo inferido (None = sempre converte)."""
+    tipo = meta["type"]
+    if tipo == "boolean":
+        return f"lower({col_txt}) IN ({BOOL_TRUE}, {BOOL_FALSE})"
+    if tipo == "timestamp":
+        formato = next((f for f in DATE_FORMATS if f[0] == meta.get("format")), None)
+        if formato is None:
+            return "false"
+        # to_timestamp não aceita o ano 0
+        return _data_valida_sql(col_txt, formato[0], formato[1], ano_min=1)
+    if tipo == "bigint":
+        return f"{col_txt} ~ '^{RE_INT}$' AND length(ltrim({col_txt}, '-')) <= 18"
+    if tipo == "numeric(18,4)":
+        return f"{col_txt} ~ '^{RE_DECIMAL}$' AND length(split_part(ltrim({col_txt}, '-'), '.', 1)) <= 14"
+    return None
+
+
+def generate_cast_sql(col_dest, meta):
+    """Expressão de cast staging (TEXT) -> tipo inferido; valores que não convertem viram NULL (nunca erro)."""
+    col_txt = f'"{meta["source_col"]}"::text'
+    tipo = meta["type"]
+    if meta.get("ausente"):
+        # Coluna que saiu da staging: mantida na silver, sem valor
+        return f'NULL::{tipo} AS "{col_dest}"'
+    valido = _cast_valido_sql(col_txt, meta)
+    if valido is None:
+        return f'{col_txt} AS "{col_dest}"'
+
+    if tipo == "boolean":
+        conv = f"lower({col_txt}) IN ({BOOL_TRUE})"
+    elif tipo == "timestamp":
+        pg_fmt = next(f[2] for f in DATE_FORMATS if f[0] == meta["format"])
+        conv = f"to_timestamp({col_txt}, '{pg_fmt}')"
+    else:
+        conv = f"{col_txt}::{tipo}"
+    # Cast externo fixa o tipo da coluna no CREATE TABLE AS (to_timestamp devolve timestamptz)
+    return f'(CASE WHEN {valido} THEN {conv} ELSE NULL END)::{tipo} AS "{col_dest}"'
+
+
+def generate_rejects_sql(columns):
+    """Array com as colunas da linha cujo valor não nulo não converteu."""
+    casos = []
+    for col_dest, meta in columns.items():
+        col_txt = f'"{meta["source_col"]}"::text'
+        valido = _cast_valido_sql(col_txt, meta)
+        if valido is not None and not meta.get("ausente"):
+            casos.append(f"CASE WHEN {col_txt} IS NOT NULL AND NOT ({valido}) THEN '{col_dest}' END")
+    if not casos:
+        return "ARRAY[]::text[]"
+    return f"array_remove(ARRAY[{', '.join(casos)}]::text[], NULL)"
+
+
+def generate_select_cast(schema, staging_table, columns):
+    selects = ", ".join(generate_cast_sql(col_dest, meta) for col_dest, meta in columns.items())
+    return f'SELECT {selects} FROM {schema}."{staging_table}"'
+
+
+def generate_load_sql(schema, staging_table, silver_table, columns):
+    """
+    Carga em uma passada: o CTE converte cada linha uma vez; as rejeitadas (pelo ctid) vão para
+    REJECTS_TABLE com a linha original em JSON e todas seguem para a silver.
+    Parâmetros: (run_id, silver_table).
+    """
+    selects = ", ".join(generate_cast_sql(col_dest, meta) for col_dest, meta in columns.items())
+    cols = ", ".join(f'"{c}"' for c in columns)
+    staging = f'{schema}."{staging_table}"'
+    return f"""
+        WITH src AS (
+            SELECT {selects}, {generate_rejects_sql(columns)} AS _rejeitadas, s.ctid AS _ctid FROM {staging} s
+        ), rej AS (
+            INSERT INTO {schema}.{REJECTS_TABLE} (run_id, tabela, colunas, registro)
+            SELECT %s, %s, r._rejeitadas, to_jsonb(st)
+            FROM src r JOIN {staging} st ON st.ctid = r._ctid
+            WHERE cardinality(r._rejeitadas) > 0
+        )
+        INSERT INTO {schema}."{silver_table}" ({cols}) SELECT {cols} FROM src
+    """
+
+
+def ensure_rejects(engine, schema):
+    with engine.begin() as conn:
+        conn.execute(text(f"""
+            CREATE TABLE IF NOT EXISTS {schema}.{REJECTS_TABLE} (
+                id BIGSERIAL PRIMARY KEY,
+                run_id TEXT,
+                tabela TEXT NOT NULL,
+                colunas TEXT[] NOT NULL,
+                registro JSONB,
+                rejeitado_em TIMESTAMP NOT NULL DEFAULT now()
+            )
+        """))
+
+
+def fingerprint(colunas):
+    """Impressão digital do conjunto de colunas (ordem não importa)."""
+    return hashlib.md5("\n".join(sorted(colunas)).encode("utf-8")).hexdigest()
+
+
+def trocar_silver(cur, schema, silver_table):
+    """silver_x__next no lugar de silver_x; a antiga sai sem CASCADE depois de recriadas as views dependentes."""
+    alvo = f'{schema}."{silver_table}"'
+    cur.execute("SELECT to_regclass(%s)", (alvo,))
+    if cur.fetchone()[0] is None:
+        cur.execute(f'ALTER TABLE {schema}."{silver_table}__next" RENAME TO "{silver_table}"')
+        return
+    externas = views_externas(cur, schema, silver_table)
+    copiar_privilegios(cur, alvo, f'{schema}."{silver_table}__next"')
+    cur.execute(f'DROP TABLE IF EXISTS {schema}."{silver_table}__old"')
+    cur.execute(f'ALTER TABLE {alvo} RENAME TO "{silver_table}__old"')
+    cur.execute(f'ALTER TABLE {schema}."{silver_table}__next" RENAME TO "{silver_table}"')
+    for externa in externas:
+        recriar_view(cur, *externa)
+    cur.execute(f'DROP TABLE {schema}."{silver_table}__old"')
+
+
+def silver_table_name(staging_table):
+    return staging_table.replace("staging_", "silver_")
+
+
+# ================= ENGINE =================
+class TypeInferenceEngine:
+    """Mantém o registro de schema (SCHEMA_FILE, versionado por fingerprint) e carrega as silver_* a partir das staging_*."""
+
+    def __init__(self, engine, schema, schema_file=SCHEMA_FILE, sample_limit=SAMPLE_LIMIT,
+                 profiler=PROFILER, tablesample=TABLESAMPLE, workers=SILVER_WORKERS, run_id=None):
+        self.engine = engine
+        self.schema = schema
+        self.schema_file = Path(schema_file)
+        self.sample_limit = sample_limit
+        self.profiler = profiler
+        self.tablesample = tablesample
+        self.workers = workers
+        self.run_id = run_id
+
+    def staging_columns(self):
+        """{staging_table: [colunas na ordem da tabela]} de todas as staging_*, em uma consulta."""
+        with self.engine.connect() as conn:
+            rows = conn.execute(text("""
+                SELECT c.table_name, c.column_name
+                FROM information_schema.columns c
+                JOIN information_schema.tables t USING (table_schema, table_name)
+                WHERE c.table_schema = :schema AND t.table_type = 'BASE TABLE' AND c.table_name LIKE 'staging\\_%'
+                ORDER BY c.table_name, c.ordinal_position
+            """), {"schema": self.schema})
+            colunas = {}
+            for tabela, coluna in rows:
+                colunas.setdefault(tabela, []).append(coluna)
+            return colunas
+
+    def profile_table(self, staging_table, colunas):
+        """Tipos inferidos no Postgres: só os contadores trafegam, em blocos de PROFILE_CHUNK colunas."""
+        tipos = {}
+        raw_conn = self.engine.raw_connection()
+        try:
+            cur = raw_conn.cursor()
+            for i in range(0, len(colunas), PROFILE_CHUNK):
+                bloco = colunas[i:i + PROFILE_CHUNK]
+                cur.execute(profile_sql(self.schema, staging_table, bloco, self.sample_limit, self.tablesample))
+                for col, perfil in _unpack_profile(cur.fetchone(), bloco).items():
+                    tipos[col] = classify_profile(perfil)
+            raw_conn.rollback()
+        finally:
+            raw_conn.close()
+        return tipos
+
+    def infer_columns(self, staging_table, colunas):
+        """{coluna destino: meta} só para as colunas pedidas."""
+        if self.profiler == "sql":
+            tipos = self.profile_table(staging_table, colunas)
+        else:
+            lista = ", ".join(f'"{c}"' for c in colunas)
+            df = pd.read_sql(f'SELECT {lista} FROM {self.schema}."{staging_table}" LIMIT {self.sample_limit}', self.engine)
+            tipos = {col: infer_column_type(df[col]) for col in df.columns}
+        return {col.lower(): {**tipo, "source_col": col} for col, tipo in tipos.items()}
+
+    def reconcile_table(self, silver_table, staging_table, colunas, meta=None):
+        """
+        Registro do schema por fingerprint do conjunto de colunas da staging.
+        Mesmo fingerprint = nada a fazer. Mudou: infere só as colunas novas, marca as que sumiram
+        como ausentes (viram NULL na silver) e grava uma nova versão. Retorna (meta, mudou).
+        """
+        impressao = fingerprint(colunas)
+        if meta is not None and meta.get("fingerprint") == impressao:
+            return meta, False
+
+        meta = meta or {"staging_table": staging_table, "columns": {}, "version": 0, "history": []}
+        conhecidas = {m["source_col"] for m in meta["columns"].values()}
+        novas = [c for c in colunas if c not in conhecidas]
+        sumiram = sorted(conhecidas - set(colunas))
+        voltaram = [d for d, m in meta["columns"].items() if m.get("ausente") and m["source_col"] in colunas]
+
+        if novas:
+            meta["columns"].update(self.infer_columns(staging_table, novas))
+        for dest, m in meta["columns"].items():
+            if m["source_col"] in sumiram:
+                m["ausente"] = True
+            elif dest in voltaram:
+                m.pop("ausente", None)
+
+        meta["fingerprint"] = impressao
+        meta["version"] = meta.get("version", 0) + 1
+        meta.setdefault("history", []).append({
+            "version": meta["version"], "fingerprint": impressao, "added": novas, "removed": sumiram,
+            "at": datetime.now().isoformat(timespec="seconds"),
+        })
+        logger.info(
+            f"[SCHEMA] {self.schema}.{silver_table} v{meta['version']}: "
+            f"{len(novas)} colunas novas, {len(sumiram)} ausentes"
+        )
+        return meta, True
+
+    def load_or_create_schema(self, staging_columns):
+        """Carrega o registro (SCHEMA_FILE) e o concilia com as colunas atuais de cada staging."""
+        schema_silver = {}
+        if self.schema_file.exists():
+            with open(self.schema_file, "r", encoding="utf-8") as f:
+                schema_silver = json.load(f)
+
+        alteradas = 0
+        for staging_table, colunas in staging_columns.items():
+            silver_table = silver_table_name(staging_table)
+            inicio = time.time()
+            meta, mudou = self.reconcile_table(silver_table, staging_table, colunas, schema_silver.get(silver_table))
+            if mudou:
+                schema_silver[silver_table] = meta
+                alteradas += 1
+                logger.info(f"[SCHEMA] {self.schema}.{staging_table} conciliada em {time.time() - inicio:.2f}s")
+
+        if alteradas:
+            with open(self.schema_file, "w", encoding="utf-8") as f:
+                json.dump(schema_silver, f, indent=2, ensure_ascii=False)
+            logger.info(f"[SCHEMA] {self.schema_file.name} atualizado ({alteradas} tabelas)")
+        # Tabelas cuja staging não existe mais ficam no registro, mas não são carregadas
+        return {t: m for t, m in schema_silver.items() if m["staging_table"] in staging_columns}
+
+    def add_missing_columns(self, cur, alvo, columns):
+        """ALTER TABLE ADD COLUMN para as colunas do registro que a silver ainda não tem."""
+        cur.execute(
+            "SELECT attname FROM pg_attribute WHERE attrelid = %s::regclass AND attnum > 0 AND NOT attisdropped",
+            (alvo,),
+        )
+        existentes = {r[0] for r in cur.fetchall()}
+        for dest, meta in columns.items():
+            if dest not in existentes:
+                cur.execute(f'ALTER TABLE {alvo} ADD COLUMN "{dest}" {meta["type"]}')
+                logger.info(f"[SCHEMA] {alvo}: coluna {dest} ({meta['type']}) adicionada")
+
+    def tipos_mudaram(self, cur, alvo, select):
+        """Colunas da silver cujo tipo difere do SELECT de cast atual (só se resolve recriando a tabela)."""
+        cur.execute(f'CREATE TEMP TABLE "_tipos_silver" ON COMMIT DROP AS {select} WITH NO DATA')
+        cur.execute("""
+            SELECT a.attname FROM pg_attribute a
+            JOIN pg_attribute n ON n.attrelid = '"_tipos_silver"'::regclass AND n.attname = a.attname
+                               AND n.attnum > 0 AND NOT n.attisdropped
+            WHERE a.attrelid = %s::regclass AND a.attnum > 0 AND NOT a.attisdropped
+              AND format_type(a.atttypid, a.atttypmod) <> format_type(n.atttypid, n.atttypmod)
+        """, (alvo,))
+        mudaram = [r[0] for r in cur.fetchall()]
+        cur.execute('DROP TABLE "_tipos_silver"')
+        return mudaram
+
+    def load_silver(self, silver_table, meta):
+        """
+        Uma transação por tabela, sem SET UNLOGGED/SET LOGGED (cada um reescreve a tabela):
+        - tabela existente com os mesmos tipos: ADD COLUMN das colunas novas do registro, TRUNCATE e
+          INSERT ... SELECT na própria tabela (com wal_level=minimal, o TRUNCATE na mesma transação
+          dispensa o WAL da carga);
+        - tabela nova ou com tipo de coluna alterado: carga em silver_x__next e troca por RENAME
+          (trocar_silver), recriando as views dependentes e os grants.
+        Retorna (linhas, rejeitadas).
+        """
+        alvo = f'{self.schema}."{silver_table}"'
+        columns = meta["columns"]
+        inicio = time.time()
+        raw_conn = self.engine.raw_connection()
+        try:
+            cur = raw_conn.cursor()
+            select = generate_select_cast(self.schema, meta["staging_table"], columns)
+            cur.execute("SELECT to_regclass(%s)", (alvo,))
+            existe = cur.fetchone()[0] is not None
+            mudaram = self.tipos_mudaram(cur, alvo, select) if existe else []
+            if existe and not mudaram:
+                self.add_missing_columns(cur, alvo, columns)
+                cur.execute(f"TRUNCATE {alvo}")
+                destino = silver_table
+            else:
+                if mudaram:
+                    logger.info(f"[SCHEMA] {alvo}: tipo alterado em {mudaram}, tabela recriada")
+                destino = f"{silver_table}__next"
+                cur.execute(f'DROP TABLE IF EXISTS {self.schema}."{destino}"')
+                cur.execute(f'CREATE TABLE {self.schema}."{destino}" AS {select} WITH NO DATA')
+            cur.execute(generate_load_sql(self.schema, meta["staging_table"], destino, columns),
+                        (self.run_id, silver_table))
+            linhas = cur.rowcount
+            if destino != silver_table:
+                trocar_silver(cur, self.schema, silver_table)
+            # Marca da carga no manifesto (mesmo commit): a gold só dá por construída a partição extraída antes dela
+            cur.execute(manifest_upsert(self.schema), (silver_table, "full", linhas, None))
+            cur.execute(
+                f"SELECT count(*) FROM {self.schema}.{REJECTS_TABLE} WHERE tabela = %s AND run_id IS NOT DISTINCT FROM %s "
+                f"AND rejeitado_em >= now()",
+                (silver_table, self.run_id),
+            )
+            rejeitadas = cur.fetchone()[0]
+            cur.execute(metrica_insert(self.schema), metrica_params(
+                self.run_id, "silver", silver_table, time.time() - inicio, linhas, rejeitadas=rejeitadas,
+            ))
+            raw_conn.commit()
+        except Exception:
+            raw_conn.rollback()
+            raise
+        finally:
+            raw_conn.close()
+        logger.info(
+            f"[OK] {alvo}: {linhas} linhas ({rejeitadas} com valores rejeitados) em {time.time() - inicio:.2f}s"
+        )
+        return linhas, rejeitadas
+
+    def process_tables(self):
+        ensure_rejects(self.engine, self.schema)
+        ensure_manifest(self.engine, self.schema)
+        ensure_metrics(self.engine, self.schema)
+        schema_silver = self.load_or_create_schema(self.staging_columns())
+        # Falha de uma tabela não interrompe as outras; o erro é relançado no fim (executar_em_paralelo)
+        return executar_em_paralelo(
+            list(schema_silver.items()), lambda item: self.load_silver(*item),
+            max_workers=self.workers, nome=lambda item: item[0],
+        )
+
+
+# ================= BENCHMARK =================
+def synthetic_staging(linhas, colunas, seed=42):
+    """Tabela staging larga sintética (tudo texto, com nulos) cobrindo todos os tipos inferidos."""
+    rng = np.random.default_rng(seed)
+    datas = pd.Timestamp("2020-01-01") + pd.to_timedelta(rng.integers(0, 2000, linhas), unit="D")
+    geradores = [
+        lambda: rng.integers(0, 2, linhas).astype(str),
+        lambda: rng.integers(-10**6, 10**6, linhas).astype(str),
+        lambda: np.round(rng.normal(100, 50, linhas), 2).astype(str),
+        lambda: datas.strftime("%Y-%m-%d %H:%M:%S").to_numpy(),
+        lambda: datas.strftime("%d/%m/%Y").to_numpy(),
+        lambda: np.array([f"{d.day}/{d.month}/{d.year}" for d in datas], dtype=object),
+        lambda: np.char.add("ITEM ", rng.integers(0, 5000, linhas).astype(str)),
+    ]
+    dados = {}
+    for i in range(colunas):
+        valores = pd.Series(geradores[i % len(geradores)](), dtype=object)
+        valores[rng.random(linhas) < 0.05] = None
+        dados[f"col{i:03d}"] = valores
+    return pd.DataFrame(dados)
+
+
+def benchmark(linhas=SAMPLE_LIMIT, colunas=120):
+    df = synthetic_staging(linhas, colunas)
+    inicio = time.perf_counter()
+    tipos = {col: infer_column_type(df[col])["type"] for col in df.columns}
+    total = time.perf_counter() - inicio
+    contagem = pd.Series(tipos).value_counts().to_dict()
+    print(f"{linhas} linhas x {colunas} colunas: {total:.2f}s ({total / colunas * 1000:.1f} ms/coluna) {contagem}")
+    return total
+
+
+if __name__ == "__main__":
+    benchmark(*(int(a) for a in sys.argv[1:3]))
@@ -0,0 +1,98 @@
+"""
+Conversão dos registros da Useall para pyarrow.Table, sem passar por DataFrame de colunas object.
+Usado pelo cliente (buscar_dados), pela raw zone e pelo COPY (useall_loader.ArrowCsvStream).
+"""
+
+import os
+import logging
+
+try:
+    import pyarrow as pa # type: ignore
+    import pyarrow.compute as pc # type: ignore
+except ImportError:  # sem pyarrow: tudo segue pelo caminho pandas
+    pa = None
+
+import pandas as pd # type: ignore
+
+logger = logging.getLogger("useall_pipeline")
+
+ARROW = pa is not None and os.getenv("USEALL_ARROW", "1").lower() in ("1", "true", "sim")
+
+
+def _texto(v):
+    if v is None or (isinstance(v, float) and v != v):
+        return None
+    return str(v)
+
+
+def _coluna_texto(valores):
+    return pa.array([_texto(v) for v in valores], type=pa.string())
+
+
+def registros_para_arrow(registros):
+    """
+    Lista de dicts -> pyarrow.Table. O struct inferido pelo Arrow já une as chaves de todos os registros.
+    Colunas aninhadas (listas/objetos) e registros com tipos misturados caem para texto (str, como no pandas).
+    """
+    if not registros:
+        return pa.table({})
+    try:
+        tabela = pa.Table.from_struct_array(pa.array(registros))
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        colunas = dict.fromkeys(k for r in registros for k in r)
+        return pa.table({c: _coluna_texto(r.get(c) for r in registros) for c in colunas})
+
+    aninhadas = [i for i, f in enumerate(tabela.schema) if pa.types.is_nested(f.type)]
+    for i in aninhadas:
+        tabela = tabela.set_column(i, tabela.field(i).name, _coluna_texto(tabela.column(i).to_pylist()))
+    return tabela
+
+
+def _float_texto(col):
+    """repr do Python, como o to_csv do pandas ("100.0", "1e-05"): o cast do Arrow daria "100" e "0.00001"."""
+    return pa.array([None if v is None else repr(v) for v in col.to_pylist()], type=pa.string())
+
+
+def como_texto(tabela):
+    """
+    Todas as colunas como string (tabelas TEXT da staging e schema estável entre lotes na raw zone),
+    com o mesmo texto do caminho pandas para a inferência da silver dar os mesmos tipos:
+    float sempre com ponto decimal, bool como True/False e inteiro com nulos como float ("1.0",
+    o pandas promove a coluna a float64).
+    """
+    colunas = []
+    for col in tabela.columns:
+        tipo = col.type
+        if pa.types.is_string(tipo) or pa.types.is_large_string(tipo):
+            colunas.append(col)
+        elif pa.types.is_floating(tipo):
+            colunas.append(_float_texto(col))
+        elif pa.types.is_boolean(tipo):
+            colunas.append(pc.if_else(col, "True", "False"))
+        elif pa.types.is_integer(tipo) and col.null_count:
+            colunas.append(pc.binary_join_element_wise(pc.cast(col, pa.string()), ".0", ""))
+        else:
+            try:
+                colunas.append(pc.cast(col, pa.string()))
+            except (pa.ArrowInvalid, pa.ArrowNotImplementedError):
+                colunas.append(_coluna_texto(col.to_pylist()))
+    return pa.table(colunas, names=tabela.column_names)
+
+
+def lote_para_arrow(lote):
+    """DataFrame, lista de dicts, Table ou RecordBatch -> pyarrow.Table."""
+    if isinstance(lote, pa.Table):
+        return lote
+    if isinstance(lote, pa.RecordBatch):
+        return pa.Table.from_batches([lote])
+    if isinstance(lote, pd.DataFrame):
+        if all(isinstance(t, pd.ArrowDtype) for t in lote.dtypes):
+            return pa.Table.from_pandas(lote, preserve_index=False)
+        return pa.table({str(c): _coluna_texto(lote[c]) if lote[c].dtype == object else pa.array(lote[c])
+                         for c in lote.columns})
+    return registros_para_arrow(lote)
+
+
+def para_pandas(tabela):
+    """DataFrame com dtype_backend pyarrow (sem cópia para objetos Python)."""
+    return tabela.to_pandas(types_mapper=pd.ArrowDtype)
@@ -0,0 +1,160 @@
+"""
+dim_calendario gerada por generate_series num intervalo fixo (sem lacunas), com os feriados nacionais
+de dim_feriados. Só é estendida quando o intervalo cresce; não lê as tabelas de fatos.
+"""
+
+import os
+import logging
+from datetime import date, timedelta
+
+from sqlalchemy import text # type: ignore
+
+logger = logging.getLogger("useall_pipeline")
+
+CALENDARIO_TABLE = "dim_calendario"
+FERIADOS_TABLE = "dim_feriados"
+
+# Intervalo: de USEALL_CALENDARIO_INICIO até 31/12 de (ano atual + USEALL_CALENDARIO_ANOS_FUTUROS).
+# O calendário cobre os dados, não os limita: o início deve ficar antes da DATA mais antiga extraída
+# (requisições desde 01/01/2010, ver filtros_req). A extração não lê esta constante.
+CALENDARIO_INICIO = os.getenv("USEALL_CALENDARIO_INICIO", "2010-01-01")
+CALENDARIO_ANOS_FUTUROS = int(os.getenv("USEALL_CALENDARIO_ANOS_FUTUROS", "2"))
+
+_FIXOS = [
+    (1, 1, "Confraternização Universal"),
+    (4, 21, "Tiradentes"),
+    (5, 1, "Dia do Trabalho"),
+    (9, 7, "Independência do Brasil"),
+    (10, 12, "Nossa Senhora Aparecida"),
+    (11, 2, "Finados"),
+    (11, 15, "Proclamação da República"),
+    (12, 25, "Natal"),
+]
+
+# Deslocamentos a partir do domingo de Páscoa
+_MOVEIS = [
+    (-48, "Carnaval"),
+    (-47, "Carnaval"),
+    (-2, "Sexta-feira Santa"),
+    (60, "Corpus Christi"),
+]
+
+
+# ================= FERIADOS =================
+
+def pascoa(ano):
+    """Domingo de Páscoa (algoritmo de Meeus/Jones/Butcher, calendário gregoriano)."""
+    a, b, c = ano % 19, ano // 100, ano % 100
+    d, e = b // 4, b % 4
+    f = (b + 8) // 25
+    g = (b - f + 1) // 3
+    h = (19 * a + b - d - g + 15) % 30
+    i, k = c // 4, c % 4
+    dd = (32 + 2 * e + 2 * i - h - k) % 7
+    m = (a + 11 * h + 22 * dd) // 451
+    mes = (h + dd - 7 * m + 114) // 31
+    dia = (h + dd - 7 * m + 114) % 31 + 1
+    return date(ano, mes, dia)
+
+
+def feriados_nacionais(ano):
+    """[(data, nome)] dos feriados nacionais e pontos facultativos de Carnaval/Corpus Christi."""
+    feriados = [(date(ano, m, d), nome) for m, d, nome in _FIXOS]
+    if ano >= 2024:  # Lei 14.759/2023
+        feriados.append((date(ano, 11, 20), "Dia Nacional de Zumbi e da Consciência Negra"))
+    domingo = pascoa(ano)
+    feriados += [(domingo + timedelta(days=n), nome) for n, nome in _MOVEIS]
+    return sorted(feriados)
+
+
+# ================= CALENDÁRIO =================
+
+def intervalo_calendario(hoje=None):
+    hoje = hoje or date.today()
+    return date.fromisoformat(CALENDARIO_INICIO), date(hoje.year + CALENDARIO_ANOS_FUTUROS, 12, 31)
+
+
+def _sql_tabelas(schema):
+    return f"""
+        CREATE TABLE IF NOT EXISTS {schema}.{FERIADOS_TABLE} (
+            data DATE PRIMARY KEY,
+            nome TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS {schema}.{CALENDARIO_TABLE} (
+            data DATE PRIMARY KEY, ano INT, mes INT, dia INT, ano_mes TEXT, ano_mes_atual TEXT, ano_mes_ordem INT,
+            nome_mes TEXT, nome_mes_abrev TEXT, nome_dia TEXT, nome_dia_abrev TEXT, dia_semana INT, semana_iso INT,
+            ano_iso INT, trimestre INT, dia_mes_abr TEXT, is_fim_de_semana BOOLEAN, is_feriado BOOLEAN, nome_feriado TEXT
+        );
+        CREATE INDEX IF NOT EXISTS idx_dim_calendario_ano_mes_ordem ON {schema}.{CALENDARIO_TABLE} (ano_mes_ordem);
+    """
+
+
+def _ano_mes_atual(col):
+    return f"CASE WHEN date_trunc('month', {col}) = date_trunc('month', CURRENT_DATE) THEN 'Mês Atual' ELSE TO_CHAR({col}, 'YYYY/MM') END"
+
+
+def _sql_gerar(schema):
+    """Insere os dias de :inicio a :fim que ainda não existem (generate_series, feriados por LEFT JOIN)."""
+    return f"""
+        INSERT INTO {schema}.{CALENDARIO_TABLE} (data, ano, mes, dia, ano_mes, ano_mes_atual, ano_mes_ordem, nome_mes,
+            nome_mes_abrev, nome_dia, nome_dia_abrev, dia_semana, semana_iso, ano_iso, trimestre, dia_mes_abr,
+            is_fim_de_semana, is_feriado, nome_feriado)
+        SELECT
+            d::date, EXTRACT(YEAR FROM d)::int, EXTRACT(MONTH FROM d)::int, EXTRACT(DAY FROM d)::int,
+            TO_CHAR(d, 'YYYY/MM'), {_ano_mes_atual('d')}, (EXTRACT(YEAR FROM d) * 100 + EXTRACT(MONTH FROM d))::int,
+            (ARRAY['Janeiro','Fevereiro','Março','Abril','Maio','Junho','Julho','Agosto','Setembro','Outubro','Novembro','Dezembro'])[EXTRACT(MONTH FROM d)::int],
+            (ARRAY['Jan','Fev','Mar','Abr','Mai','Jun','Jul','Ago','Set','Out','Nov','Dez'])[EXTRACT(MONTH FROM d)::int],
+            (ARRAY['Segunda-feira','Terça-feira','Quarta-feira','Quinta-feira','Sexta-feira','Sábado','Domingo'])[EXTRACT(ISODOW FROM d)::int],
+            (ARRAY['Seg','Ter','Qua','Qui','Sex','Sáb','Dom'])[EXTRACT(ISODOW FROM d)::int],
+            EXTRACT(ISODOW FROM d)::int, EXTRACT(WEEK FROM d)::int, EXTRACT(ISOYEAR FROM d)::int,
+            EXTRACT(QUARTER FROM d)::int, TO_CHAR(d, 'DD/MM'), EXTRACT(ISODOW FROM d) IN (6, 7),
+            f.data IS NOT NULL, f.nome
+        FROM generate_series(CAST(:inicio AS date), CAST(:fim AS date), interval '1 day') AS d
+        LEFT JOIN {schema}.{FERIADOS_TABLE} f ON f.data = d::date
+        ON CONFLICT (data) DO NOTHING
+    """
+
+
+def atualizar_calendario(engine, schema, hoje=None):
+    """
+    Garante dim_calendario contínua de CALENDARIO_INICIO até o fim do intervalo, com os feriados de dim_feriados.
+    Se já cobre o intervalo sem lacunas (checagem pela PK), só confere feriados e acerta o "Mês Atual";
+    senão gera os dias que faltam.
+    """
+    inicio, fim = intervalo_calendario(hoje)
+    with engine.begin() as conn:
+        conn.execute(text(_sql_tabelas(schema)))
+        minimo, maximo, dias = conn.execute(text(
+            f"SELECT MIN(data), MAX(data), COUNT(*) FROM {schema}.{CALENDARIO_TABLE}"
+        )).one()
+        completo = minimo is not None and minimo <= inicio and maximo >= fim and dias == (maximo - minimo).days + 1
+
+        # Feriados sempre conferidos (poucas centenas de linhas): o calendário pode ter sido gerado sem eles
+        # (sql/dim_calendario.sql antigo, dim_feriados vazia) e estar completo mesmo assim
+        anos = range(min(inicio, minimo or inicio).year, max(fim, maximo or fim).year + 1)
+        feriados = [{"data": d, "nome": n} for ano in anos for d, n in feriados_nacionais(ano)]
+        # DO NOTHING: feriados cadastrados à mão (estaduais, municipais) prevalecem
+        conn.execute(text(
+            f"INSERT INTO {schema}.{FERIADOS_TABLE} (data, nome) VALUES (:data, :nome) ON CONFLICT (data) DO NOTHING"
+        ), feriados)
+
+        if not completo:
+            # Datas já existentes fora do intervalo (calendário antigo) entram no preenchimento de lacunas
+            inicio, fim = min(inicio, minimo or inicio), max(fim, maximo or fim)
+            inseridos = conn.execute(text(_sql_gerar(schema)), {"inicio": inicio, "fim": fim}).rowcount
+            logger.info(f"dim_calendario estendida: {inseridos} dias novos ({inicio} a {fim}).")
+
+        # Dias gerados antes do feriado existir (ou calendário tirado dos fatos, que vinha sem feriado)
+        marcados = conn.execute(text(f"""
+            UPDATE {schema}.{CALENDARIO_TABLE} c SET is_feriado = TRUE, nome_feriado = f.nome
+            FROM {schema}.{FERIADOS_TABLE} f
+            WHERE f.data = c.data AND (c.is_feriado IS NOT TRUE OR c.nome_feriado IS DISTINCT FROM f.nome)
+        """)).rowcount
+        if marcados:
+            logger.info(f"dim_calendario: {marcados} feriados marcados.")
+
+        # ano_mes_atual depende do dia da execução: só as linhas do mês que entrou/saiu mudam
+        conn.execute(text(f"""
+            UPDATE {schema}.{CALENDARIO_TABLE} SET ano_mes_atual = {_ano_mes_atual('data')}
+            WHERE ano_mes_atual IS DISTINCT FROM ({_ano_mes_atual('data')})
+        """))
@@ -0,0 +1,569 @@
+"""
+Cliente HTTP da API Useall.
+Uma única requests.Session com pool de conexões (keep-alive + gzip) compartilhada por todas as extrações,
+em vez de um requests.get avulso (novo handshake TCP+TLS) a cada chamada.
+"""
+
+import os
+import json
+import logging
+from itertools import count
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import urllib3 # type: ignore
+import requests # type: ignore
+import pandas as pd # type: ignore
+from requests.adapters import HTTPAdapter # type: ignore
+
+try:
+    import ijson # type: ignore
+except ImportError:
+    # Sem ijson: cai para response.json() (corpo inteiro em memória)
+    ijson = None
+
+from useall_arrow import ARROW, pa, como_texto, para_pandas, registros_para_arrow
+from useall_metrics import somar, propagar
+from useall_ratelimit import LIMITER
+from useall_split import PerfisExtracao, dividir, bisectar, tamanho, SPLIT_FILIAIS, SPLIT_DIAS
+
+logger = logging.getLogger("useall_pipeline")
+
+POOL_SIZE = int(os.getenv("USEALL_POOL_SIZE", "8"))
+CONNECT_TIMEOUT = float(os.getenv("USEALL_CONNECT_TIMEOUT", "10"))
+READ_TIMEOUT = float(os.getenv("USEALL_READ_TIMEOUT", "500"))
+# Registros por lote no parser incremental
+BATCH_SIZE = int(os.getenv("USEALL_BATCH_SIZE", "50000"))
+# Paginação (pagina/qtderegistros): descoberta por identificação; páginas/partes buscadas em paralelo
+PAGINACAO = os.getenv("USEALL_PAGINACAO", "1").lower() in ("1", "true", "sim")
+PAGE_SIZE = int(os.getenv("USEALL_PAGE_SIZE", "20000"))
+PAGE_WORKERS = int(os.getenv("USEALL_PAGE_WORKERS", "3"))
+# Timeouts seguidos tolerados antes de dividir a consulta (0 = reenviar para sempre, como antes)
+TIMEOUT_TENTATIVAS = int(os.getenv("USEALL_TIMEOUT_TENTATIVAS", "2"))
+
+
+# Falhas lendo o corpo já em stream (o get só vê as que ocorrem até os cabeçalhos)
+ERROS_CORPO = (
+    requests.exceptions.ConnectionError,
+    requests.exceptions.ChunkedEncodingError,
+    urllib3.exceptions.ReadTimeoutError,
+    urllib3.exceptions.ProtocolError,
+)
+
+
+class PaginacaoInconsistente(RuntimeError):
+    """A página 2 repetiu a página 1: a identificação aceita qtderegistros mas ignora pagina."""
+
+
+class ConsultaPesada(RuntimeError):
+    """Timeouts seguidos ou 400/413 de payload pesado: a consulta precisa ser dividida."""
+
+
+class _PrefixedStream:
+    """Devolve os bytes já espiados antes de continuar lendo do socket."""
+
+    def __init__(self, head, raw):
+        self._head = head
+        self._raw = raw
+
+    def read(self, n=-1):
+        if n == 0:
+            return b""
+        if self._head:
+            data, self._head = self._head, b""
+            return data
+        return self._raw.read(n)
+
+
+def iter_registros(raw):
+    """
+    Percorre os registros do corpo JSON direto do socket, sem materializar a resposta.
+    Aceita os dois formatos da Useall: lista no topo ou {"data": [...]}.
+    """
+    head = b""
+    while True:
+        byte = raw.read(1)
+        if not byte:
+            return
+        head += byte
+        if not byte.isspace():
+            break
+
+    prefix = "data.item" if byte == b"{" else "item"
+    yield from ijson.items(_PrefixedStream(head, raw), prefix, use_float=True)
+
+
+class UseallClient:
+    def __init__(self, base_url, headers, limiter=LIMITER, pool_size=POOL_SIZE,
+                 connect_timeout=CONNECT_TIMEOUT, read_timeout=READ_TIMEOUT, perfis=None,
+                 page_size=PAGE_SIZE, page_workers=PAGE_WORKERS):
+        self.base_url = base_url
+        self.limiter = limiter
+        self.timeout = (connect_timeout, read_timeout)
+        self.perfis = perfis or PerfisExtracao()
+        self.page_size = page_size
+        self.page_workers = page_workers
+
+        self.session = requests.Session()
+        # Retentativas ficam com o limitador; o adapter só cuida do pool
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=0, pool_block=True)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.session.headers.update(headers)
+        self.session.headers.update({"Accept-Encoding": "gzip, deflate", "Connection": "keep-alive"})
+
+    def get(self, params, stream=False, tentativas_timeout=TIMEOUT_TENTATIVAS):
+        """
+        GET com limitador global: reenvia em 429 e timeout de leitura/conexão.
+        Após tentativas_timeout timeouts seguidos, ou em 400/413 de payload pesado, levanta ConsultaPesada.
+        """
+        tentativa = 0
+        while True:
+            try:
+                self.limiter.acquire()
+                response = self.session.get(self.base_url, params=params, timeout=self.timeout, stream=stream)
+            except requests.exceptions.Timeout:
+                tentativa += 1
+                somar(requisicoes=1, retentativas=1)
+                if tentativas_timeout and tentativa >= tentativas_timeout:
+                    raise ConsultaPesada(f"{tentativa} timeouts seguidos")
+                self.limiter.on_timeout(tentativa)
+                continue
+
+            self.limiter.on_response(response)
+            # elapsed: do envio até os cabeçalhos (o corpo em stream entra no tempo da identificação)
+            somar(requisicoes=1, latencia_api_s=response.elapsed.total_seconds())
+            if response.status_code == 429:
+                somar(http_429=1, retentativas=1)
+                continue
+            if response.status_code == 413 or (response.status_code == 400 and "pesad" in response.text.lower()):
+                response.close()
+                raise ConsultaPesada(f"{response.status_code} payload pesado")
+            response.raise_for_status()
+            return response
+
+    def _params(self, identificacao, backend_filters=None, extra_params=None, pagina=None):
+        query_params = {"Identificacao": identificacao}
+
+        if backend_filters:
+            query_params["FiltrosSqlQuery"] = json.dumps(backend_filters, ensure_ascii=False)
+        if extra_params:
+            query_params.update(extra_params)
+        if pagina is not None:
+            query_params.update({"pagina": pagina, "qtderegistros": self.page_size})
+        return query_params
+
+    def _stream(self, query_params, nome_arquivo, batch_size=BATCH_SIZE, tentativas_timeout=TIMEOUT_TENTATIVAS):
+        """
+        Uma requisição: gera lotes de até batch_size registros conforme chegam do socket.
+        Timeout ou conexão caída no meio do corpo: descarta o lote parcial e reenvia como um timeout do get
+        (limitador, e ConsultaPesada após tentativas_timeout seguidas), pulando os registros já entregues.
+        """
+        entregues, ultimo, tentativa = 0, None, 0
+        while True:
+            try:
+                response = self.get(query_params, stream=True, tentativas_timeout=tentativas_timeout)
+            except ConsultaPesada:
+                raise
+            except Exception as e:
+                logger.error(f"Erro em {nome_arquivo}: {e}")
+                raise
+
+            pular = entregues
+            try:
+                with response:
+                    try:
+                        if ijson is None:
+                            data = response.json()
+                            registros = (data.get("data") if isinstance(data, dict) else data) or []
+                        else:
+                            response.raw.decode_content = True  # gzip
+                            registros = iter_registros(response.raw)
+
+                        lote = []
+                        for registro in registros:
+                            if pular:
+                                # Reenvio: os primeiros já foram entregues; o último deles confere a ordem
+                                pular -= 1
+                                if not pular and registro != ultimo:
+                                    raise ConsultaPesada(f"{nome_arquivo}: resposta mudou entre as tentativas")
+                                continue
+                            lote.append(registro)
+                            if len(lote) >= batch_size:
+                                entregues, ultimo = entregues + len(lote), lote[-1]
+                                yield lote
+                                lote = []
+                        if pular:
+                            raise ConsultaPesada(f"{nome_arquivo}: resposta mudou entre as tentativas")
+                        if lote:
+                            entregues, ultimo = entregues + len(lote), lote[-1]
+                            yield lote
+                        return
+                    finally:
+                        # Bytes lidos do socket (comprimidos, com gzip; só desta tentativa)
+                        somar(bytes=response.raw.tell())
+            except ERROS_CORPO as e:
+                tentativa += 1
+                somar(retentativas=1)
+                if tentativas_timeout and tentativa >= tentativas_timeout:
+                    raise ConsultaPesada(f"{tentativa} falhas seguidas lendo a resposta ({type(e).__name__})") from e
+                logger.warning(f"{nome_arquivo}: {type(e).__name__} no meio da resposta. Reenviando.")
+                self.limiter.on_timeout(tentativa)
+
+    def _registros(self, query_params, nome_arquivo):
+        return [r for lote in self._stream(query_params, nome_arquivo) for r in lote]
+
+    def _em_paralelo(self, itens, buscar):
+        """buscar(item) para cada item, até page_workers em voo (o limitador segue global), na ordem dos itens."""
+        itens = iter(itens)
+        with ThreadPoolExecutor(max_workers=self.page_workers) as pool:
+            buscar = propagar(buscar)
+            voando = deque(pool.submit(buscar, i) for _, i in zip(range(self.page_workers), itens))
+            while voando:
+                resultado = voando.popleft().result()
+                proximo = next(itens, None)
+                if proximo is not None:
+                    voando.append(pool.submit(buscar, proximo))
+                yield resultado
+
+    @staticmethod
+    def _fatiar(registros, batch_size):
+        for i in range(0, len(registros), batch_size):
+            yield registros[i:i + batch_size]
+
+    def iter_batches(self, identificacao, nome_arquivo, backend_filters=None, extra_params=None, batch_size=BATCH_SIZE):
+        """
+        Gera lotes (listas de dicts) de até batch_size registros.
+        Com USEALL_PAGINACAO, pede página a página (pagina/qtderegistros) se a identificação paginar;
+        se não paginar, divide a consulta por IDFILIAL ou DATA (useall_split). O perfil descoberto
+        fica em self.perfis.
+        """
+        logger.info(f"Extraindo: {nome_arquivo}...")
+        if not PAGINACAO:
+            yield from self._stream(self._params(identificacao, backend_filters, extra_params), nome_arquivo, batch_size)
+            return
+
+        perfil = self.perfis.get(identificacao)
+        # Sem paginação, ou já dividida por ConsultaPesada numa execução anterior: vai direto às partes
+        if perfil.get("paginavel") is False or perfil.get("filiais_por_parte") or perfil.get("dias_por_parte"):
+            yield from self._iter_partes(identificacao, nome_arquivo, backend_filters, extra_params, batch_size, perfil)
+        else:
+            yield from self._iter_paginas(identificacao, nome_arquivo, backend_filters, extra_params, batch_size, perfil)
+
+    def _iter_paginas(self, identificacao, nome_arquivo, backend_filters, extra_params, batch_size, perfil):
+        """
+        A página 1 vai em stream. Mais de qtderegistros registros = a identificação ignora a paginação
+        e a resposta já é o relatório inteiro. Página cheia = busca as seguintes em paralelo até uma vir incompleta.
+        """
+        def params(pagina):
+            return self._params(identificacao, backend_filters, extra_params, pagina=pagina)
+
+        recebidos, primeiro = 0, None
+        try:
+            for lote in self._stream(params(1), nome_arquivo, batch_size):
+                primeiro = lote[0] if primeiro is None else primeiro
+                recebidos += len(lote)
+                yield lote
+        except ConsultaPesada as e:
+            if recebidos:
+                raise
+            # Nem a primeira página saiu: divide a consulta (e o perfil guarda o tamanho que funcionou)
+            yield from self._iter_partes(identificacao, nome_arquivo, backend_filters, extra_params, batch_size, perfil, e)
+            return
+
+        if recebidos > self.page_size:
+            self.perfis.atualizar(identificacao, paginavel=False)
+            return
+        if recebidos < self.page_size:
+            return
+
+        def buscar(pagina):
+            return self._registros(params(pagina), f"{nome_arquivo} (página {pagina})")
+
+        for pagina, registros in zip(count(2), self._em_paralelo(count(2), buscar)):
+            if pagina == 2 and not perfil.get("paginavel"):
+                if registros and registros[0] == primeiro:
+                    self.perfis.atualizar(identificacao, paginavel=False)
+                    raise PaginacaoInconsistente(f"{nome_arquivo}: {identificacao} ignora 'pagina'. Próxima execução divide a consulta.")
+                self.perfis.atualizar(identificacao, paginavel=True, tamanho_pagina=self.page_size)
+            yield from self._fatiar(registros, batch_size)
+            if len(registros) < self.page_size:
+                return
+
+    def _iter_partes(self, identificacao, nome_arquivo, backend_filters, extra_params, batch_size, perfil, falha=None):
+        """
+        Consulta dividida por IDFILIAL/DATA: partes em paralelo e na ordem, cada uma lida por completo
+        (_buscar_parte) e bisseccionada se for pesada demais. falha = ConsultaPesada da consulta inteira.
+        Sem paginação confirmada (paginavel False) as partes vão sem pagina/qtderegistros.
+        """
+        paginar = perfil.get("paginavel") is not False
+        partes = dividir(backend_filters or [], perfil.get("filiais_por_parte", SPLIT_FILIAIS),
+                         perfil.get("dias_por_parte", SPLIT_DIAS))
+        if len(partes) == 1 and falha is not None:
+            yield from self._fatiar(self._bisseccionar(identificacao, nome_arquivo, partes[0], extra_params, falha, paginar), batch_size)
+            return
+        if len(partes) == 1 and not paginar:
+            recebidos = 0
+            try:
+                for lote in self._stream(self._params(identificacao, backend_filters, extra_params), nome_arquivo, batch_size):
+                    recebidos += len(lote)
+                    yield lote
+            except ConsultaPesada as e:
+                if recebidos:
+                    raise
+                yield from self._fatiar(self._bisseccionar(identificacao, nome_arquivo, partes[0], extra_params, e, paginar), batch_size)
+            return
+
+        if len(partes) > 1:
+            logger.info(f"{nome_arquivo}: dividido em {len(partes)} partes.")
+
+        def buscar(parte):
+            n, filtros = parte
+            return self._buscar_dividindo(identificacao, f"{nome_arquivo} (parte {n}/{len(partes)})", filtros, extra_params, paginar)
+
+        for registros in self._em_paralelo(enumerate(partes, 1), buscar):
+            yield from self._fatiar(registros, batch_size)
+
+    def _buscar_parte(self, identificacao, nome_arquivo, filtros, extra_params, paginar):
+        """
+        Todos os registros de uma parte. Com paginar, página a página até uma vir incompleta;
+        sem paginar, uma requisição sem pagina/qtderegistros (nenhum teto de page_size).
+        """
+        if not paginar:
+            return self._registros(self._params(identificacao, filtros, extra_params), nome_arquivo)
+
+        registros = []
+        for pagina in count(1):
+            atual = self._registros(self._params(identificacao, filtros, extra_params, pagina=pagina),
+                                    f"{nome_arquivo} (página {pagina})")
+            if pagina == 1 and len(atual) > self.page_size:
+                # Ignora a paginação por completo: a resposta já é a parte inteira
+                self.perfis.atualizar(identificacao, paginavel=False)
+                return atual
+            if pagina == 2 and atual and atual[0] == registros[0]:
+                self.perfis.atualizar(identificacao, paginavel=False)
+                raise PaginacaoInconsistente(f"{nome_arquivo}: {identificacao} ignora 'pagina'. Próxima execução divide sem paginar.")
+            registros.extend(atual)
+            if len(atual) < self.page_size:
+                return registros
+
+    def _buscar_dividindo(self, identificacao, nome_arquivo, filtros, extra_params, paginar):
+        """Busca a parte inteira; se vier ConsultaPesada, divide ao meio e tenta de novo (recursivo)."""
+        try:
+            return self._buscar_parte(identificacao, nome_arquivo, filtros, extra_params, paginar)
+        except ConsultaPesada as e:
+            return self._bisseccionar(identificacao, nome_arquivo, filtros, extra_params, e, paginar)
+
+    def _bisseccionar(self, identificacao, nome_arquivo, filtros, extra_params, erro, paginar):
+        """
+        Divide a consulta ao meio e busca as metades em paralelo; o perfil guarda a maior metade.
+        Timeout/payload pesado diz só o tamanho da parte: a paginação descoberta (paginavel) não muda.
+        """
+        divisao = bisectar(filtros)
+        if divisao is None:
+            logger.error(f"{nome_arquivo}: {erro} e a consulta não tem como ser dividida.")
+            raise erro
+        campo, metades = divisao
+        logger.warning(f"{nome_arquivo}: {erro}. Dividindo ao meio por {campo.split('_')[0]}.")
+
+        # As próximas execuções já começam desse tamanho (metades que falharem reduzem de novo)
+        maior = max(tamanho(m, campo) for m in metades)
+        atual = self.perfis.get(identificacao).get(campo, SPLIT_FILIAIS if campo == "filiais_por_parte" else SPLIT_DIAS)
+        if not atual or maior < atual:
+            self.perfis.atualizar(identificacao, **{campo: maior})
+
+        with ThreadPoolExecutor(max_workers=2) as pool:
+            resultados = list(pool.map(
+                propagar(lambda m: self._buscar_dividindo(identificacao, f"{nome_arquivo} [{m[0]}/2]", m[1], extra_params, paginar)),
+                enumerate(metades, 1),
+            ))
+        return resultados[0] + resultados[1]
+
+    def buscar_dados(self, identificacao, nome_arquivo, backend_filters=None, extra_params=None, batch_size=BATCH_SIZE):
+        """
+        Busca um relatório da Useall e retorna um DataFrame (vazio se não houver registros).
+        Com USEALL_ARROW, os lotes viram Tables de strings e o DataFrame usa dtypes pyarrow
+        (sem colunas object; o COPY reaproveita os buffers).
+        """
+        if ARROW:
+            tabelas = [
+                como_texto(registros_para_arrow(lote))
+                for lote in self.iter_batches(identificacao, nome_arquivo, backend_filters, extra_params, batch_size)
+            ]
+            if not tabelas:
+                return pd.DataFrame()
+            return para_pandas(pa.concat_tables(tabelas, promote_options="default"))
+
+        frames = [
+            pd.DataFrame(lote)
+            for lote in self.iter_batches(identificacao, nome_arquivo, backend_filters, extra_params, batch_size)
+        ]
+        if not frames:
+            return pd.DataFrame()
+        if len(frames) == 1:
+            return frames[0]
+        return pd.concat(frames, ignore_index=True)
+
+    def close(self):
+        self.session.close()
+
+
+# ================= BENCHMARK =================
+
+class _Stub:
+    """Servidor HTTP(S) local com keep-alive que devolve um JSON fixo (sem rede e sem a API)."""
+
+    def __init__(self, corpo, tls=True):
+        import ssl
+        import shutil
+        import tempfile
+        import threading
+        import subprocess
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            disable_nagle_algorithm = True  # cabeçalho e corpo saem em writes separados (evita o delayed ACK)
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(corpo)))
+                self.end_headers()
+                self.wfile.write(corpo)
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.cert = None
+        # Com openssl, HTTPS com certificado autoassinado: o handshake TLS é o que o pool economiza
+        if tls and shutil.which("openssl"):
+            self._dir = tempfile.mkdtemp()
+            self.cert, chave = os.path.join(self._dir, "cert.pem"), os.path.join(self._dir, "chave.pem")
+            subprocess.run(["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1",
+                            "-subj", "/CN=127.0.0.1", "-addext", "subjectAltName=IP:127.0.0.1",
+                            "-keyout", chave, "-out", self.cert], check=True, capture_output=True)
+            contexto = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+            contexto.load_cert_chain(self.cert, chave)
+            self.server.socket = contexto.wrap_socket(self.server.socket, server_side=True)
+        esquema = "https" if self.cert else "http"
+        self.url = f"{esquema}://127.0.0.1:{self.server.server_port}/"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def benchmark_pool(chamadas=200, registros=100):
+    """
+    requests.get avulso (handshake TCP+TLS a cada chamada, como o buscar_dados_api antigo) x UseallClient
+    (Session com pool keep-alive), contra um stub local, em série como as extrações do estoque diário.
+    """
+    import time
+    from useall_ratelimit import RateLimiter
+
+    corpo = json.dumps([{"IDITEM": i, "DESCRICAO": f"ITEM {i}"} for i in range(registros)]).encode()
+    stub = _Stub(corpo)
+    verify = stub.cert or True
+    params = {"Identificacao": "benchmark"}
+    try:
+        def avulso():
+            for _ in range(chamadas):
+                requests.get(stub.url, params=params, timeout=(CONNECT_TIMEOUT, READ_TIMEOUT), verify=verify).json()
+
+        cliente = UseallClient(stub.url, {}, limiter=RateLimiter(rate=1e9, burst=10**9))
+        # Sem trust_env: REQUESTS_CA_BUNDLE/proxies do ambiente substituiriam o verify do stub
+        cliente.session.trust_env = False
+        cliente.session.verify = verify
+
+        def pool():
+            for _ in range(chamadas):
+                cliente.get(params).json()
+
+        resultados = {}
+        for nome, func in [("avulso", avulso), ("pool", pool)]:
+            func()  # aquecimento (imports, primeira conexão do pool)
+            inicio = time.perf_counter()
+            func()
+            resultados[nome] = time.perf_counter() - inicio
+            print(f"{nome:>6}: {chamadas} chamadas em {resultados[nome]:6.2f}s  "
+                  f"{resultados[nome] / chamadas * 1000:6.2f} ms/chamada")
+        print(f"{'HTTPS' if stub.cert else 'HTTP'} local: pool {resultados['avulso'] / resultados['pool']:.1f}x mais rápido")
+        cliente.close()
+    finally:
+        stub.close()
+    return resultados
+
+
+def _gravar_corpo(caminho, registros):
+    """Corpo no formato da Useall ({"data": [...]}) com registros parecidos com os de estoque, gravado aos poucos."""
+    with open(caminho, "wb") as f:
+        f.write(b'{"data": [')
+        for i in range(registros):
+            f.write((b"," if i else b"") + json.dumps({
+                "IDITEM": i, "IDFILIAL": i % 40, "CODIGO": f"{i:08d}", "DESCRICAO": f"ITEM DE ESTOQUE {i}",
+                "QUANTIDADE": i % 997 * 1.5, "CUSTOMEDIO": i % 313 / 7, "ATIVO": i % 3 != 0,
+                "DATAHORAALT": f"2024-{i % 12 + 1:02d}-{i % 28 + 1:02d}T10:00:00",
+            }).encode())
+        f.write(b"]}")
+
+
+def _medir_memoria(modo, caminho, batch_size):
+    """Roda num processo novo: pico do tracemalloc e ru_maxrss (só cresce, por isso um processo por modo)."""
+    import resource
+    import tracemalloc
+
+    rss_antes = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    tracemalloc.start()
+    linhas = 0
+    with open(caminho, "rb") as f:  # o arquivo faz o papel do socket
+        if modo == "stream":
+            lote = []
+            for registro in iter_registros(f):
+                lote.append(registro)
+                if len(lote) >= batch_size:
+                    linhas += len(pd.DataFrame(lote))
+                    lote = []
+            if lote:
+                linhas += len(pd.DataFrame(lote))
+        else:
+            # Caminho antigo: response.json() com a resposta inteira e um DataFrame único
+            linhas = len(pd.DataFrame(json.loads(f.read())["data"]))
+    pico = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss_antes  # KiB no Linux
+    return linhas, pico, rss * 1024
+
+
+def benchmark_memoria(registros=1_000_000, batch_size=BATCH_SIZE):
+    """Pico de memória: corpo de `registros` lido em streaming (ijson, lotes de batch_size) x json.loads."""
+    import tempfile
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+
+    if ijson is None:
+        print("ijson não instalado: sem streaming para comparar.")
+        return None
+    resultados = {}
+    with tempfile.TemporaryDirectory() as pasta:
+        caminho = os.path.join(pasta, "corpo.json")
+        _gravar_corpo(caminho, registros)
+        print(f"corpo: {registros} registros, {os.path.getsize(caminho) / 2**20:.0f} MiB")
+        for modo in ("stream", "json.loads"):
+            with ProcessPoolExecutor(1, mp_context=multiprocessing.get_context("spawn")) as pool:
+                linhas, pico, rss = pool.submit(_medir_memoria, modo, caminho, batch_size).result()
+            resultados[modo] = (pico, rss)
+            print(f"{modo:>10}: {linhas} linhas  pico tracemalloc {pico / 2**20:8.1f} MiB  RSS +{rss / 2**20:8.1f} MiB")
+    print(f"streaming usa {resultados['json.loads'][0] / resultados['stream'][0]:.1f}x menos memória (tracemalloc)")
+    return resultados
+
+
+if __name__ == "__main__":
+    # python useall_client.py [pool [chamadas] [registros]] | memoria [registros] [batch_size]
+    import sys
+    if len(sys.argv) > 1 and sys.argv[1] == "memoria":
+        benchmark_memoria(*(int(a) for a in sys.argv[2:4]))
+    else:
+        benchmark_pool(*(int(a) for a in sys.argv[1 + (sys.argv[1:2] == ["pool"]):][:2]))
@@ -0,0 +1,98 @@
+"""
+Execução concorrente das extrações da API Useall (e dos builds da camada gold).
+"""
+
+import os
+import time
+import logging
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+from useall_metrics import propagar
+
+logger = logging.getLogger("useall_pipeline")
+
+# Quantidade de extrações simultâneas (o limite de requisições continua global, ver useall_ratelimit)
+MAX_WORKERS = int(os.getenv("USEALL_MAX_WORKERS", "4"))
+
+
+def executar_em_paralelo(tarefas, func, max_workers=MAX_WORKERS, nome=lambda t: t["nome"]):
+    """
+    Executa func(tarefa) para cada tarefa em um pool limitado de threads.
+    Loga a latência de cada tarefa e relança o primeiro erro após todas terminarem.
+    Retorna {nome: resultado}.
+    """
+    return executar_dag(tarefas, func, {}, max_workers=max_workers, nome=nome)
+
+
+def executar_dag(tarefas, func, dependencias, max_workers=MAX_WORKERS, nome=lambda t: t["nome"]):
+    """
+    Como executar_em_paralelo, mas cada tarefa só começa quando as tarefas de que depende terminaram.
+    dependencias: {nome: conjunto de nomes}; nomes fora de `tarefas` são ignorados.
+    Após a primeira falha nada novo é disparado; as que já estão rodando terminam e o erro é relançado.
+    """
+    por_nome = {nome(t): t for t in tarefas}
+    faltam = {n: set(dependencias.get(n, ())) & por_nome.keys() for n in por_nome}
+    resultados, erros, latencias = {}, {}, {}
+
+    # Tarefas rodam no escopo de métricas de quem chamou (ver useall_metrics.medir)
+    @propagar
+    def _medir(n):
+        inicio = time.time()
+        try:
+            return func(por_nome[n])
+        finally:
+            latencias[n] = time.time() - inicio
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        rodando = {}
+
+        def _disparar():
+            for n in [n for n, d in faltam.items() if not d]:
+                del faltam[n]
+                rodando[pool.submit(_medir, n)] = n
+
+        _disparar()
+        while rodando:
+            feitos, _ = wait(rodando, return_when=FIRST_COMPLETED)
+            for fut in feitos:
+                n = rodando.pop(fut)
+                try:
+                    resultados[n] = fut.result()
+                    logger.info(f"[{n}] concluída em {latencias[n]:.2f}s")
+                except Exception as e:
+                    erros[n] = e
+                    logger.error(f"[{n}] falhou após {latencias.get(n, 0):.2f}s: {e}")
+                    continue
+                for d in faltam.values():
+                    d.discard(n)
+            if not erros:
+                _disparar()
+
+    if latencias:
+        lenta = max(latencias, key=latencias.get)
+        resumo = (
+            f"{len(tarefas)} tarefas com {max_workers} workers | "
+            f"soma {sum(latencias.values()):.2f}s | mais lenta: {lenta} ({latencias[lenta]:.2f}s)"
+        )
+        if dependencias:
+            resumo += f" | caminho crítico {_caminho_critico(latencias, dependencias):.2f}s"
+        logger.info(resumo)
+
+    if erros:
+        raise next(iter(erros.values()))
+    if faltam:
+        raise ValueError(f"Dependência circular ou inexistente entre: {sorted(faltam)}")
+    return resultados
+
+
+def _caminho_critico(latencias, dependencias):
+    """Maior soma de latências ao longo de uma cadeia de dependências (o piso do tempo total)."""
+    memo = {}
+
+    def _fim(n):
+        if n not in memo:
+            antes = [_fim(d) for d in dependencias.get(n, ()) if d in latencias]
+            memo[n] = latencias[n] + max(antes, default=0)
+        return memo[n]
+
+    return max(_fim(n) for n in latencias)
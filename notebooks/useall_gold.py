@@ -0,0 +1,682 @@
+"""
+Camada Gold: declaração das tabelas/views e materialização.
+Cada tabela gold é um SELECT sobre a silver, publicado de um de dois jeitos (USEALL_GOLD_MODO):
+- swap (padrão): constrói gold_x__next em sessão própria, indexa, ANALYZE e troca por RENAME.
+  O ACCESS EXCLUSIVE fica só no rename (milissegundos), não na reconstrução inteira.
+  Os builds rodam em paralelo respeitando as dependências entre golds (useall_extract.executar_dag);
+- merge: aplica por chave natural (useall_merge) em uma única transação.
+Golds com "particao" são incrementais nos dois modos: só as datas tocadas desde o último build
+são apagadas e reinseridas (DELETE + INSERT na tabela viva, sem swap).
+Índices declarados (chave + "indices"/GOLD_INDICES) e ANALYZE acompanham cada carga; no fim,
+um EXPLAIN dos SELECTs com JOIN aponta golds que caíram em nested loop sobre varredura sequencial.
+"""
+
+import os
+import re
+import json
+import time
+import logging
+from datetime import date, timedelta
+
+from useall_merge import merge_select, colunas_tabela, tabela_existe, sincronizar_colunas
+from useall_extract import executar_dag
+from useall_manifest import MANIFEST_TABLE
+from useall_metrics import medir
+from sqlalchemy import text # type: ignore
+
+logger = logging.getLogger("useall_pipeline")
+
+GOLD_MODO = os.getenv("USEALL_GOLD_MODO", "swap").lower()
+# Espera máxima pelo lock do rename (ex.: refresh do Power BI lendo a tabela) antes de tentar de novo
+SWAP_LOCK_TIMEOUT = os.getenv("USEALL_SWAP_LOCK_TIMEOUT", "5s")
+SWAP_TENTATIVAS = 5
+# Builds gold simultâneos (cada um segura uma conexão do pool do engine)
+GOLD_WORKERS = int(os.getenv("USEALL_GOLD_WORKERS", "4"))
+# Fila de chaves tocadas pelas extrações, consumida pelas golds com "particao": {"pendentes": True}
+PENDENTES_TABLE = "gold_pendentes"
+
+# Definição original (janela sobre toda a gold_custos) da vw_ultimos_custos: base da conferência
+ULTIMOS_CUSTOS_JANELA = """SELECT * FROM (SELECT gc.*, ROW_NUMBER() OVER (PARTITION BY codigoitem ORDER BY datacusto DESC) AS rn FROM useall.gold_custos gc WHERE ultimocusto <> 0) t WHERE rn = 1"""
+
+
+# Chaves naturais das golds genéricas (cópia direta da silver). Sem chave = TRUNCATE + INSERT.
+GOLD_KEYS = {
+    "gold_itens": ["iditem"],
+    "gold_unidades": ["idunidade"],
+    "gold_segmentos": ["idsegmento"],
+    "gold_cidades": ["idcidade"],
+    "gold_empresas": ["idempresa"],
+    "gold_clientesfornecedores": ["idclifor"],
+    "gold_almoxarifados": ["idalmox"],
+}
+
+# Índices além da chave natural, criados depois da carga (e seguidos de ANALYZE). Coluna com " DESC"
+# vira índice descendente; colunas que a tabela não tiver são ignoradas com aviso.
+GOLD_INDICES = {
+    # vw_ultimos_custos: ROW_NUMBER() OVER (PARTITION BY codigoitem ORDER BY datacusto DESC)
+    "gold_custos": [["codigoitem", "datacusto DESC"]],
+}
+
+# Golds com regra própria. As dependências saem do próprio SQL (ver dependencias_gold);
+# "depende" permite declarar entradas que o parser não enxerga.
+GOLD_STEPS = [
+    # Último custo por item: tabela mantida só para os codigoitem tocados pela extração de custos
+    # (fila gold_pendentes). Mesmo resultado da janela ULTIMOS_CUSTOS_JANELA, sem ordenar a gold_custos inteira.
+    {
+        "nome": "gold_ultimos_custos",
+        "chave": ["codigoitem"],
+        "unico": True,
+        "particao": {"coluna": "codigoitem", "pendentes": True},
+        "sql": """SELECT DISTINCT ON (codigoitem) gc.* FROM useall.gold_custos gc WHERE ultimocusto <> 0 ORDER BY codigoitem, datacusto DESC""",
+    },
+    # View Custos (compatibilidade com o Power BI: mesmas colunas da antiga view com ROW_NUMBER)
+    {
+        "nome": "vw_ultimos_custos",
+        "tipo": "view",
+        "sql": """SELECT *, 1::bigint AS rn FROM useall.gold_ultimos_custos""",
+    },
+    # Gold Filiais
+    {
+        "nome": "gold_filiais",
+        "chave": ["idfilial"],
+        "sql": """SELECT *, CASE WHEN idfilial IN (393, 336, 337, 558, 387) THEN 'RS' WHEN idfilial = 520 THEN 'BA' WHEN idfilial = 404 THEN 'DF' WHEN idfilial IN (342, 343, 381, 389, 334, 335, 339, 333, 341, 578, 390, 379, 344, 345, 346, 338) THEN 'SC' ELSE '*NOVA' END AS uf FROM useall.silver_filiais""",
+    },
+    # Gold Atendimentos (incremental: só as datas de data_atend cuja impressão mudou desde o último build,
+    # inclusive NULL). A extração é um retrato completo sem chave: a impressão por data é o que aponta a mudança.
+    # py_idreqitem/py_iddataitem são colunas de saída; joins usam (idreqmat, iditem) / (iditem, data)
+    {
+        "nome": "gold_atendimentodereq",
+        "chave": None,
+        "particao": {"coluna": "data_atend", "impressao": True},
+        "indices": [["idreqmat", "iditem"]],
+        "sql": """SELECT *, idreqmat::text || '-' || iditem::text AS py_idreqitem, iditem::text || '-' || TO_CHAR(data_atend::date, 'YYYYMMDD') AS py_iddataitem FROM useall.silver_atendimentodereq""",
+    },
+    # Gold Estoque
+    {
+        "nome": "gold_estoque",
+        "chave": None,
+        "indices": [["iditem"], ["idfilial"]],
+        "sql": """SELECT e.*, c.ultimocusto, CASE WHEN e.estoquemin IS NOT NULL AND e.estoquemax IS NOT NULL AND e.estoquemin > e.estoquemax THEN 'PARAMETRO_INVALIDO' WHEN e.saldodisponivel < 0 THEN 'INCONSISTENTE' WHEN e.estoquemin IS NULL OR e.estoquemin = 0 THEN 'SEM_MINIMO' WHEN e.estoquemin > 0 AND e.saldodisponivel = 0 THEN 'RUPTURA' WHEN e.estoquemin > 0 AND e.saldodisponivel > 0 AND e.saldodisponivel < e.estoquemin THEN 'CRITICO' WHEN e.estoquemax IS NOT NULL AND e.saldodisponivel > e.estoquemax THEN 'EXCESSO' WHEN e.saldodisponivel >= e.estoquemin AND (e.estoquemax IS NULL OR e.saldodisponivel <= e.estoquemax) THEN 'ADEQUADO' ELSE 'NAO_CLASSIFICADO' END AS py_status_estoque, CASE WHEN e.estoquemin IS NOT NULL AND e.estoquemax IS NOT NULL AND e.estoquemin > e.estoquemax THEN 0 WHEN e.estoquemin IS NULL OR e.estoquemin = 0 THEN 0 WHEN e.saldodisponivel < e.estoquemin THEN (e.estoquemin - GREATEST(e.saldodisponivel, 0)) * COALESCE(c.ultimocusto, 0) WHEN e.estoquemax IS NOT NULL AND e.saldodisponivel > e.estoquemax THEN -1 * (e.saldodisponivel - e.estoquemax) * COALESCE(c.ultimocusto, 0) ELSE 0 END AS valor_impacto_estoque FROM useall.silver_estoque e LEFT JOIN useall.gold_ultimos_custos c ON c.codigoitem = e.iditem""",
+    },
+    # Gold Requisicoes (joins pela chave tipada (idreqmat, iditem); py_idreqitem é só coluna de saída para o Power BI)
+    {
+        "nome": "gold_requisicoes",
+        "chave": ["idreqmat", "iditem"],
+        "indices": [["idfilial"]],
+        "sql": """SELECT r.*, CASE status::int WHEN 0 THEN 'Digitado' WHEN 1 THEN 'Aberto' WHEN 3 THEN 'Cancelado' WHEN 10 THEN 'Parcial' WHEN 11 THEN 'Atendido' ELSE 'Desconhecido' END AS py_desc_status, CASE WHEN r.quantcancel = r.quant THEN 'CANCELADO TOTAL' WHEN r.quantsubst = r.quant THEN 'SUBSTITUIDO TOTAL' WHEN r.quantatend = 0 AND r.saldo > 0 THEN 'NÃO ATENDIDA' WHEN r.quantatend = r.quant THEN 'ATENDIDO' WHEN r.quantatend > r.quant THEN 'ATENDIDO A MAIS' WHEN r.quantatend < r.quant AND r.quantatend > 0 THEN 'ATENDIDA PARCIAL' ELSE 'INDEFINIDO' END AS py_status_item, CASE WHEN r.quantatend > 0 THEN 'SIM' ELSE 'NÃO' END AS py_gera_atend, r.idreqmat::text || '-' || r.iditem::text AS py_idreqitem, COALESCE(ati.max_dataatend_item, atr.max_dataatend_req) AS py_data_ult_atend FROM useall.silver_requisicoes r LEFT JOIN (SELECT idreqmat, iditem, MAX(data_atend) AS max_dataatend_item FROM useall.gold_atendimentodereq GROUP BY idreqmat, iditem) ati ON ati.idreqmat = r.idreqmat AND ati.iditem = r.iditem LEFT JOIN (SELECT idreqmat, MAX(data_atend) AS max_dataatend_req FROM useall.gold_atendimentodereq GROUP BY idreqmat) atr ON atr.idreqmat = r.idreqmat""",
+    },
+    # Gold Estoque Diario (incremental pelos dias recarregados no manifesto e já levados à silver; particionada por mês)
+    {
+        "nome": "gold_estoque_diario",
+        "chave": ["iditem", "data_referencia"],
+        "particao": {"coluna": "data_referencia", "origem": "m2_estoque_saldo_de_estoque", "silver": "silver_estoque_diario",
+                     "mensal": True},
+        "indices": [["data_referencia"], ["idfilial"]],
+        "sql": """SELECT *, CONCAT(iditem, '-', TO_CHAR(data_referencia::date, 'YYYYMMDD')) AS py_iddataitem FROM useall.silver_estoque_diario WHERE desc_almox = 'MERC. MATRIZ'""",
+    },
+]
+
+
+def gold_generico(cur, schema):
+    """Golds sem regra própria: cópia direta de cada silver_* (antes era o bloco DO $$ ... $$)."""
+    especificos = {s["nome"] for s in GOLD_STEPS}
+    cur.execute(
+        "SELECT table_name FROM information_schema.tables "
+        "WHERE table_schema = %s AND table_name LIKE 'silver\\_%%' ORDER BY table_name",
+        (schema,),
+    )
+    passos = []
+    for (silver,) in cur.fetchall():
+        gold = silver.replace("silver_", "gold_")
+        if gold in especificos or silver.endswith(("__next", "__old")):
+            continue
+        passos.append({"nome": gold, "chave": GOLD_KEYS.get(gold), "sql": f"SELECT * FROM {schema}.{silver}"})
+    return passos
+
+
+def dependencias_gold(passos):
+    """{saída: entradas}, onde entradas são as outras saídas referenciadas como schema.nome no SQL."""
+    saidas = {p["nome"] for p in passos}
+    deps = {}
+    for p in passos:
+        lidas = set(re.findall(r"\b\w+\.\"?(\w+)\"?", p["sql"])) | set(p.get("depende", ()))
+        deps[p["nome"]] = (lidas & saidas) - {p["nome"]}
+    return deps
+
+
+def ensure_pendentes(engine, schema):
+    with engine.begin() as conn:
+        conn.execute(text(f"""
+            CREATE TABLE IF NOT EXISTS {schema}.{PENDENTES_TABLE} (
+                id BIGSERIAL PRIMARY KEY,
+                gold TEXT NOT NULL,
+                chave TEXT,
+                registrado_em TIMESTAMP NOT NULL DEFAULT now()
+            )
+        """))
+
+
+def marcar_pendentes_sql(schema, gold, select_chaves):
+    """INSERT na fila de pendentes das chaves de select_chaves; roda na transação da carga (pre/post_sql)."""
+    return (f"INSERT INTO {schema}.{PENDENTES_TABLE} (gold, chave) "
+            f"SELECT DISTINCT '{gold}', k::text FROM ({select_chaves}) AS p(k) WHERE k IS NOT NULL")
+
+
+def _corte_pendentes(cur, schema, nome):
+    """Maior id da fila para a gold: o que chegar depois fica para a próxima execução."""
+    cur.execute(f"SELECT max(id) FROM {schema}.{PENDENTES_TABLE} WHERE gold = %s", (nome,))
+    return cur.fetchone()[0] or 0
+
+
+def _filtro_pendentes(cur, schema, passo, corte):
+    """Chaves da fila tipadas como a coluna da gold; chave que não converte força build completo."""
+    nome, coluna = passo["nome"], passo["particao"]["coluna"]
+    cur.execute(f"SELECT DISTINCT chave FROM {schema}.{PENDENTES_TABLE} WHERE gold = %s AND id <= %s",
+                (nome, corte))
+    chaves = [r[0] for r in cur.fetchall()]
+    tipo = dict(colunas_tabela(cur, f'{schema}."{nome}"')).get(coluna)
+    if tipo is None:
+        return None
+    cur.execute("SAVEPOINT gold_pendentes")
+    try:
+        cur.execute(f"SELECT %s::{tipo}[]", (chaves,))
+        cur.execute("RELEASE SAVEPOINT gold_pendentes")
+    except Exception as e:
+        cur.execute("ROLLBACK TO SAVEPOINT gold_pendentes")
+        logger.warning(f"{nome}: chave pendente fora do tipo {tipo} ({e}). Build completo.")
+        return None
+    return f'"{coluna}" = ANY(%s::{tipo}[])', [chaves], chaves
+
+
+def _carga_silver(cur, schema, part):
+    """Quando a silver de origem foi carregada com sucesso pela última vez (manifesto); None se não registrada."""
+    if not part.get("silver"):
+        return None
+    cur.execute(f"SELECT loaded_at FROM {schema}.{MANIFEST_TABLE} WHERE identificacao = %s AND partition_key = 'full'",
+                (part["silver"],))
+    linha = cur.fetchone()
+    return linha[0] if linha else None
+
+
+def _filtro(cur, schema, passo, corte=None):
+    """
+    Fatia a reconstruir: (WHERE sobre a coluna de partição, parâmetros, datas) ou None para build completo.
+    Com "origem", as datas são as partições da extração carregadas depois do último build da gold;
+    com "pendentes", as chaves da fila gold_pendentes até corte; com "impressao", as datas cuja impressão mudou.
+    """
+    part = passo["particao"]
+    if part.get("pendentes"):
+        return _filtro_pendentes(cur, schema, passo, corte)
+    col = f'"{part["coluna"]}"::date'
+    if part.get("origem"):
+        cur.execute(f"SELECT 1 FROM {schema}.{MANIFEST_TABLE} WHERE identificacao = %s LIMIT 1", (passo["nome"],))
+        if cur.fetchone() is None:
+            return None
+        # Só partições extraídas antes da última carga da silver: se a silver falhou, ficam para depois
+        cur.execute(f"""
+            SELECT s.partition_key::date FROM {schema}.{MANIFEST_TABLE} s
+            LEFT JOIN {schema}.{MANIFEST_TABLE} g ON g.identificacao = %s AND g.partition_key = s.partition_key
+            WHERE s.identificacao = %s AND (g.loaded_at IS NULL OR s.loaded_at > g.loaded_at)
+              AND s.loaded_at <= COALESCE(%s, now())
+            ORDER BY 1
+        """, (passo["nome"], part["origem"], _carga_silver(cur, schema, part)))
+        datas = [r[0] for r in cur.fetchall()]
+        return f"{col} = ANY(%s)", [datas], datas
+    return _filtro_impressao(cur, schema, passo, col)
+
+
+def _sql_impressao(origem, col):
+    """Impressão por data: linhas e soma dos hashes das linhas (independe da ordem; NULL vira a chave 'NULL')."""
+    return (f"SELECT COALESCE(({col})::text, 'NULL') AS chave, count(*) AS linhas, "
+            f"sum(hashtextextended(q::text, 0))::text AS impressao FROM {origem} q GROUP BY 1")
+
+
+def _filtro_impressao(cur, schema, passo, col):
+    """
+    Datas cuja impressão (linhas + hash) no SELECT da gold difere da registrada no manifesto no último build:
+    linhas novas, alteradas ou apagadas em qualquer data, inclusive NULL ("OR coluna IS NULL").
+    Uma passada agregada pela silver; a gold publicada não é lida. Sem registro no manifesto: build completo.
+    """
+    nome = passo["nome"]
+    cur.execute(f"SELECT 1 FROM {schema}.{MANIFEST_TABLE} WHERE identificacao = %s LIMIT 1", (nome,))
+    if cur.fetchone() is None:
+        return None
+    sql = passo["sql"].strip().rstrip(";")
+    cur.execute(f"""
+        WITH atual AS ({_sql_impressao(f"({sql})", col)}),
+             gravada AS (SELECT partition_key, rows, checksum FROM {schema}.{MANIFEST_TABLE} WHERE identificacao = %s)
+        SELECT COALESCE(a.chave, g.partition_key)
+        FROM atual a FULL JOIN gravada g ON g.partition_key = a.chave
+        WHERE a.linhas IS DISTINCT FROM g.rows OR a.impressao IS DISTINCT FROM g.checksum
+    """, (nome,))
+    chaves = [r[0] for r in cur.fetchall()]
+    datas = [date.fromisoformat(c) for c in chaves if c != "NULL"]
+    where = f"{col} = ANY(%s)" + (f" OR {col} IS NULL" if len(datas) < len(chaves) else "")
+    return f"({where})", [datas], chaves
+
+
+def _criar_particionada(cur, alvo, tmp, coluna):
+    cur.execute(f'CREATE TABLE {alvo} (LIKE {tmp}) PARTITION BY RANGE ("{coluna}")')
+    cur.execute(f"CREATE TABLE {alvo[:-1]}_default\" PARTITION OF {alvo} DEFAULT")
+
+
+def _particionada_ok(cur, alvo, part):
+    """Tabela criada antes do particionamento (relkind 'r') precisa ser recriada uma vez."""
+    cur.execute("SELECT relkind FROM pg_class WHERE oid = %s::regclass", (alvo,))
+    return (cur.fetchone()[0] == "p") == bool(part.get("mensal"))
+
+
+def _garantir_meses(cur, schema, nome, tmp, coluna):
+    """Cria as partições mensais que faltam para os dados em tmp (meses antigos nunca são reescritos)."""
+    cur.execute(f"SELECT DISTINCT date_trunc('month', \"{coluna}\"::date)::date FROM {tmp} WHERE \"{coluna}\" IS NOT NULL")
+    for (mes,) in cur.fetchall():
+        proximo = (mes.replace(day=28) + timedelta(days=4)).replace(day=1)
+        cur.execute(
+            f'CREATE TABLE IF NOT EXISTS {schema}."{nome}_p{mes:%Y%m}" PARTITION OF {schema}."{nome}" '
+            f"FOR VALUES FROM ('{mes}') TO ('{proximo}')"
+        )
+
+
+def aplicar_incremental(cur, schema, passo, completo=False):
+    """DELETE + INSERT só da fatia tocada. Registra no manifesto as datas aplicadas (golds com "origem")."""
+    nome, part = passo["nome"], passo["particao"]
+    alvo = f'{schema}."{nome}"'
+    corte = _corte_pendentes(cur, schema, nome) if part.get("pendentes") else None
+    filtro = None if completo or not tabela_existe(cur, alvo) else _filtro(cur, schema, passo, corte)
+    if filtro is not None and filtro[2] == []:
+        logger.info(f"{alvo} [incremental]: nenhuma partição nova.")
+        return {"inserted": 0, "deleted": 0, "modo": "incremental", "particoes": 0}
+
+    where, params, datas = filtro if filtro else ("TRUE", [], None)
+    tmp = f'"_inc_{nome}"'
+    cur.execute(f"DROP TABLE IF EXISTS {tmp}")
+    cur.execute(
+        f"CREATE TEMP TABLE {tmp} ON COMMIT DROP AS "
+        f"SELECT * FROM ({passo['sql'].strip().rstrip(';')}) q WHERE {where}",
+        params or None,
+    )
+
+    if tabela_existe(cur, alvo) and (not _particionada_ok(cur, alvo, part) or not sincronizar_colunas(cur, alvo, tmp)):
+        logger.warning(f"Estrutura de {alvo} mudou. Recriando a tabela.")
+        cur.execute(f"DROP TABLE {alvo} CASCADE")
+        return aplicar_incremental(cur, schema, passo, completo=True)
+    if not tabela_existe(cur, alvo):
+        if part.get("mensal"):
+            _criar_particionada(cur, alvo, tmp, part["coluna"])
+        else:
+            cur.execute(f"CREATE TABLE {alvo} (LIKE {tmp})")
+    # Índices declarados depois da criação também entram (IF NOT EXISTS)
+    garantir_indices(cur, alvo, passo)
+    if part.get("mensal"):
+        _garantir_meses(cur, schema, nome, tmp, part["coluna"])
+
+    if filtro:
+        cur.execute(f"DELETE FROM {alvo} WHERE {where}", params)
+    else:
+        cur.execute(f"TRUNCATE {alvo}")
+    removidas = cur.rowcount if filtro else 0
+    cols = ", ".join(f'"{c}"' for c, _ in colunas_tabela(cur, tmp))
+    cur.execute(f"INSERT INTO {alvo} ({cols}) SELECT {cols} FROM {tmp}")
+    inseridas = cur.rowcount
+
+    if part.get("origem"):
+        # loaded_at = carga da silver usada: partição re-extraída depois dela continua pendente
+        cur.execute(f"""
+            INSERT INTO {schema}.{MANIFEST_TABLE} (identificacao, partition_key, rows, checksum, loaded_at)
+            SELECT %s, s.partition_key, count(t.*), NULL, COALESCE(%s, now())
+            FROM {schema}.{MANIFEST_TABLE} s
+            LEFT JOIN {tmp} t ON t."{part["coluna"]}"::date = s.partition_key::date
+            WHERE s.identificacao = %s {"AND s.partition_key::date = ANY(%s)" if datas is not None else ""}
+            GROUP BY s.partition_key
+            ON CONFLICT (identificacao, partition_key)
+            DO UPDATE SET rows = EXCLUDED.rows, loaded_at = EXCLUDED.loaded_at
+        """, [nome, _carga_silver(cur, schema, part), part["origem"]] + ([datas] if datas is not None else []))
+    if part.get("impressao"):
+        # Impressões das datas reconstruídas (a tmp tem exatamente as linhas delas) para a próxima comparação
+        cur.execute(f"DELETE FROM {schema}.{MANIFEST_TABLE} WHERE identificacao = %s"
+                    + (" AND partition_key = ANY(%s)" if datas is not None else ""),
+                    [nome] + ([datas] if datas is not None else []))
+        cur.execute(f"""
+            INSERT INTO {schema}.{MANIFEST_TABLE} (identificacao, partition_key, rows, checksum, loaded_at)
+            SELECT %s, chave, linhas, impressao, now() FROM ({_sql_impressao(tmp, f'q."{part["coluna"]}"::date')}) i
+        """, (nome,))
+    if part.get("pendentes"):
+        cur.execute(f"DELETE FROM {schema}.{PENDENTES_TABLE} WHERE gold = %s AND id <= %s", (nome, corte))
+    cur.execute(f"ANALYZE {alvo}")
+
+    stats = {"inserted": inseridas, "deleted": removidas, "modo": "incremental" if filtro else "completo",
+             "particoes": len(datas) if datas is not None else None}
+    logger.info(f"{alvo} [{stats['modo']}]: {removidas} removidas, {inseridas} inseridas.")
+    return stats
+
+
+def executar_passo(cur, schema, passo, completo=False):
+    if passo.get("particao"):
+        return aplicar_incremental(cur, schema, passo, completo)
+    if passo.get("tipo") == "view":
+        cur.execute("SAVEPOINT gold_view")
+        try:
+            cur.execute(f"CREATE OR REPLACE VIEW {schema}.{passo['nome']} AS {passo['sql']}")
+        except Exception:
+            # A tabela base ganhou colunas (gc.* mudou de forma): só recriando a view
+            cur.execute("ROLLBACK TO SAVEPOINT gold_view")
+            logger.warning(f"Recriando a view {schema}.{passo['nome']}.")
+            cur.execute(f"DROP VIEW IF EXISTS {schema}.{passo['nome']} CASCADE")
+            cur.execute(f"CREATE VIEW {schema}.{passo['nome']} AS {passo['sql']}")
+        cur.execute("RELEASE SAVEPOINT gold_view")
+        return None
+    stats = merge_select(cur, schema, passo["nome"], passo["sql"], passo.get("chave"))
+    garantir_indices(cur, f'{schema}."{passo["nome"]}"', passo)
+    cur.execute(f'ANALYZE {schema}."{passo["nome"]}"')
+    return stats
+
+
+def em_transacao(engine, func):
+    """Roda func(cur) em uma conexão própria do pool e faz commit."""
+    raw_conn = engine.raw_connection()
+    try:
+        cur = raw_conn.cursor()
+        resultado = func(cur)
+        raw_conn.commit()
+        cur.close()
+        return resultado
+    except Exception:
+        raw_conn.rollback()
+        raise
+    finally:
+        raw_conn.close()
+
+
+def _indices(passo):
+    """Chave natural + "indices" do passo + GOLD_INDICES, sem repetição."""
+    specs = ([passo["chave"]] if passo.get("chave") else []) + passo.get("indices", []) + GOLD_INDICES.get(passo["nome"], [])
+    unicos = []
+    for cols in specs:
+        if list(cols) not in unicos:
+            unicos.append(list(cols))
+    return unicos
+
+
+def _coluna_base(col):
+    return col.split()[0]
+
+
+def _nome_indice(nome, cols):
+    return f"ix_{nome}_{'_'.join(map(_coluna_base, cols))}"[:57]
+
+
+def garantir_indices(cur, alvo, passo, sufixo=""):
+    """CREATE INDEX IF NOT EXISTS de cada spec de _indices(passo) cujas colunas existam em alvo."""
+    existentes = {c for c, _ in colunas_tabela(cur, alvo)}
+    criados = []
+    for cols in _indices(passo):
+        faltam = [c for c in map(_coluna_base, cols) if c not in existentes]
+        if faltam:
+            logger.warning(f"{alvo}: índice {cols} ignorado (colunas ausentes: {faltam}).")
+            continue
+        lista = ", ".join(f'"{_coluna_base(c)}"{c[len(_coluna_base(c)):]}' for c in cols)
+        indice = f"{_nome_indice(passo['nome'], cols)}{sufixo}"
+        unico = "UNIQUE " if passo.get("unico") and cols == passo.get("chave") else ""
+        cur.execute(f'CREATE {unico}INDEX IF NOT EXISTS "{indice}" ON {alvo} ({lista})')
+        criados.append(indice)
+    return criados
+
+
+def _views_dependentes(nome):
+    return [p for p in GOLD_STEPS if p.get("tipo") == "view" and re.search(rf"\.{nome}\b", p["sql"])]
+
+
+def construir_next(cur, schema, passo):
+    """CREATE TABLE gold_x__next AS <select>, com índices e estatísticas. Retorna o nº de linhas."""
+    nome = passo["nome"]
+    prox = f'{schema}."{nome}__next"'
+    cur.execute(f"DROP TABLE IF EXISTS {prox}")
+    cur.execute(f"CREATE TABLE {prox} AS {passo['sql'].strip().rstrip(';')}")
+    linhas = cur.rowcount
+    garantir_indices(cur, prox, passo, sufixo="__next")
+    cur.execute(f"ANALYZE {prox}")
+    return linhas
+
+
+def privilegios(cur, tabela):
+    """GRANTs da tabela a outros papéis (relacl): [(privilégio, papel para o GRANT, oid do papel, com grant option)]."""
+    cur.execute("""
+        SELECT a.privilege_type, CASE WHEN a.grantee = 0 THEN 'PUBLIC' ELSE quote_ident(a.grantee::regrole::text) END,
+               a.grantee, a.is_grantable
+        FROM pg_class c, aclexplode(c.relacl) a
+        WHERE c.oid = %s::regclass AND a.grantee <> c.relowner
+        ORDER BY 2, 1
+    """, (tabela,))
+    return cur.fetchall()
+
+
+def copiar_privilegios(cur, origem, destino):
+    """
+    Reaplica em destino os GRANTs de origem (a tabela nova do swap nasce só com o dono) e confere com
+    has_table_privilege que cada papel ainda consegue o que tinha; se não, a troca falha e nada muda.
+    """
+    concedidos = privilegios(cur, origem)
+    for privilegio, papel, _, opcao in concedidos:
+        cur.execute(f"GRANT {privilegio} ON {destino} TO {papel}{' WITH GRANT OPTION' if opcao else ''}")
+    for privilegio, papel, oid, _ in concedidos:
+        if oid:
+            cur.execute("SELECT has_table_privilege(%s::oid, %s::regclass, %s)", (oid, destino, privilegio))
+            if not cur.fetchone()[0]:
+                raise RuntimeError(f"{papel} perdeu {privilegio} em {destino} na troca.")
+    return len(concedidos)
+
+
+def views_externas(cur, schema, nome):
+    """
+    Views (e materializadas) que dependem de gold_x, inclusive em cadeia, fora de GOLD_STEPS: (schema, nome,
+    relkind, definição, grants) na ordem de criação. Ex.: sql/view/vw_gold_estoque_status.sql.
+    """
+    cur.execute("""
+        WITH RECURSIVE deps AS (
+            SELECT r.ev_class AS oid, 1 AS nivel
+            FROM pg_depend d JOIN pg_rewrite r ON r.oid = d.objid
+            WHERE d.classid = 'pg_rewrite'::regclass AND d.refclassid = 'pg_class'::regclass
+              AND d.refobjid = %s::regclass AND r.ev_class <> d.refobjid
+            UNION ALL
+            SELECT r.ev_class, deps.nivel + 1
+            FROM deps
+            JOIN pg_depend d ON d.refobjid = deps.oid AND d.classid = 'pg_rewrite'::regclass
+                            AND d.refclassid = 'pg_class'::regclass
+            JOIN pg_rewrite r ON r.oid = d.objid AND r.ev_class <> deps.oid
+        )
+        SELECT n.nspname, c.relname, c.relkind, pg_get_viewdef(c.oid),
+               (SELECT array_agg(format('GRANT %%s ON %%I.%%I TO %%s', a.privilege_type, n.nspname, c.relname,
+                                        CASE WHEN a.grantee = 0 THEN 'PUBLIC' ELSE quote_ident(a.grantee::regrole::text) END))
+                FROM aclexplode(c.relacl) a WHERE a.grantee <> c.relowner),
+               max(deps.nivel) AS nivel
+        FROM deps JOIN pg_class c ON c.oid = deps.oid JOIN pg_namespace n ON n.oid = c.relnamespace
+        GROUP BY n.nspname, c.relname, c.relkind, c.oid
+        ORDER BY nivel, n.nspname, c.relname
+    """, (f'{schema}."{nome}"',))
+    gerenciadas = {v["nome"] for v in _views_dependentes(nome)}
+    return [v[:5] for v in cur.fetchall() if not (v[0] == schema and v[1] in gerenciadas)]
+
+
+def recriar_view(cur, view_schema, view, relkind, definicao, grants):
+    """Reaponta a view para a tabela nova; se a forma mudou demais para OR REPLACE, recria (com os grants)."""
+    alvo = f'{view_schema}."{view}"'
+    cur.execute("SELECT to_regclass(%s)", (alvo,))
+    existe = cur.fetchone()[0] is not None
+    if existe and relkind == "v":
+        cur.execute("SAVEPOINT gold_view_externa")
+        try:
+            cur.execute(f"CREATE OR REPLACE VIEW {alvo} AS {definicao}")
+            cur.execute("RELEASE SAVEPOINT gold_view_externa")
+            return
+        except Exception:
+            cur.execute("ROLLBACK TO SAVEPOINT gold_view_externa")
+    if existe:
+        logger.warning(f"Recriando a view {alvo} sobre a tabela nova.")
+        cur.execute(f"DROP {'MATERIALIZED ' if relkind == 'm' else ''}VIEW {alvo}")
+    # Sem existir: levada pelo DROP ... CASCADE de uma view gerenciada acima dela
+    cur.execute(f"CREATE {'MATERIALIZED ' if relkind == 'm' else ''}VIEW {alvo} AS {definicao}")
+    for grant in grants or []:
+        cur.execute(grant)
+
+
+def trocar_next(cur, schema, passo):
+    """
+    Publica gold_x__next no lugar de gold_x. Único trecho com ACCESS EXCLUSIVE.
+    Os grants da tabela vão para a nova; views de fora da série (sql/view) são guardadas antes e recriadas
+    sobre ela; a antiga sai sem CASCADE: se algo ainda depender dela, a troca falha em vez de apagar o dependente.
+    """
+    nome = passo["nome"]
+    cur.execute(f"SET LOCAL lock_timeout = '{SWAP_LOCK_TIMEOUT}'")
+    cur.execute(f'DROP TABLE IF EXISTS {schema}."{nome}__old"')
+    cur.execute("SELECT to_regclass(%s)", (f'{schema}."{nome}"',))
+    existe = cur.fetchone()[0] is not None
+    externas = views_externas(cur, schema, nome) if existe else []
+    if existe:
+        # Grants (ex.: SELECT do papel do Power BI) passam para a tabela nova antes do rename
+        copiar_privilegios(cur, f'{schema}."{nome}"', f'{schema}."{nome}__next"')
+    cur.execute(f'ALTER TABLE IF EXISTS {schema}."{nome}" RENAME TO "{nome}__old"')
+    cur.execute(f'ALTER TABLE {schema}."{nome}__next" RENAME TO "{nome}"')
+    # Views apontam para o OID: redefinidas sobre a tabela nova antes de derrubar a antiga
+    for view in _views_dependentes(nome):
+        executar_passo(cur, schema, view)
+    for externa in externas:
+        recriar_view(cur, *externa)
+    cur.execute(f'DROP TABLE IF EXISTS {schema}."{nome}__old"')
+    for cols in _indices(passo):
+        indice = _nome_indice(nome, cols)
+        cur.execute(f'ALTER INDEX IF EXISTS {schema}."{indice}__next" RENAME TO "{indice}"')
+
+
+def publicar(engine, schema, passo, completo=False):
+    """Swap de um passo: build em sessão própria, depois troca curta (com novas tentativas se houver lock)."""
+    if passo.get("tipo") == "view" or passo.get("particao"):
+        return em_transacao(engine, lambda cur: executar_passo(cur, schema, passo, completo))
+
+    inicio = time.time()
+    linhas = em_transacao(engine, lambda cur: construir_next(cur, schema, passo))
+    construido = time.time()
+    for tentativa in range(1, SWAP_TENTATIVAS + 1):
+        try:
+            em_transacao(engine, lambda cur: trocar_next(cur, schema, passo))
+            break
+        except Exception as e:
+            if "lock timeout" not in str(e) or tentativa == SWAP_TENTATIVAS:
+                raise
+            logger.warning(f"{passo['nome']}: tabela ocupada, nova troca em {tentativa * 2}s.")
+            time.sleep(tentativa * 2)
+    fim = time.time()
+    logger.info(
+        f"{schema}.{passo['nome']} [swap]: {linhas} linhas | build {construido - inicio:.2f}s | "
+        f"troca {(fim - construido) * 1000:.0f}ms"
+    )
+    return {"rows": linhas, "modo": "swap", "build_s": construido - inicio, "swap_s": fim - construido}
+
+
+def conferir_ultimos_custos(cur, schema):
+    """
+    Compara gold_ultimos_custos com a janela original (ULTIMOS_CUSTOS_JANELA): os mesmos itens dos dois lados
+    e cada linha da tabela entre as de maior datacusto do item. Em empate, ROW_NUMBER e DISTINCT ON
+    escolhem uma linha qualquer, então a comparação é contra todas as empatadas (RANK = 1).
+    """
+    topo = ULTIMOS_CUSTOS_JANELA.replace("ROW_NUMBER()", "RANK()")
+    cur.execute(f"""
+        WITH janela AS ({ULTIMOS_CUSTOS_JANELA}),
+             topo AS ({topo}),
+             tabela AS (SELECT *, 1::bigint AS rn FROM {schema}.gold_ultimos_custos)
+        SELECT (SELECT count(*) FROM (SELECT * FROM tabela EXCEPT ALL SELECT * FROM topo) f),
+               (SELECT count(*) FROM (SELECT codigoitem FROM janela EXCEPT SELECT codigoitem FROM tabela) j),
+               (SELECT count(*) FROM (SELECT codigoitem FROM tabela EXCEPT SELECT codigoitem FROM janela) t),
+               (SELECT count(*) FROM (SELECT codigoitem FROM topo GROUP BY codigoitem HAVING count(*) > 1) e)
+    """)
+    resultado = dict(zip(("fora_do_topo", "itens_so_janela", "itens_so_tabela", "empates"), cur.fetchone()))
+    if resultado["fora_do_topo"] or resultado["itens_so_janela"] or resultado["itens_so_tabela"]:
+        logger.warning(f"gold_ultimos_custos difere da janela: {resultado}.")
+    else:
+        logger.info(f"gold_ultimos_custos equivalente à janela ({resultado['empates']} itens com empate).")
+    return resultado
+
+
+# ================= PLANOS =================
+
+def _nos(plano):
+    yield plano
+    for filho in plano.get("Plans", []):
+        yield from _nos(filho)
+
+
+def _varredura_interna(no):
+    """Lado interno de um Nested Loop, atravessando Materialize/Memoize."""
+    while no.get("Node Type") in ("Materialize", "Memoize") and no.get("Plans"):
+        no = no["Plans"][0]
+    return no
+
+
+def analisar_plano(plano):
+    """{"joins": tipos de join do plano, "nested_loop_seq": relações lidas por Seq Scan dentro de um Nested Loop}."""
+    joins, fallback = [], []
+    for no in _nos(plano):
+        tipo = no.get("Node Type")
+        if tipo in ("Hash Join", "Merge Join", "Nested Loop"):
+            joins.append(tipo)
+        if tipo == "Nested Loop" and len(no.get("Plans", [])) == 2:
+            interno = _varredura_interna(no["Plans"][1])
+            if interno.get("Node Type") == "Seq Scan":
+                fallback.append(interno.get("Relation Name"))
+    return {"joins": joins, "nested_loop_seq": fallback}
+
+
+def verificar_planos(cur, schema, passos):
+    """
+    EXPLAIN (sem executar) dos SELECTs com JOIN, já com índices e estatísticas novos.
+    Joins por hash, merge ou nested loop com índice passam; nested loop sobre Seq Scan é reportado.
+    """
+    relatorio = {}
+    for p in passos:
+        if p.get("tipo") == "view" or not re.search(r"\bJOIN\b", p["sql"], re.IGNORECASE):
+            continue
+        cur.execute(f"EXPLAIN (FORMAT JSON) {p['sql'].strip().rstrip(';')}")
+        saida = cur.fetchone()[0]
+        plano = (json.loads(saida) if isinstance(saida, str) else saida)[0]["Plan"]
+        relatorio[p["nome"]] = analise = analisar_plano(plano)
+        if analise["nested_loop_seq"]:
+            logger.warning(
+                f"{schema}.{p['nome']}: nested loop com varredura sequencial em {analise['nested_loop_seq']} "
+                f"(índice ausente ou estatística ruim)."
+            )
+        else:
+            logger.info(f"{schema}.{p['nome']}: joins {analise['joins']} ok.")
+    return relatorio
+
+
+def _medido(passo, func):
+    """Roda func() como escopo de métricas do passo (etapa "gold" em pipeline_metrics)."""
+    with medir("gold", passo["nome"]) as m:
+        stats = func()
+        if isinstance(stats, dict):
+            m.somar(linhas=stats.get("rows", stats.get("inserted")))
+            m.extras.update({k: v for k, v in stats.items() if k in ("modo", "deleted", "updated", "build_s", "swap_s")})
+        return stats
+
+
+def materializar_gold(engine, schema, modo=GOLD_MODO, completo=False):
+    """
+    Publica todas as golds (completo=True reconstrói também as incrementais) e confere os planos dos joins.
+    Retorna {tabela: estatísticas}; golds com JOIN ganham "plano" (ver verificar_planos).
+    """
+    genericos = em_transacao(engine, lambda cur: gold_generico(cur, schema))
+    passos = genericos + GOLD_STEPS
+
+    if modo == "swap":
+        # Builds independentes rodam juntos; o passo espera só as golds que lê (tempo ~ caminho crítico)
+        resultados = executar_dag(passos, lambda p: _medido(p, lambda: publicar(engine, schema, p, completo)),
+                                  dependencias_gold(passos), max_workers=GOLD_WORKERS)
+    else:
+        resultados = em_transacao(engine, lambda cur: {
+            p["nome"]: _medido(p, lambda p=p: executar_passo(cur, schema, p, completo)) for p in passos
+        })
+
+    planos = em_transacao(engine, lambda cur: verificar_planos(cur, schema, passos))
+    for nome, plano in planos.items():
+        if isinstance(resultados.get(nome), dict):
+            resultados[nome]["plano"] = plano
+    return resultados
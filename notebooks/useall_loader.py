@@ -0,0 +1,419 @@
+"""
+Carga em massa para o Postgres via COPY (psycopg2 copy_expert).
+Substitui o DataFrame.to_sql (INSERT linha a linha) nas tabelas staging.
+Com pyarrow (USEALL_ARROW), os lotes viram pyarrow.Table e o CSV sai do writer do Arrow,
+sem DataFrame de colunas object no meio.
+"""
+
+import io
+import os
+import time
+import hashlib
+import logging
+
+import pandas as pd # type: ignore
+
+from useall_arrow import ARROW, pa, como_texto, lote_para_arrow
+from useall_manifest import manifest_upsert
+from useall_merge import merge_temp
+from useall_metrics import somar
+
+logger = logging.getLogger("useall_pipeline")
+
+# Linhas serializadas por bloco (limita a memória extra do CSV)
+COPY_CHUNK_ROWS = int(os.getenv("COPY_CHUNK_ROWS", "50000"))
+# Tamanho do buffer lido pelo copy_expert a cada chamada
+COPY_BUFFER_SIZE = 1024 * 1024
+
+NULL_MARKER = "\\N"
+
+if pa is not None:
+    import pyarrow.csv as pa_csv # type: ignore
+
+
+# ================= DDL =================
+
+def _ensure_table(cur, columns, table, schema, if_exists):
+    # Staging é bruta: tudo TEXT (os lotes do stream podem divergir de dtype; a silver infere os tipos)
+    cols = ", ".join(f'"{c}" TEXT' for c in columns)
+
+    if if_exists == "replace":
+        cur.execute(f'DROP TABLE IF EXISTS {schema}."{table}"')
+        cur.execute(f'CREATE TABLE {schema}."{table}" ({cols})')
+        return
+
+    # append: cria se não existir e acrescenta colunas novas vindas da API
+    cur.execute(f'CREATE TABLE IF NOT EXISTS {schema}."{table}" ({cols})')
+    _add_columns(cur, columns, table, schema)
+
+
+def _add_columns(cur, columns, table, schema):
+    # Só altera colunas realmente novas: ALTER TABLE trava a tabela inteira até o commit,
+    # o que serializaria cargas concorrentes de partições diferentes
+    cur.execute(
+        "SELECT column_name FROM information_schema.columns WHERE table_schema = %s AND table_name = %s",
+        (schema, table),
+    )
+    existentes = {r[0] for r in cur.fetchall()}
+    for c in columns:
+        if c not in existentes:
+            cur.execute(f'ALTER TABLE {schema}."{table}" ADD COLUMN IF NOT EXISTS "{c}" TEXT')
+
+
+# ================= COPY =================
+
+class CsvChunkStream:
+    """Arquivo somente-leitura que gera o CSV do DataFrame sob demanda, bloco a bloco."""
+
+    def __init__(self, df, chunk_rows=COPY_CHUNK_ROWS, hasher=None):
+        self._df = df
+        self._chunk_rows = chunk_rows
+        self._hasher = hasher
+        self._pos = 0
+        self._current = io.StringIO()
+
+    def _next_chunk(self):
+        if self._pos >= len(self._df):
+            return False
+        chunk = self._df.iloc[self._pos:self._pos + self._chunk_rows]
+        self._pos += self._chunk_rows
+        csv = chunk.to_csv(index=False, header=False, na_rep=NULL_MARKER)
+        if self._hasher is not None:
+            self._hasher.update(csv.encode("utf-8"))
+        self._current = io.StringIO(csv)
+        return True
+
+    def read(self, size=-1):
+        partes = []
+        faltam = size
+        while size < 0 or faltam > 0:
+            data = self._current.read(faltam if size >= 0 else -1)
+            if data:
+                partes.append(data)
+                faltam -= len(data)
+                continue
+            if not self._next_chunk():
+                break
+        return "".join(partes)
+
+
+class ArrowCsvStream:
+    """
+    Mesmo contrato do CsvChunkStream para uma pyarrow.Table: cada RecordBatch é serializado pelo
+    writer CSV do Arrow (C++) direto em bytes. Strings válidas saem entre aspas e nulos como campo
+    vazio sem aspas, que o COPY CSV (NULL '' padrão) lê como NULL; "" continua sendo string vazia.
+    """
+
+    def __init__(self, tabela, chunk_rows=COPY_CHUNK_ROWS, hasher=None):
+        self._batches = iter(tabela.to_batches(max_chunksize=chunk_rows))
+        self._hasher = hasher
+        self._opcoes = pa_csv.WriteOptions(include_header=False, quoting_style="all_valid")
+        self._current = memoryview(b"")
+
+    def _next_chunk(self):
+        batch = next(self._batches, None)
+        if batch is None:
+            return False
+        sink = pa.BufferOutputStream()
+        pa_csv.write_csv(batch, sink, self._opcoes)
+        buf = sink.getvalue()
+        if self._hasher is not None:
+            self._hasher.update(buf)
+        self._current = memoryview(buf)
+        return True
+
+    def read(self, size=-1):
+        partes = []
+        faltam = size
+        while size < 0 or faltam > 0:
+            if self._current.nbytes:
+                n = self._current.nbytes if size < 0 else min(faltam, self._current.nbytes)
+                partes.append(self._current[:n].tobytes())
+                self._current = self._current[n:]
+                faltam -= n
+                continue
+            if not self._next_chunk():
+                break
+        return b"".join(partes)
+
+
+def _copy_frame(cur, df, alvo, chunk_rows, hasher=None):
+    colunas = ", ".join(f'"{c}"' for c in df.columns)
+    sql_copy = f"""COPY {alvo} ({colunas}) FROM STDIN WITH (FORMAT CSV, NULL '{NULL_MARKER}')"""
+    cur.copy_expert(sql_copy, CsvChunkStream(df, chunk_rows, hasher), size=COPY_BUFFER_SIZE)
+
+
+def _copy_arrow(cur, tabela, alvo, chunk_rows, hasher=None):
+    colunas = ", ".join(f'"{c}"' for c in tabela.column_names)
+    sql_copy = f"""COPY {alvo} ({colunas}) FROM STDIN WITH (FORMAT CSV)"""
+    cur.copy_expert(sql_copy, ArrowCsvStream(tabela, chunk_rows, hasher), size=COPY_BUFFER_SIZE)
+
+
+def _preparar(lote):
+    """
+    Table só de strings (caminho Arrow) ou DataFrame. DataFrames numpy/object seguem no caminho pandas.
+    Colunas tipadas passam por como_texto: o texto no COPY é o mesmo do to_csv do pandas.
+    """
+    if isinstance(lote, pd.DataFrame):
+        if ARROW and len(lote.columns) and all(isinstance(t, pd.ArrowDtype) for t in lote.dtypes):
+            return como_texto(lote_para_arrow(lote))
+        return lote
+    if pa is not None and isinstance(lote, (pa.Table, pa.RecordBatch)):
+        tabela = como_texto(lote_para_arrow(lote))
+        return tabela if ARROW else tabela.to_pandas()
+    return como_texto(lote_para_arrow(lote)) if ARROW else pd.DataFrame(lote)
+
+
+def _normalizar_chaves(df, keys):
+    """Renomeia para o nome declarado as colunas da chave que vieram com outra caixa (ex.: IDREQMAT → idreqmat)."""
+    arrow = not isinstance(df, pd.DataFrame)
+    cols = df.column_names if arrow else list(df.columns)
+    chaves = {k.lower(): k for k in keys}
+    novos = [chaves.get(c.lower(), c) if c not in keys else c for c in cols]
+    if novos == cols:
+        return df
+    return df.rename_columns(novos) if arrow else df.set_axis(novos, axis=1)
+
+
+def _medindo_espera(batches, espera):
+    """Repassa os lotes somando em espera[0] o tempo parado em next() (API, raw zone), fora do banco."""
+    lotes = iter(batches)
+    while True:
+        inicio = time.time()
+        try:
+            lote = next(lotes)
+        except StopIteration:
+            return
+        finally:
+            espera[0] += time.time() - inicio
+        yield lote
+
+
+def copy_batches_to_postgres(batches, table, engine, schema, if_exists="replace", pre_sql=None,
+                             chunk_rows=COPY_CHUNK_ROWS, manifest=None, keys=None, post_sql=None,
+                             delete_missing=False):
+    """
+    Carrega lotes (DataFrames, listas de dicts ou pyarrow.Table) via COPY FROM STDIN em uma única transação,
+    consumindo o iterável sob demanda (ex.: UseallClient.iter_batches direto do socket).
+    DDL e pre_sql (ex.: DELETE da partição) rodam uma vez, no primeiro lote não vazio.
+
+    if_exists: "replace" | "append" | "merge" (upsert pela chave natural `keys`, via tabela temporária;
+    delete_missing=True trata o lote como retrato completo e remove as chaves que sumiram).
+    manifest=(identificacao, partition_key) registra a carga (linhas + md5 do CSV) no mesmo commit.
+    post_sql: lista de (sql, params) executada antes do commit (ex.: avançar o watermark).
+    Retorna a quantidade de linhas carregadas (0 = nada foi alterado).
+    """
+    if if_exists == "merge" and not keys:
+        raise ValueError(f"Merge em {table} exige a chave natural (keys).")
+
+    inicio = time.time()
+    espera = [0.0]
+    total = 0
+    colunas = None
+    hasher = hashlib.md5() if manifest else None
+    alvo = f'{schema}."{table}"'
+
+    raw_conn = engine.raw_connection()
+    try:
+        cur = raw_conn.cursor()
+        for lote in _medindo_espera(batches, espera):
+            df = _preparar(lote)
+            arrow = not isinstance(df, pd.DataFrame)
+            n_linhas = df.num_rows if arrow else len(df)
+            if not n_linhas:
+                continue
+            if if_exists == "merge" and keys:
+                df = _normalizar_chaves(df, keys)
+            cols_lote = df.column_names if arrow else list(df.columns)
+
+            if colunas is None:
+                if if_exists == "merge":
+                    faltando = [k for k in keys if k not in cols_lote]
+                    if faltando and not delete_missing:
+                        raise ValueError(f"Chave natural {faltando} ausente no delta de {table}.")
+                    if faltando:
+                        # Retrato completo sem a chave: o merge_temp substitui o conteúdo (TRUNCATE + INSERT)
+                        logger.warning(f"{table}: chave {faltando} ausente na resposta. Mantendo carga completa.")
+                        keys = None
+                    alvo = f'"_merge_{table}"'
+                    tmp_cols = ", ".join(f'"{c}" TEXT' for c in cols_lote)
+                    cur.execute(f"CREATE TEMP TABLE {alvo} ({tmp_cols}) ON COMMIT DROP")
+                else:
+                    _ensure_table(cur, cols_lote, table, schema, if_exists)
+                for s in pre_sql or []:
+                    cur.execute(s)
+                colunas = list(cols_lote)
+            else:
+                novas = [c for c in cols_lote if c not in colunas]
+                if novas and if_exists == "merge":
+                    for c in novas:
+                        cur.execute(f'ALTER TABLE {alvo} ADD COLUMN "{c}" TEXT')
+                elif novas:
+                    _add_columns(cur, novas, table, schema)
+                colunas.extend(novas)
+
+            if arrow:
+                _copy_arrow(cur, df, alvo, chunk_rows, hasher)
+            else:
+                _copy_frame(cur, df, alvo, chunk_rows, hasher)
+            total += n_linhas
+
+        if total and if_exists == "merge":
+            merge_temp(cur, schema, table, alvo, keys, delete_missing)
+
+        if total and manifest:
+            cur.execute(manifest_upsert(schema), (*manifest, total, hasher.hexdigest()))
+
+        if total:
+            for sql, params in post_sql or []:
+                cur.execute(sql, params)
+            raw_conn.commit()
+        else:
+            raw_conn.rollback()
+        cur.close()
+    except Exception:
+        raw_conn.rollback()
+        raise
+    finally:
+        raw_conn.close()
+
+    duracao = time.time() - inicio
+    # carga_s: só o tempo no banco (DDL, COPY, merge, commit); o resto foi espera pelos lotes
+    somar(linhas=total, carga_s=duracao - espera[0])
+    if total:
+        logger.info(
+            f"COPY {schema}.{table}: {total} regs em {duracao:.2f}s, {duracao - espera[0]:.2f}s no banco "
+            f"({total / max(duracao, 1e-6):,.0f} regs/s)."
+        )
+    return total
+
+
+def copy_df_to_postgres(df, table, engine, schema, if_exists="replace", pre_sql=None,
+                        chunk_rows=COPY_CHUNK_ROWS, manifest=None, keys=None, post_sql=None, delete_missing=False):
+    """Carrega um DataFrame via COPY (DDL, pre_sql e COPY atômicos). Retorna as linhas carregadas."""
+    if df is None or df.empty:
+        return 0
+    return copy_batches_to_postgres([df], table, engine, schema, if_exists, pre_sql, chunk_rows,
+                                    manifest, keys, post_sql, delete_missing)
+
+
+# ================= BENCHMARK =================
+
+def _registros_sinteticos(linhas, colunas, seed=42):
+    """Registros no formato do ijson (use_float=True): inteiros, floats, datas em texto, nulos."""
+    import random
+    rnd = random.Random(seed)
+    tipos = [i % 4 for i in range(colunas)]
+    registros = []
+    for i in range(linhas):
+        r = {}
+        for j, t in enumerate(tipos):
+            if rnd.random() < 0.05:
+                r[f"c{j}"] = None
+            elif t == 0:
+                r[f"c{j}"] = rnd.randint(1, 10**6)
+            elif t == 1:
+                r[f"c{j}"] = round(rnd.random() * 1000, 2)
+            elif t == 2:
+                r[f"c{j}"] = f"{rnd.randint(1, 28):02d}/{rnd.randint(1, 12):02d}/2024"
+            else:
+                r[f"c{j}"] = f"ITEM {i} \"{j}\", descrição"
+        registros.append(r)
+    return registros
+
+
+def _drenar(stream):
+    total = 0
+    while True:
+        bloco = stream.read(COPY_BUFFER_SIZE)
+        if not bloco:
+            return total
+        total += len(bloco)
+
+
+def benchmark(linhas=100_000, colunas=40, lote=50_000):
+    """
+    Serialização lote -> CSV do COPY (sem banco): pandas (DataFrame + to_csv) x Arrow (Table + writer CSV).
+    Memória = pico do tracemalloc (objetos Python/numpy) + pico do pool do Arrow.
+    """
+    import tracemalloc
+
+    registros = _registros_sinteticos(linhas, colunas)
+    lotes = [registros[i:i + lote] for i in range(0, linhas, lote)]
+
+    def via_pandas():
+        return sum(_drenar(CsvChunkStream(pd.DataFrame(l), hasher=hashlib.md5())) for l in lotes)
+
+    def via_arrow():
+        return sum(_drenar(ArrowCsvStream(como_texto(lote_para_arrow(l)), hasher=hashlib.md5())) for l in lotes)
+
+    caminhos = [("pandas", via_pandas)] + ([("arrow", via_arrow)] if pa is not None else [])
+    for nome, func in caminhos:
+        inicio = time.perf_counter()
+        tamanho = func()
+        duracao = time.perf_counter() - inicio
+
+        # Segunda passada só para memória (o tracemalloc distorce o tempo)
+        if pa is not None:
+            pa.default_memory_pool().release_unused()
+        base_arrow = pa.total_allocated_bytes() if pa is not None else 0
+        tracemalloc.start()
+        func()
+        _, pico_py = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        pico_arrow = max(pa.default_memory_pool().max_memory() - base_arrow, 0) if nome == "arrow" else 0
+        print(f"{nome:>6}: {duracao:6.2f}s  {linhas / duracao:>10,.0f} regs/s  "
+              f"CSV {tamanho / 2**20:,.1f} MiB  pico Python {pico_py / 2**20:,.1f} MiB  "
+              f"pico Arrow {pico_arrow / 2**20:,.1f} MiB")
+
+
+def _texto_pandas(lote):
+    """Colunas como o caminho pandas as grava na staging: CSV do CsvChunkStream lido de volta como texto."""
+    df = pd.DataFrame(lote)
+    stream = CsvChunkStream(df)
+    csv = "".join(iter(lambda: stream.read(COPY_BUFFER_SIZE), ""))
+    return pd.read_csv(io.StringIO(csv), header=None, names=list(df.columns), dtype=str,
+                       keep_default_na=False, na_values=[NULL_MARKER])
+
+
+def conferir_inferencia(linhas=2_000, colunas=12):
+    """
+    Mesma entrada pelos dois caminhos (pandas e como_texto do Arrow) e a inferência da silver
+    (type_analytics.infer_column_type) em cada coluna. Retorna {coluna: (tipo pandas, tipo arrow)} das divergentes
+    (e das colunas data_* que não saíram timestamp).
+    """
+    import random
+    from type_analytics import infer_column_type
+
+    rnd = random.Random(7)
+    registros = _registros_sinteticos(linhas, colunas)
+    for i, r in enumerate(registros):
+        nulo = rnd.random() < 0.05
+        r.update({
+            "preco_inteiro": None if nulo else float(rnd.randint(1, 500)),  # decimal só com valores inteiros
+            "preco": None if nulo else rnd.choice([100.0, 0.5, 1e-05, 1e15, 12.25]),
+            "ativo": None if nulo else rnd.random() < 0.5,
+            "quantidade": None if nulo else rnd.randint(0, 99),
+            "misto": i if i % 2 else i + 0.5,
+            # Datas sem zero à esquerda (dia/mês/hora de 1 dígito) também são timestamp
+            "data_sem_zero": None if nulo else f"2024-{i % 12 + 1}-{i % 28 + 1}",
+            "data_br_sem_zero": None if nulo else f"{i % 28 + 1}/{i % 12 + 1}/2024 {i % 24}:05:00",
+        })
+
+    divergentes = {}
+    for inicio in range(0, linhas, 500):
+        lote = registros[inicio:inicio + 500]
+        via_pandas = _texto_pandas(lote)
+        via_arrow = como_texto(lote_para_arrow(lote)).to_pandas()
+        for c in via_pandas.columns:
+            tipos = (infer_column_type(via_pandas[c])["type"], infer_column_type(via_arrow[c])["type"])
+            if tipos[0] != tipos[1] or (c.startswith("data_") and tipos[0] != "timestamp"):
+                divergentes[c] = tipos
+    print(f"inferência pandas x arrow: {len(divergentes)} colunas divergentes {divergentes or ''}")
+    return divergentes
+
+
+if __name__ == "__main__":
+    benchmark()
+    if pa is not None and conferir_inferencia():
+        raise SystemExit(1)
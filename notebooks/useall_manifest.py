@@ -0,0 +1,85 @@
+"""
+Manifesto de extração: uma linha por (identificação, partição) carregada com sucesso.
+As decisões de "já carregado?" viram uma busca indexada no manifesto,
+em vez de varrer as tabelas staging (sem índice) a cada dia/grupo.
+"""
+
+import logging
+
+from sqlalchemy import text # type: ignore
+
+logger = logging.getLogger("useall_pipeline")
+
+MANIFEST_TABLE = "extraction_manifest"
+
+
+def ensure_manifest(engine, schema):
+    with engine.begin() as conn:
+        conn.execute(text(f"""
+            CREATE TABLE IF NOT EXISTS {schema}.{MANIFEST_TABLE} (
+                identificacao TEXT NOT NULL,
+                partition_key TEXT NOT NULL,
+                rows BIGINT NOT NULL,
+                checksum TEXT,
+                loaded_at TIMESTAMP NOT NULL DEFAULT now(),
+                PRIMARY KEY (identificacao, partition_key)
+            )
+        """))
+
+
+def manifest_upsert(schema):
+    """SQL (estilo psycopg2) para registrar a carga; roda na mesma transação do COPY."""
+    return f"""
+        INSERT INTO {schema}.{MANIFEST_TABLE} (identificacao, partition_key, rows, checksum, loaded_at)
+        VALUES (%s, %s, %s, %s, now())
+        ON CONFLICT (identificacao, partition_key)
+        DO UPDATE SET rows = EXCLUDED.rows, checksum = EXCLUDED.checksum, loaded_at = EXCLUDED.loaded_at
+    """
+
+
+def particoes_carregadas(engine, schema, identificacao, desde=None):
+    """Partições já carregadas da identificação (opcionalmente só as com loaded_at >= desde)."""
+    sql = f"SELECT partition_key FROM {schema}.{MANIFEST_TABLE} WHERE identificacao = :id"
+    params = {"id": identificacao}
+    if desde is not None:
+        sql += " AND loaded_at >= :desde"
+        params["desde"] = desde
+    with engine.connect() as conn:
+        return {r[0] for r in conn.execute(text(sql), params)}
+
+
+def semear_manifest(engine, schema, identificacao, table, coluna):
+    """
+    Migração única: se o manifesto ainda não conhece a identificação, registra as partições
+    que já estão na tabela staging (um único GROUP BY) para não rebuscar o histórico.
+    """
+    with engine.begin() as conn:
+        if not conn.execute(text("SELECT to_regclass(:t)"), {"t": f"{schema}.{table}"}).scalar():
+            return
+        conhecida = conn.execute(
+            text(f"SELECT 1 FROM {schema}.{MANIFEST_TABLE} WHERE identificacao = :id LIMIT 1"),
+            {"id": identificacao},
+        ).scalar()
+        if conhecida:
+            return
+        n = conn.execute(text(f"""
+            INSERT INTO {schema}.{MANIFEST_TABLE} (identificacao, partition_key, rows, checksum, loaded_at)
+            SELECT :id, {coluna}::text, count(*), NULL, now()
+            FROM {schema}.{table}
+            WHERE {coluna} IS NOT NULL
+            GROUP BY {coluna}
+            ON CONFLICT DO NOTHING
+        """), {"id": identificacao}).rowcount
+    logger.info(f"Manifesto semeado para {identificacao}: {n} partições de {schema}.{table}.")
+
+
+def dias_pendentes(engine, schema, identificacao, inicio, fim):
+    """Datas entre inicio e fim (inclusive) sem carga registrada no manifesto. Uma única consulta."""
+    with engine.connect() as conn:
+        rows = conn.execute(text(f"""
+            SELECT d::date FROM generate_series(CAST(:ini AS date), CAST(:fim AS date), interval '1 day') d
+            EXCEPT
+            SELECT partition_key::date FROM {schema}.{MANIFEST_TABLE} WHERE identificacao = :id
+            ORDER BY 1
+        """), {"ini": inicio, "fim": fim, "id": identificacao})
+        return [r[0] for r in rows]
@@ -0,0 +1,135 @@
+"""
+Carga por merge (upsert pela chave natural) em vez de DROP + CREATE.
+Os dados novos vão para uma tabela temporária e só as linhas alteradas são tocadas no destino:
+dependências (views, sessões do Power BI) continuam de pé e o WAL fica proporcional à mudança.
+
+Todas as funções recebem um cursor psycopg2 e rodam dentro da transação do chamador.
+"""
+
+import logging
+
+logger = logging.getLogger("useall_pipeline")
+
+
+def colunas_tabela(cur, relacao):
+    """[(coluna, tipo)] da relação, na ordem das colunas."""
+    cur.execute(
+        "SELECT attname, format_type(atttypid, atttypmod) FROM pg_attribute "
+        "WHERE attrelid = %s::regclass AND attnum > 0 AND NOT attisdropped ORDER BY attnum",
+        (relacao,),
+    )
+    return cur.fetchall()
+
+
+def tabela_existe(cur, relacao):
+    """relacao (schema."nome") existe?"""
+    cur.execute("SELECT to_regclass(%s)", (relacao,))
+    return cur.fetchone()[0] is not None
+
+
+def sincronizar_colunas(cur, alvo, tmp):
+    """
+    Acrescenta no destino as colunas novas da origem. Retorna False se alguma coluna mudou de tipo.
+    Colunas que só existem no destino são mantidas (ficam NULL nas linhas novas).
+    """
+    destino = dict(colunas_tabela(cur, alvo))
+    for c, tipo in colunas_tabela(cur, tmp):
+        if c not in destino:
+            cur.execute(f'ALTER TABLE {alvo} ADD COLUMN "{c}" {tipo}')
+        elif destino[c] != tipo:
+            return False
+    return True
+
+
+def _chave_duplicada(cur, tmp, keys):
+    grupo = ", ".join(f'"{k}"' for k in keys)
+    cur.execute(f"SELECT 1 FROM {tmp} GROUP BY {grupo} HAVING count(*) > 1 LIMIT 1")
+    return cur.fetchone() is not None
+
+
+def merge_temp(cur, schema, table, tmp, keys=None, delete_missing=True):
+    """
+    Aplica o conteúdo de `tmp` em schema.table.
+    - destino inexistente ou com coluna de outro tipo: CREATE TABLE AS (no 2º caso, DROP ... CASCADE antes, com aviso);
+    - com chave única em `tmp`: DELETE das chaves ausentes (se delete_missing), UPDATE só das linhas
+      diferentes e INSERT das chaves novas;
+    - sem chave declarada (ou chave ausente/repetida): TRUNCATE + INSERT, preservando o objeto.
+    Retorna {"inserted", "updated", "deleted", "unchanged", "modo"}.
+    """
+    alvo = f'{schema}."{table}"'
+    cur.execute(f"ANALYZE {tmp}")
+    cur.execute(f"SELECT count(*) FROM {tmp}")
+    total = cur.fetchone()[0]
+    stats = {"inserted": 0, "updated": 0, "deleted": 0, "unchanged": 0, "modo": "merge"}
+
+    if tabela_existe(cur, alvo) and not sincronizar_colunas(cur, alvo, tmp):
+        logger.warning(f"Estrutura de {alvo} mudou. Recriando a tabela.")
+        cur.execute(f"DROP TABLE {alvo} CASCADE")
+
+    if not tabela_existe(cur, alvo):
+        cur.execute(f"CREATE TABLE {alvo} AS SELECT * FROM {tmp}")
+        stats.update(inserted=total, modo="criacao")
+        return _log(alvo, stats)
+
+    colunas = [c for c, _ in colunas_tabela(cur, tmp)]
+    cols = ", ".join(f'"{c}"' for c in colunas)
+
+    if keys and any(k not in colunas for k in keys):
+        logger.warning(f"Chave {keys} ausente em {alvo}. Substituindo o conteúdo.")
+        keys = None
+    if keys and _chave_duplicada(cur, tmp, keys):
+        logger.warning(f"Chave {keys} não é única em {alvo}. Substituindo as chaves recebidas.")
+        if not delete_missing:
+            # delta: troca todas as versões das chaves recebidas
+            on = " AND ".join(f't."{k}" = s."{k}"' for k in keys)
+            cur.execute(f"DELETE FROM {alvo} t USING {tmp} s WHERE {on}")
+            stats["deleted"] = cur.rowcount
+        keys = None
+
+    if not keys:
+        if delete_missing:
+            cur.execute(f"TRUNCATE {alvo}")
+        cur.execute(f"INSERT INTO {alvo} ({cols}) SELECT {cols} FROM {tmp}")
+        stats.update(inserted=cur.rowcount, modo="substituicao")
+        return _log(alvo, stats)
+
+    on = " AND ".join(f't."{k}" = s."{k}"' for k in keys)
+
+    if delete_missing:
+        cur.execute(f"DELETE FROM {alvo} t WHERE NOT EXISTS (SELECT 1 FROM {tmp} s WHERE {on})")
+        stats["deleted"] = cur.rowcount
+
+    valores = [c for c in colunas if c not in keys]
+    if valores:
+        sets = ", ".join(f'"{c}" = s."{c}"' for c in valores)
+        antes = ", ".join(f't."{c}"' for c in valores)
+        depois = ", ".join(f's."{c}"' for c in valores)
+        cur.execute(
+            f"UPDATE {alvo} t SET {sets} FROM {tmp} s "
+            f"WHERE {on} AND ROW({antes}) IS DISTINCT FROM ROW({depois})"
+        )
+        stats["updated"] = cur.rowcount
+
+    cur.execute(
+        f"INSERT INTO {alvo} ({cols}) SELECT {cols} FROM {tmp} s "
+        f"WHERE NOT EXISTS (SELECT 1 FROM {alvo} t WHERE {on})"
+    )
+    stats["inserted"] = cur.rowcount
+    stats["unchanged"] = total - stats["inserted"] - stats["updated"]
+    return _log(alvo, stats)
+
+
+def merge_select(cur, schema, table, select_sql, keys=None, delete_missing=True):
+    """Materializa `select_sql` em uma tabela temporária e aplica em schema.table via merge_temp."""
+    tmp = f'"_merge_{table}"'
+    cur.execute(f"DROP TABLE IF EXISTS {tmp}")
+    cur.execute(f"CREATE TEMP TABLE {tmp} ON COMMIT DROP AS {select_sql.strip().rstrip(';')}")
+    return merge_temp(cur, schema, table, tmp, keys, delete_missing)
+
+
+def _log(alvo, stats):
+    logger.info(
+        f"{alvo} [{stats['modo']}]: {stats['inserted']} inseridas, {stats['updated']} atualizadas, "
+        f"{stats['deleted']} removidas, {stats['unchanged']} inalteradas."
+    )
+    return stats
@@ -0,0 +1,221 @@
+"""
+Métricas de execução: uma linha por (execução, etapa, identificação) em pipeline_metrics.
+medir() abre um escopo (task, identificação, passo gold); cliente, loader e gold somam contadores no
+escopo ativo e cada escopo repassa os seus ao escopo de cima. Exportação opcional para StatsD/OpenTelemetry.
+"""
+
+import os
+import json
+import time
+import socket
+import logging
+import threading
+import contextvars
+from contextlib import contextmanager
+
+from sqlalchemy import text # type: ignore
+
+try:
+    from opentelemetry import metrics as otel_metrics # type: ignore
+except ImportError:  # exportação OTel desativada
+    otel_metrics = None
+
+logger = logging.getLogger("useall_pipeline")
+
+METRICS_TABLE = "pipeline_metrics"
+
+# "", "statsd" ou "otel" (o OTel usa o MeterProvider configurado no processo)
+METRICS_EXPORT = os.getenv("USEALL_METRICS_EXPORT", "").lower()
+STATSD_HOST = os.getenv("USEALL_STATSD_HOST", "localhost")
+STATSD_PORT = int(os.getenv("USEALL_STATSD_PORT", "8125"))
+STATSD_PREFIX = os.getenv("USEALL_STATSD_PREFIX", "useall")
+
+# Contadores somados pelo cliente (API), pelo loader (COPY) e pela gold
+CONTADORES = ("linhas", "requisicoes", "latencia_api_s", "bytes", "http_429", "retentativas", "carga_s")
+
+if METRICS_EXPORT == "otel" and otel_metrics is None:
+    logger.warning("opentelemetry não instalado: métricas ficam só em pipeline_metrics.")
+
+_ATUAL = contextvars.ContextVar("useall_medicao", default=None)
+
+
+def ensure_metrics(engine, schema):
+    with engine.begin() as conn:
+        conn.execute(text(f"""
+            CREATE TABLE IF NOT EXISTS {schema}.{METRICS_TABLE} (
+                id BIGSERIAL PRIMARY KEY,
+                run_id TEXT,
+                etapa TEXT NOT NULL,
+                identificacao TEXT,
+                duracao_s DOUBLE PRECISION,
+                linhas BIGINT,
+                detalhes JSONB,
+                registrado_em TIMESTAMP NOT NULL DEFAULT now()
+            )
+        """))
+        conn.execute(text(f"CREATE INDEX IF NOT EXISTS ix_{METRICS_TABLE}_run_id ON {schema}.{METRICS_TABLE} (run_id)"))
+        # Contadores do JSONB em colunas, para comparar execuções sem ->> em toda consulta
+        conn.execute(text(f"""
+            CREATE OR REPLACE VIEW {schema}.vw_{METRICS_TABLE} AS
+            SELECT id, run_id, etapa, identificacao, duracao_s, linhas,
+                   (detalhes->>'requisicoes')::bigint AS requisicoes,
+                   (detalhes->>'latencia_api_s')::float8 AS latencia_api_s,
+                   (detalhes->>'latencia_api_s')::float8 / NULLIF((detalhes->>'requisicoes')::float8, 0) AS latencia_media_s,
+                   (detalhes->>'bytes')::bigint AS bytes,
+                   (detalhes->>'http_429')::bigint AS http_429,
+                   (detalhes->>'retentativas')::bigint AS retentativas,
+                   (detalhes->>'carga_s')::float8 AS carga_s,
+                   detalhes->>'erro' AS erro,
+                   detalhes, registrado_em
+            FROM {schema}.{METRICS_TABLE}
+        """))
+
+
+def metrica_insert(schema):
+    """SQL (estilo psycopg2) para registrar uma métrica; pode rodar na mesma transação da carga."""
+    return f"""
+        INSERT INTO {schema}.{METRICS_TABLE} (run_id, etapa, identificacao, duracao_s, linhas, detalhes)
+        VALUES (%s, %s, %s, %s, %s, %s)
+    """
+
+
+def metrica_params(run_id, etapa, identificacao, duracao_s=None, linhas=None, **detalhes):
+    return (run_id, etapa, identificacao, duracao_s, linhas, json.dumps(detalhes, default=str) if detalhes else None)
+
+
+# ================= ESCOPOS DE MEDIÇÃO =================
+
+class Medicao:
+    """Contadores de um escopo; somar() repassa os valores aos escopos acima (thread-safe)."""
+
+    def __init__(self, etapa, identificacao=None, pai=None, engine=None, schema=None, run_id=None, **extras):
+        self.etapa = etapa
+        self.identificacao = identificacao
+        self.pai = pai
+        self.engine = engine or (pai.engine if pai else None)
+        self.schema = schema or (pai.schema if pai else None)
+        self.run_id = run_id or (pai.run_id if pai else None)
+        self.extras = extras
+        self.contadores = dict.fromkeys(CONTADORES, 0)
+        self.duracao_s = None
+        self._lock = threading.Lock()
+
+    def somar(self, **valores):
+        m = self
+        while m is not None:
+            with m._lock:
+                for k, v in valores.items():
+                    m.contadores[k] = m.contadores.get(k, 0) + (v or 0)
+            m = m.pai
+
+
+def somar(**valores):
+    """Soma contadores no escopo ativo (nada acontece fora de medir)."""
+    m = _ATUAL.get()
+    if m is not None:
+        m.somar(**valores)
+
+
+def propagar(func):
+    """func para rodar em outra thread dentro do escopo atual (ThreadPoolExecutor não herda contextvars)."""
+    m = _ATUAL.get()
+    if m is None:
+        return func
+
+    def _no_escopo(*args, **kwargs):
+        token = _ATUAL.set(m)
+        try:
+            return func(*args, **kwargs)
+        finally:
+            _ATUAL.reset(token)
+    return _no_escopo
+
+
+@contextmanager
+def medir(etapa, identificacao=None, engine=None, schema=None, run_id=None, limiter=None, **extras):
+    """
+    Escopo medido: tempo de parede + contadores somados dentro dele, gravados em pipeline_metrics na saída
+    (também em caso de erro). engine/schema/run_id vêm do escopo de cima quando omitidos; sem engine, só exporta.
+    limiter: registra a variação de limiter.stats (requisições, 429 e retentativas de todo o processo).
+    """
+    m = Medicao(etapa, identificacao, _ATUAL.get(), engine, schema, run_id, **extras)
+    token = _ATUAL.set(m)
+    antes = dict(limiter.stats) if limiter else None
+    inicio = time.time()
+    try:
+        yield m
+    except Exception as e:
+        m.extras["erro"] = f"{type(e).__name__}: {e}"[:500]
+        raise
+    finally:
+        _ATUAL.reset(token)
+        m.duracao_s = time.time() - inicio
+        if limiter:
+            m.extras["limitador"] = {k: v - antes.get(k, 0) for k, v in limiter.stats.items()}
+        registrar(m)
+        exportar(m)
+
+
+def registrar(m):
+    if m.engine is None:
+        return
+    contadores = {k: v for k, v in m.contadores.items() if v and k != "linhas"}
+    try:
+        with m.engine.begin() as conn:
+            conn.exec_driver_sql(metrica_insert(m.schema), metrica_params(
+                m.run_id, m.etapa, m.identificacao, m.duracao_s, m.contadores["linhas"], **contadores, **m.extras,
+            ))
+    except Exception as e:
+        # Métrica é só observação: a carga segue mesmo sem gravar
+        logger.warning(f"Falha ao gravar métrica {m.etapa}/{m.identificacao}: {e}")
+
+
+# ================= EXPORTAÇÃO =================
+
+_statsd = None
+_otel = {}
+_otel_lock = threading.Lock()
+
+
+def _nome_statsd(*partes):
+    return ".".join(str(p).replace(".", "_").replace(":", "_") for p in partes if p)
+
+
+def _exportar_statsd(m):
+    global _statsd
+    if _statsd is None:
+        _statsd = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    base = _nome_statsd(STATSD_PREFIX, m.etapa, m.identificacao)
+    linhas = [f"{base}.duracao:{m.duracao_s * 1000:.0f}|ms"]
+    for k, v in m.contadores.items():
+        if v:
+            linhas.append(f"{base}.{k}:{v * 1000:.0f}|ms" if k.endswith("_s") else f"{base}.{k}:{v}|c")
+    _statsd.sendto("\n".join(linhas).encode(), (STATSD_HOST, STATSD_PORT))
+
+
+def _exportar_otel(m):
+    with _otel_lock:
+        if not _otel:
+            meter = otel_metrics.get_meter("useall_pipeline")
+            _otel["duracao"] = meter.create_histogram("useall.duracao", unit="s")
+            for k in CONTADORES:
+                _otel[k] = (meter.create_histogram(f"useall.{k}", unit="s") if k.endswith("_s")
+                            else meter.create_counter(f"useall.{k}"))
+    atributos = {"etapa": m.etapa, "identificacao": m.identificacao or ""}
+    _otel["duracao"].record(m.duracao_s, atributos)
+    for k, v in m.contadores.items():
+        if v:
+            instrumento = _otel[k]
+            (instrumento.record if k.endswith("_s") else instrumento.add)(v, atributos)
+
+
+def exportar(m):
+    if not METRICS_EXPORT:
+        return
+    try:
+        if METRICS_EXPORT == "statsd":
+            _exportar_statsd(m)
+        elif METRICS_EXPORT == "otel" and otel_metrics is not None:
+            _exportar_otel(m)
+    except Exception as e:
+        logger.warning(f"Falha ao exportar métrica {m.etapa}/{m.identificacao}: {e}")
@@ -0,0 +1,187 @@
+"""
+Limitador de requisições à API Useall (token bucket adaptativo).
+Compartilhado por todas as threads/tasks do processo: um 429 pausa todo mundo uma única vez,
+em vez de cada worker dormir 185s por conta própria.
+
+- Respeita Retry-After e X-RateLimit-Remaining/Reset quando a Useall enviar.
+- Sem cabeçalhos, aprende o limite: reduz a taxa pela metade a cada 429 e volta a subir aos poucos.
+- Backoff exponencial com jitter para 429 sem Retry-After e para timeouts.
+- O relógio é injetável (SimulatedClock) para rodar contra um servidor stub sem esperar de verdade.
+"""
+
+import os
+import time
+import random
+import threading
+import logging
+from email.utils import parsedate_to_datetime
+from datetime import datetime, timezone
+
+logger = logging.getLogger("useall_pipeline")
+
+
+# ================= RELÓGIOS =================
+
+class Clock:
+    """Relógio real."""
+
+    def now(self):
+        return time.monotonic()
+
+    def epoch(self):
+        """Segundos desde 1970 (para cabeçalhos com horário absoluto, como X-RateLimit-Reset)."""
+        return time.time()
+
+    def sleep(self, seconds):
+        if seconds > 0:
+            time.sleep(seconds)
+
+
+class SimulatedClock(Clock):
+    """Relógio simulado (dry-run): sleep apenas avança o tempo e registra a espera."""
+
+    def __init__(self, start=0.0, epoch=None):
+        self._t = start
+        self._inicio = start
+        self._epoch = time.time() if epoch is None else epoch
+        self._lock = threading.Lock()
+        self.slept = []
+
+    def now(self):
+        with self._lock:
+            return self._t
+
+    def epoch(self):
+        return self._epoch + (self.now() - self._inicio)
+
+    def sleep(self, seconds):
+        if seconds > 0:
+            with self._lock:
+                self._t += seconds
+                self.slept.append(seconds)
+
+
+# ================= LIMITADOR =================
+
+def parse_retry_after(value, now_utc=None):
+    """Retry-After em segundos ou data HTTP. Retorna segundos ou None."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        quando = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    now_utc = now_utc or datetime.now(timezone.utc)
+    return max(0.0, (quando - now_utc).total_seconds())
+
+
+class RateLimiter:
+    """
+    Token bucket com taxa adaptativa (AIMD) e pausa global.
+    rate = requisições/segundo, burst = capacidade do balde.
+    """
+
+    def __init__(self, rate, burst, min_rate=None, max_rate=None,
+                 backoff_base=15.0, backoff_max=185.0, clock=None, rng=None):
+        self.clock = clock or Clock()
+        self.rate = rate
+        self.burst = burst
+        self.min_rate = min_rate or rate / 16
+        self.max_rate = max_rate or rate * 4
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self._rng = rng or random.Random()
+        self._lock = threading.Lock()
+        self._tokens = float(burst)
+        self._last = self.clock.now()
+        self._paused_until = 0.0
+        self._falhas = 0
+        self.stats = {"requests": 0, "429": 0, "retries": 0}
+
+    def _refill(self, now):
+        self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate)
+        self._last = now
+
+    def acquire(self):
+        """Bloqueia até existir token e não houver pausa global ativa."""
+        while True:
+            with self._lock:
+                now = self.clock.now()
+                self._refill(now)
+                if now < self._paused_until:
+                    wait = self._paused_until - now
+                elif self._tokens >= 1:
+                    self._tokens -= 1
+                    self.stats["requests"] += 1
+                    return
+                else:
+                    wait = (1 - self._tokens) / self.rate
+            self.clock.sleep(wait)
+
+    def pause(self, seconds):
+        """Pausa global. Pausas sobrepostas não se somam."""
+        with self._lock:
+            until = self.clock.now() + seconds
+            if until > self._paused_until:
+                self._paused_until = until
+                logger.warning(f"Rate limit: pausa global de {seconds:.0f}s.")
+
+    def backoff_delay(self, tentativa):
+        """Backoff exponencial com jitter total: uniforme em [0, min(max, base * 2^n)]."""
+        teto = min(self.backoff_max, self.backoff_base * (2 ** max(0, tentativa - 1)))
+        return self._rng.uniform(0, teto)
+
+    def on_response(self, response):
+        """Ajusta o limitador a partir do status e dos cabeçalhos de rate limit."""
+        headers = response.headers or {}
+
+        if response.status_code == 429:
+            with self._lock:
+                self._falhas += 1
+                falhas = self._falhas
+                self.stats["429"] += 1
+                self.stats["retries"] += 1
+                self.rate = max(self.min_rate, self.rate / 2)
+            espera = parse_retry_after(headers.get("Retry-After"))
+            if espera is None:
+                espera = self.backoff_delay(falhas)
+            logger.warning(f"429 recebido. Nova taxa {self.rate:.3f} req/s.")
+            self.pause(espera)
+            return
+
+        with self._lock:
+            self._falhas = 0
+            # aumento aditivo: ~ +1 requisição por minuto a cada sucesso
+            self.rate = min(self.max_rate, self.rate + 1 / 60)
+
+        restantes = headers.get("X-RateLimit-Remaining")
+        reset = headers.get("X-RateLimit-Reset")
+        if restantes is not None and reset is not None:
+            try:
+                if int(float(restantes)) <= 0:
+                    reset = float(reset)
+                    # reset pode vir como epoch ou como segundos restantes
+                    if reset > 1e9:
+                        reset -= self.clock.epoch()
+                    self.pause(max(0.0, reset))
+            except ValueError:
+                pass
+
+    def on_timeout(self, tentativa):
+        """Espera com backoff antes de reenviar uma requisição que estourou o timeout."""
+        with self._lock:
+            self.stats["retries"] += 1
+        espera = self.backoff_delay(tentativa)
+        logger.warning(f"Timeout (tentativa {tentativa}). Aguardando {espera:.0f}s.")
+        self.clock.sleep(espera)
+
+
+# Instância única usada por todas as extrações do processo
+LIMITER = RateLimiter(
+    rate=float(os.getenv("USEALL_REQS_POR_JANELA", "10")) / float(os.getenv("USEALL_JANELA_SEGUNDOS", "60")),
+    burst=int(os.getenv("USEALL_BURST", "3")),
+)
@@ -0,0 +1,179 @@
+"""
+Raw zone local: cada resposta da Useall é gravada em Parquet particionado no estilo Hive
+(identificacao=<id>/data=<AAAA-MM-DD>/<particao>-<carimbo>-<n>.parquet) a caminho do Postgres.
+Replays e reconstruções da silver/gold leem daqui (pyarrow.dataset, lote a lote e com projeção),
+sem tocar na API.
+"""
+
+import os
+import re
+import glob
+import time
+import shutil
+import logging
+from contextlib import contextmanager
+from datetime import date, datetime
+
+try:
+    import pyarrow as pa # type: ignore
+    import pyarrow.dataset as ds # type: ignore
+    import pyarrow.parquet as pq # type: ignore
+except ImportError:  # raw zone desativada; a extração segue direto para o Postgres
+    pa = None
+
+import pandas as pd # type: ignore
+
+from useall_arrow import ARROW, como_texto, lote_para_arrow, para_pandas
+
+logger = logging.getLogger("useall_pipeline")
+
+RAW_DIR = os.getenv("USEALL_RAW_DIR") or os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "data", "raw")
+RAW_ZONE = os.getenv("USEALL_RAW_ZONE", "1").lower() in ("1", "true", "sim")
+RAW_BATCH_SIZE = int(os.getenv("USEALL_BATCH_SIZE", "50000"))
+# Dias que um Parquet fica na raw zone (0 = sem limite); o necessário para o replay nunca sai
+RAW_RETENCAO_DIAS = int(os.getenv("USEALL_RAW_RETENCAO_DIAS", "90"))
+
+_DATA_ISO = re.compile(r"\d{4}-\d{2}-\d{2}")
+
+
+def _para_arrow(lote):
+    """Lote (lista de dicts, DataFrame ou Table) -> pyarrow.Table só com strings, como as colunas TEXT da staging."""
+    return como_texto(lote_para_arrow(lote))
+
+
+class RawZone:
+    def __init__(self, base_dir=RAW_DIR, ativo=RAW_ZONE):
+        self.base_dir = os.path.abspath(base_dir)
+        self.ativo = ativo and pa is not None
+        if ativo and pa is None:
+            logger.warning("pyarrow não instalado: raw zone desativada.")
+
+    def _dir(self, identificacao, data):
+        return os.path.join(self.base_dir, f"identificacao={identificacao}", f"data={data}")
+
+    @contextmanager
+    def pouso(self, identificacao, particao, substituir=True):
+        """
+        Grava os lotes de uma carga em Parquet e só os publica quando o bloco termina sem erro, isto é,
+        depois do commit do COPY feito dentro dele. Falha no stream ou no banco: nada é publicado e a
+        versão anterior fica. A data da partição Hive é a própria particao quando ela é uma data
+        (estoque diário); senão, o dia da extração.
+        Uso: with RAW.pouso(id, particao) as gravar: copy_batches_to_postgres(gravar(lotes), ...)
+        gravar repassa os lotes adiante; com USEALL_ARROW, a própria Table já convertida.
+        """
+        if not self.ativo:
+            yield lambda lotes: lotes
+            return
+
+        data = particao if _DATA_ISO.fullmatch(str(particao)) else date.today().isoformat()
+        destino = self._dir(identificacao, data)
+        carimbo = datetime.now().strftime("%H%M%S%f")
+        tmp = os.path.join(destino, f".tmp-{particao}-{carimbo}")  # prefixo "." é ignorado pelo pyarrow.dataset
+        os.makedirs(tmp, exist_ok=True)
+        linhas = [0]
+
+        def gravar(lotes):
+            for n, lote in enumerate(lotes):
+                tabela = _para_arrow(lote)
+                if tabela.num_rows:
+                    pq.write_table(tabela, os.path.join(tmp, f"{particao}-{carimbo}-{n:05d}.parquet"))
+                    linhas[0] += tabela.num_rows
+                yield tabela if ARROW else lote
+
+        try:
+            yield gravar
+            # Carga vazia não vai ao banco (rollback): a versão anterior continua valendo aqui também
+            if linhas[0]:
+                if substituir:
+                    for antigo in glob.glob(os.path.join(destino, f"{glob.escape(str(particao))}-*.parquet")):
+                        os.remove(antigo)
+                for arquivo in os.listdir(tmp):
+                    os.replace(os.path.join(tmp, arquivo), os.path.join(destino, arquivo))
+                logger.info(f"Raw zone: {identificacao}/{data}/{particao} ({linhas[0]} linhas).")
+        finally:
+            shutil.rmtree(tmp, ignore_errors=True)
+
+    def versoes(self, identificacao, particao=None):
+        """[(data, particao, carimbo, [arquivos])] em ordem cronológica."""
+        grupos = {}
+        padrao = os.path.join(self.base_dir, f"identificacao={identificacao}", "data=*", "*.parquet")
+        for arquivo in glob.glob(padrao):
+            data = os.path.basename(os.path.dirname(arquivo))[len("data="):]
+            nome_particao, carimbo, _ = os.path.basename(arquivo).rsplit("-", 2)
+            if particao is None or nome_particao == particao:
+                grupos.setdefault((data, carimbo, nome_particao), []).append(arquivo)
+        return [(d, p, c, sorted(arqs)) for (d, c, p), arqs in sorted(grupos.items())]
+
+    def ultima(self, identificacao, particao):
+        """Arquivos da versão mais recente da particao ([] se não houver)."""
+        versoes = self.versoes(identificacao, particao)
+        return versoes[-1][3] if versoes else []
+
+    def ler(self, arquivos, colunas=None, batch_size=RAW_BATCH_SIZE):
+        """Lê os arquivos como um dataset (schemas unificados) e gera lotes (Table com USEALL_ARROW, senão DataFrame)."""
+        if not arquivos:
+            return
+        schema = pa.unify_schemas([pq.read_schema(a) for a in arquivos])
+        dataset = ds.dataset(arquivos, schema=schema, format="parquet")
+        projecao = [c for c in colunas if c in schema.names] if colunas else None
+        for lote in dataset.to_batches(columns=projecao, batch_size=batch_size):
+            if lote.num_rows:
+                yield pa.Table.from_batches([lote]) if ARROW else lote.to_pandas()
+
+    def ler_df(self, arquivos, colunas=None):
+        lotes = list(self.ler(arquivos, colunas))
+        if not lotes:
+            return pd.DataFrame()
+        if ARROW:
+            return para_pandas(pa.concat_tables(lotes))
+        return pd.concat(lotes, ignore_index=True)
+
+    def historico(self, identificacao):
+        """Para replay de cargas incrementais: a última carga completa e os deltas posteriores, em ordem."""
+        versoes = self.versoes(identificacao)
+        completas = [i for i, v in enumerate(versoes) if v[1] == "full"]
+        inicio = completas[-1] if completas else 0
+        return [(p, arqs) for _, p, _, arqs in versoes[inicio:] if p in ("full", "delta")]
+
+
+    def podar(self, dias=RAW_RETENCAO_DIAS, agora=None):
+        """
+        Remove os Parquet gravados há mais de `dias` (0 = guarda tudo) e as pastas .tmp de execuções
+        interrompidas. Preserva o que o replay lê: a última versão de cada partição que não é data e a
+        última carga completa com os deltas seguintes (historico). Retorna quantos arquivos saíram.
+        """
+        if not self.ativo or dias <= 0 or not os.path.isdir(self.base_dir):
+            return 0
+        agora = agora or time.time()
+        corte = agora - dias * 86400
+        removidos = 0
+        for pasta in glob.glob(os.path.join(self.base_dir, "identificacao=*")):
+            identificacao = os.path.basename(pasta)[len("identificacao="):]
+            versoes = self.versoes(identificacao)
+            ultimas = {p: arqs for _, p, _, arqs in versoes if not _DATA_ISO.fullmatch(p)}
+            manter = {a for arqs in ultimas.values() for a in arqs}
+            manter.update(a for _, arqs in self.historico(identificacao) for a in arqs)
+            for _, _, _, arqs in versoes:
+                for arquivo in arqs:
+                    if arquivo not in manter and os.path.getmtime(arquivo) < corte:
+                        os.remove(arquivo)
+                        removidos += 1
+            # .tmp de mais de um dia: processo morto no meio da carga (nada foi publicado)
+            for tmp in glob.glob(os.path.join(pasta, "data=*", ".tmp-*")):
+                if os.path.getmtime(tmp) < agora - 86400:
+                    shutil.rmtree(tmp, ignore_errors=True)
+            for dia in glob.glob(os.path.join(pasta, "data=*")):
+                if not os.listdir(dia):
+                    os.rmdir(dia)
+        if removidos:
+            logger.info(f"Raw zone: {removidos} arquivos com mais de {dias} dias removidos.")
+        return removidos
+
+
+def replay_solicitado(context):
+    """Replay da raw zone via conf da DAG ({"replay_raw": true}) ou USEALL_REPLAY_RAW=1."""
+    dag_run = context.get("dag_run")
+    conf = getattr(dag_run, "conf", None) or {}
+    if conf.get("replay_raw"):
+        return True
+    return os.getenv("USEALL_REPLAY_RAW", "0").lower() in ("1", "true", "sim")
@@ -0,0 +1,200 @@
+"""
+Perfil de extração por identificação (suporta pagina/qtderegistros? em quantas partes dividir?)
+e divisão dos filtros da Useall em partes menores por lista de IDFILIAL ou intervalo de DATA.
+O perfil fica em extraction_perfil para as próximas execuções não redescobrirem tudo.
+"""
+
+import os
+import re
+import threading
+import logging
+from datetime import datetime, timedelta
+
+from sqlalchemy import text # type: ignore
+
+logger = logging.getLogger("useall_pipeline")
+
+PERFIL_TABLE = "extraction_perfil"
+
+# Tamanho padrão das partes para endpoints sem paginação (0 desliga a divisão por aquele eixo)
+SPLIT_FILIAIS = int(os.getenv("USEALL_SPLIT_FILIAIS", "5"))
+SPLIT_DIAS = int(os.getenv("USEALL_SPLIT_DIAS", "365"))
+
+_INTERVALO = re.compile(r"^\s*(\d{2}/\d{2}/\d{4})\s*,\s*(\d{2}/\d{2}/\d{4})\s*$")
+_IN_FILIAL = re.compile(r"(IDFILIAL\s+IN\s*\()([\d\s,]+)(\))", re.IGNORECASE)
+_FMT = "%d/%m/%Y"
+
+
+# ================= PERFIL =================
+
+def ensure_perfil(engine, schema):
+    with engine.begin() as conn:
+        conn.execute(text(f"""
+            CREATE TABLE IF NOT EXISTS {schema}.{PERFIL_TABLE} (
+                identificacao TEXT PRIMARY KEY,
+                paginavel BOOLEAN,
+                tamanho_pagina INT,
+                filiais_por_parte INT,
+                dias_por_parte INT,
+                updated_at TIMESTAMP NOT NULL DEFAULT now()
+            )
+        """))
+
+
+class PerfisExtracao:
+    """Cache em memória (thread-safe) do extraction_perfil; sem engine, vale só para o processo."""
+
+    CAMPOS = ("paginavel", "tamanho_pagina", "filiais_por_parte", "dias_por_parte")
+
+    def __init__(self, engine=None, schema=None):
+        self.engine = engine
+        self.schema = schema
+        self._perfis = None
+        self._lock = threading.Lock()
+
+    def _carregar(self):
+        if self._perfis is not None:
+            return
+        self._perfis = {}
+        if self.engine is None:
+            return
+        try:
+            with self.engine.connect() as conn:
+                linhas = conn.execute(text(
+                    f"SELECT identificacao, {', '.join(self.CAMPOS)} FROM {self.schema}.{PERFIL_TABLE}"
+                )).fetchall()
+        except Exception as e:
+            logger.warning(f"Perfis de extração indisponíveis ({e}). Redescobrindo.")
+            return
+        for identificacao, *valores in linhas:
+            self._perfis[identificacao] = {c: v for c, v in zip(self.CAMPOS, valores) if v is not None}
+
+    def get(self, identificacao):
+        with self._lock:
+            self._carregar()
+            return dict(self._perfis.get(identificacao, {}))
+
+    def atualizar(self, identificacao, **campos):
+        with self._lock:
+            self._carregar()
+            perfil = self._perfis.setdefault(identificacao, {})
+            if all(perfil.get(c) == v for c, v in campos.items()):
+                return
+            perfil.update(campos)
+            valores = [perfil.get(c) for c in self.CAMPOS]
+        logger.info(f"Perfil de extração {identificacao}: {campos}.")
+        if self.engine is None:
+            return
+        try:
+            with self.engine.begin() as conn:
+                conn.execute(text(f"""
+                    INSERT INTO {self.schema}.{PERFIL_TABLE} (identificacao, {', '.join(self.CAMPOS)}, updated_at)
+                    VALUES (:id, {', '.join(':' + c for c in self.CAMPOS)}, now())
+                    ON CONFLICT (identificacao) DO UPDATE SET
+                        {', '.join(f'{c} = EXCLUDED.{c}' for c in self.CAMPOS)},
+                        updated_at = EXCLUDED.updated_at
+                """), {"id": identificacao, **dict(zip(self.CAMPOS, valores))})
+        except Exception as e:
+            # Perfil é só otimização: a extração segue mesmo sem persistir
+            logger.warning(f"Falha ao gravar perfil de {identificacao}: {e}")
+
+
+# ================= DIVISÃO DE FILTROS =================
+
+def filtro_filiais(filtros):
+    """Índice do filtro IDFILIAL com lista de ids (None se não houver)."""
+    for i, f in enumerate(filtros or []):
+        if str(f.get("Nome", "")).lower() == "idfilial" and isinstance(f.get("Valor"), list):
+            return i
+    return None
+
+
+def filtro_datas(filtros):
+    """Índice do filtro de intervalo "dd/mm/aaaa,dd/mm/aaaa" (prefere o de nome DATA)."""
+    candidatos = [i for i, f in enumerate(filtros or []) if isinstance(f.get("Valor"), str) and _INTERVALO.match(f["Valor"])]
+    for i in candidatos:
+        if str(filtros[i].get("Nome", "")).upper() == "DATA":
+            return i
+    return candidatos[0] if candidatos else None
+
+
+def intervalo(filtros, i):
+    ini, fim = _INTERVALO.match(filtros[i]["Valor"]).groups()
+    return datetime.strptime(ini, _FMT).date(), datetime.strptime(fim, _FMT).date()
+
+
+def com_filiais(filtros, ids):
+    """Cópia dos filtros restrita a ids (lista IDFILIAL e o IDFILIAL IN (...) do FILTROSWHERE, se houver)."""
+    i = filtro_filiais(filtros)
+    todos = {int(x) for x in filtros[i]["Valor"]}
+    novos = []
+    for j, f in enumerate(filtros):
+        f = dict(f)
+        if j == i:
+            f["Valor"] = list(ids)
+        elif isinstance(f.get("Valor"), str):
+            def _trocar(m):
+                no_texto = {int(x) for x in re.findall(r"\d+", m.group(2))}
+                return f"{m.group(1)}{','.join(map(str, ids))}{m.group(3)}" if no_texto == todos else m.group(0)
+            f["Valor"] = _IN_FILIAL.sub(_trocar, f["Valor"])
+        novos.append(f)
+    return novos
+
+
+def com_datas(filtros, ini, fim):
+    i = filtro_datas(filtros)
+    novos = [dict(f) for f in filtros]
+    novos[i]["Valor"] = f"{ini.strftime(_FMT)},{fim.strftime(_FMT)}"
+    return novos
+
+
+def dividir(filtros, filiais_por_parte=SPLIT_FILIAIS, dias_por_parte=SPLIT_DIAS):
+    """
+    Partes (listas de filtros) que somadas cobrem a consulta original: pela lista de IDFILIAL
+    quando houver, senão pelo intervalo de DATA (limites inclusivos, sem sobreposição).
+    Sem eixo divisível ou com a consulta já menor que a parte, devolve [filtros].
+    """
+    i = filtro_filiais(filtros)
+    if i is not None and filiais_por_parte and len(filtros[i]["Valor"]) > filiais_por_parte:
+        ids = filtros[i]["Valor"]
+        return [com_filiais(filtros, ids[k:k + filiais_por_parte]) for k in range(0, len(ids), filiais_por_parte)]
+
+    i = filtro_datas(filtros)
+    if i is not None and dias_por_parte:
+        ini, fim = intervalo(filtros, i)
+        partes = []
+        while ini <= fim:
+            ate = min(fim, ini + timedelta(days=dias_por_parte - 1))
+            partes.append(com_datas(filtros, ini, ate))
+            ini = ate + timedelta(days=1)
+        if len(partes) > 1:
+            return partes
+    return [filtros]
+
+
+def bisectar(filtros):
+    """
+    (campo do perfil, [metade1, metade2]) dividindo a consulta ao meio pela lista de IDFILIAL
+    (filiais_por_parte) ou, sem ela, pelo intervalo de DATA (dias_por_parte). None se já for indivisível.
+    """
+    i = filtro_filiais(filtros)
+    if i is not None and len(filtros[i]["Valor"]) > 1:
+        ids = filtros[i]["Valor"]
+        meio = len(ids) // 2
+        return "filiais_por_parte", [com_filiais(filtros, ids[:meio]), com_filiais(filtros, ids[meio:])]
+
+    i = filtro_datas(filtros)
+    if i is not None:
+        ini, fim = intervalo(filtros, i)
+        if fim > ini:
+            meio = ini + (fim - ini) // 2
+            return "dias_por_parte", [com_datas(filtros, ini, meio), com_datas(filtros, meio + timedelta(days=1), fim)]
+    return None
+
+
+def tamanho(filtros, campo):
+    """Tamanho da parte no eixo do campo: quantidade de filiais ou de dias."""
+    if campo == "filiais_por_parte":
+        return len(filtros[filtro_filiais(filtros)]["Valor"])
+    ini, fim = intervalo(filtros, filtro_datas(filtros))
+    return (fim - ini).days + 1
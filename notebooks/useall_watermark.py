@@ -0,0 +1,69 @@
+"""
+Watermarks de extração incremental: maior data de alteração já vista por identificação.
+As próximas execuções pedem à Useall só o delta (DATAHORAALTERACAOINI = watermark).
+"""
+
+import os
+import logging
+
+import pandas as pd # type: ignore
+from sqlalchemy import text # type: ignore
+
+logger = logging.getLogger("useall_pipeline")
+
+WATERMARK_TABLE = "extraction_watermark"
+
+
+def ensure_watermark(engine, schema):
+    with engine.begin() as conn:
+        conn.execute(text(f"""
+            CREATE TABLE IF NOT EXISTS {schema}.{WATERMARK_TABLE} (
+                identificacao TEXT PRIMARY KEY,
+                coluna TEXT NOT NULL,
+                watermark TIMESTAMP NOT NULL,
+                updated_at TIMESTAMP NOT NULL DEFAULT now()
+            )
+        """))
+
+
+def ler_watermark(engine, schema, identificacao):
+    with engine.connect() as conn:
+        return conn.execute(
+            text(f"SELECT watermark FROM {schema}.{WATERMARK_TABLE} WHERE identificacao = :id"),
+            {"id": identificacao},
+        ).scalar()
+
+
+def watermark_upsert(schema):
+    """SQL (estilo psycopg2) para avançar o watermark; roda na mesma transação da carga."""
+    return f"""
+        INSERT INTO {schema}.{WATERMARK_TABLE} (identificacao, coluna, watermark, updated_at)
+        VALUES (%s, %s, %s, now())
+        ON CONFLICT (identificacao)
+        DO UPDATE SET coluna = EXCLUDED.coluna,
+                      watermark = GREATEST({WATERMARK_TABLE}.watermark, EXCLUDED.watermark),
+                      updated_at = EXCLUDED.updated_at
+    """
+
+
+def calcular_watermark(df, coluna):
+    """Maior valor de data/hora da coluna (None se a coluna não existir ou não tiver datas válidas)."""
+    if df is None or coluna not in df.columns:
+        return None
+    brutos = df[coluna].astype("string")
+    # ISO primeiro (dayfirst inverteria dia/mês de "2025-03-10"); o que sobrar tenta o formato BR
+    valores = pd.to_datetime(brutos, errors="coerce", format="ISO8601")
+    faltam = valores.isna() & brutos.notna()
+    if faltam.any():
+        valores[faltam] = pd.to_datetime(brutos[faltam], errors="coerce", format="mixed", dayfirst=True)
+    maior = valores.max()
+    return None if pd.isna(maior) else maior.to_pydatetime()
+
+
+def full_refresh_solicitado(context):
+    """Full refresh via conf da DAG ({"full_refresh": true}) ou USEALL_FULL_REFRESH=1 (reparos)."""
+    dag_run = context.get("dag_run")
+    conf = getattr(dag_run, "conf", None) or {}
+    if conf.get("full_refresh"):
+        return True
+    return os.getenv("USEALL_FULL_REFRESH", "0").lower() in ("1", "true", "sim")
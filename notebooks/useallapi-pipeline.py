@@ -5,12 +5,12 @@ Compatível com Airflow 3.1.7 e Execução Local via Terminal.
 """
 
 import os
+import sys
 import pendulum
 import json
-import time
 import logging
-import requests # type: ignore
-import pandas as pd # type: ignore
+import functools
+from contextlib import nullcontext
 from datetime import datetime, timedelta
 from zoneinfo import ZoneInfo
 from dotenv import load_dotenv # type: ignore
@@ -37,17 +37,33 @@ BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 if os.path.exists("/.dockerenv"):
     # Estamos no Docker
     ENV_PATH = "/opt/airflow/useall/.env"
-    TOOLS_DIR = "/opt/airflow/tools"
 else:
     # Estamos no Windows / Local
     # Assume que o .env está na raiz do projeto ou na pasta config
     ENV_PATH = os.path.join(BASE_DIR, "..", ".env") 
     if not os.path.exists(ENV_PATH):
         ENV_PATH = os.path.join(BASE_DIR, ".env")
-    TOOLS_DIR = r"C:\Repositorio\Tools"
 
 load_dotenv(ENV_PATH, override=True)
 
+# Módulos auxiliares do pipeline ficam na mesma pasta da DAG
+if BASE_DIR not in sys.path:
+    sys.path.append(BASE_DIR)
+
+from useall_loader import copy_df_to_postgres, copy_batches_to_postgres # noqa: E402
+from useall_calendario import atualizar_calendario # noqa: E402
+from useall_client import UseallClient # noqa: E402
+from useall_extract import executar_em_paralelo # noqa: E402
+from useall_manifest import ensure_manifest, particoes_carregadas, semear_manifest, dias_pendentes # noqa: E402
+from useall_merge import merge_select # noqa: E402
+from useall_gold import materializar_gold, ensure_pendentes, marcar_pendentes_sql, conferir_ultimos_custos, em_transacao # noqa: E402
+from type_analytics import TypeInferenceEngine # noqa: E402
+from useall_metrics import ensure_metrics, medir # noqa: E402
+from useall_ratelimit import LIMITER # noqa: E402
+from useall_raw import RawZone, replay_solicitado # noqa: E402
+from useall_split import PerfisExtracao, ensure_perfil # noqa: E402
+from useall_watermark import ensure_watermark, ler_watermark, watermark_upsert, calcular_watermark, full_refresh_solicitado # noqa: E402
+
 # Variáveis
 BASE_URL = os.getenv("USEALL_BASE_URL")
 TOKEN = os.getenv("USEALL_TOKEN")
@@ -55,6 +71,10 @@ HEADERS = {
     "accept": "application/json",
     "use-relatorio-token": TOKEN,
 }
+# Sessão HTTP única (pool keep-alive) compartilhada pelas tasks de extração
+CLIENT = UseallClient(BASE_URL, HEADERS)
+# Raw zone Parquet (USEALL_RAW_DIR): toda resposta passa por aqui a caminho do Postgres
+RAW = RawZone()
 
 # Banco de Dados
 DB_User = quote(os.getenv("PG_USER", "postgres"))
@@ -70,84 +90,175 @@ if os.path.exists("/.dockerenv") and DB_Host == "localhost":
 
 DB_URL = f"postgresql+psycopg2://{DB_User}:{DB_Pass}@{DB_Host}:{DB_Port}/{DB_Name}"
 engine = create_engine(DB_URL)
+# Paginação/divisão descobertas por identificação ficam no banco (extraction_perfil)
+CLIENT.perfis = PerfisExtracao(engine, DB_Schema)
 
 # Logging
 logging.basicConfig(level=logging.INFO, format="%(asctime)s | %(levelname)s | %(message)s")
 logger = logging.getLogger("useall_pipeline")
 
+# Fora do Airflow (execução local) todas as tasks gravam métricas sob o mesmo run_id
+RUN_LOCAL = f"local_{datetime.now():%Y%m%dT%H%M%S}"
+
 # ================= FUNÇÕES AUXILIARES =================
 
+def medido(etapa):
+    """
+    Task como escopo de métricas: uma linha em pipeline_metrics com tempo total, os contadores somados
+    pelas identificações/passos internos e a variação de LIMITER.stats.
+    """
+    def decorar(func):
+        @functools.wraps(func)
+        def task(**context):
+            run_id = context.get("run_id") or RUN_LOCAL
+            with medir(etapa, engine=engine, schema=DB_Schema, run_id=run_id, limiter=LIMITER):
+                return func(**context)
+        return task
+    return decorar
+
 def ensure_schema(**context):
     with engine.connect() as conn:
         conn.execute(text(f"CREATE SCHEMA IF NOT EXISTS {DB_Schema}"))
         conn.commit()
+    ensure_manifest(engine, DB_Schema)
+    ensure_watermark(engine, DB_Schema)
+    ensure_metrics(engine, DB_Schema)
+    ensure_perfil(engine, DB_Schema)
+    ensure_pendentes(engine, DB_Schema)
     logger.info(f"Schema {DB_Schema} garantido.")
+    # Retenção da raw zone (USEALL_RAW_RETENCAO_DIAS), uma vez por execução
+    RAW.podar()
 
 def buscar_dados_api(identificacao, nome_arquivo, backend_filters=None, extra_params=None):
-    query_params = {"Identificacao": identificacao}
-    
-    if backend_filters:
-        query_params["FiltrosSqlQuery"] = json.dumps(backend_filters, ensure_ascii=False)
-    if extra_params:
-        query_params.update(extra_params)
-    
-    logger.info(f"Extraindo: {nome_arquivo}...")
-    
-    while True:
-        try:
-            response = requests.get(BASE_URL, headers=HEADERS, params=query_params, timeout=500)
-            if response.status_code == 429:
-                time.sleep(185)
-                continue
-            response.raise_for_status()
-            data = response.json()
-            registros = data.get("data") if isinstance(data, dict) else data
-            
-            if registros:
-                return pd.DataFrame(registros)
-            return pd.DataFrame()
-            
-        except requests.exceptions.Timeout:
-            time.sleep(60)
-            continue
-        except Exception as e:
-            logger.error(f"Erro em {nome_arquivo}: {e}")
-            raise
+    return CLIENT.buscar_dados(identificacao, nome_arquivo, backend_filters, extra_params)
+
+def pouso_raw(manifest, landing):
+    """Raw zone da carga: os Parquet só são publicados depois do commit do COPY feito dentro do with."""
+    if landing and manifest:
+        return RAW.pouso(*manifest, substituir=manifest[1] != "delta")
+    return nullcontext(lambda lotes: lotes)
 
-def save_to_postgres(df, table_name, if_exists="replace"):
+def save_to_postgres(df, table_name, if_exists="replace", pre_sql=None, manifest=None, keys=None, post_sql=None,
+                     delete_missing=False, landing=True):
     if df is not None and not df.empty:
-        df.to_sql(table_name, engine, schema=DB_Schema, if_exists=if_exists, index=False)
+        with pouso_raw(manifest, landing) as gravar:
+            for _ in gravar([df]):
+                pass
+            copy_df_to_postgres(df, table_name, engine, DB_Schema, if_exists=if_exists, pre_sql=pre_sql,
+                                manifest=manifest, keys=keys, post_sql=post_sql, delete_missing=delete_missing)
         logger.info(f"Tabela {DB_Schema}.{table_name} salva com sucesso ({len(df)} regs).")
     else:
         logger.warning(f"DataFrame vazio para {table_name}. Nada salvo.")
 
+def save_stream_to_postgres(batches, table_name, if_exists="replace", pre_sql=None, manifest=None, keys=None,
+                            delete_missing=False, landing=True, post_sql=None):
+    # Lotes vão do socket direto para o COPY, sem montar o DataFrame inteiro (e para a raw zone no caminho)
+    with pouso_raw(manifest, landing) as gravar:
+        total = copy_batches_to_postgres(gravar(batches), table_name, engine, DB_Schema, if_exists=if_exists,
+                                         pre_sql=pre_sql, manifest=manifest, keys=keys, post_sql=post_sql,
+                                         delete_missing=delete_missing)
+    if total:
+        logger.info(f"Tabela {DB_Schema}.{table_name} salva com sucesso ({total} regs).")
+    else:
+        logger.warning(f"Resposta vazia para {table_name}. Nada salvo.")
+    return total
+
 def filtro_simples(nome, valor):
     return {"Nome": nome, "Valor": valor}
 
 # ================= TASKS DE EXTRAÇÃO =================
 
+@medido("extract_simples")
 def task_extract_simples(**context):
-    params_fixos = {"pagina": 1, "qtderegistros": 1}
-    
+    full_refresh = full_refresh_solicitado(context)
+    replay = replay_solicitado(context)
+
+    # Incrementais: (coluna de alteração na resposta, filtro INI, formato do filtro) + chave natural do merge
+    alt = ("datahoraalteracao", "DATAHORAALTERACAOINI", "%d/%m/%Y")
+    alt_hora = ("datahoraalt", "DATAHORAALTINI", "%d/%m/%Y, %H:%M:%S")
+
     tarefas = [
-        {"nome": "staging_itens", "id": "m2_estoque_item", "filtros": [filtro_simples("DATAHORAALTERACAOINI", "01/01/1900"), filtro_simples("DATAHORAALTERACAOFIM", "01/01/2027")]},
-        {"nome": "staging_unidades", "id": "m2_estoque_unidade", "filtros": [filtro_simples("DATAHORAALTERACAOINI", "01/01/1900"), filtro_simples("DATAHORAALTERACAOFIM", "01/01/2027")]},
-        {"nome": "staging_segmentos", "id": "m2_vendas_segmento", "filtros": [filtro_simples("DATAHORAALTERACAOINI", "01/01/1900"), filtro_simples("DATAHORAALTERACAOFIM", "01/01/2027")]},
-        {"nome": "staging_cidades", "id": "m2_geral_cidades", "filtros": [filtro_simples("DATAHORAALTERACAOINI", "01/01/1900"), filtro_simples("DATAHORAALTERACAOFIM", "01/01/2027")]},
+        {"nome": "staging_itens", "id": "m2_estoque_item", "filtros": [filtro_simples("DATAHORAALTERACAOINI", "01/01/1900"), filtro_simples("DATAHORAALTERACAOFIM", "01/01/2027")], "incremental": alt, "chave": ["iditem"]},
+        {"nome": "staging_unidades", "id": "m2_estoque_unidade", "filtros": [filtro_simples("DATAHORAALTERACAOINI", "01/01/1900"), filtro_simples("DATAHORAALTERACAOFIM", "01/01/2027")], "incremental": alt, "chave": ["idunidade"]},
+        {"nome": "staging_segmentos", "id": "m2_vendas_segmento", "filtros": [filtro_simples("DATAHORAALTERACAOINI", "01/01/1900"), filtro_simples("DATAHORAALTERACAOFIM", "01/01/2027")], "incremental": alt, "chave": ["idsegmento"]},
+        {"nome": "staging_cidades", "id": "m2_geral_cidades", "filtros": [filtro_simples("DATAHORAALTERACAOINI", "01/01/1900"), filtro_simples("DATAHORAALTERACAOFIM", "01/01/2027")], "incremental": alt, "chave": ["idcidade"]},
         {"nome": "staging_solcompra", "id": "m2_compras_m2_compras_solicitacao_de_compras__extra", "filtros": [filtro_simples("DATAINI", "01/01/1900"), filtro_simples("DataFim", "01/01/2027")]},
-        {"nome": "staging_filiais", "id": "m2_geral_filiais", "filtros": [filtro_simples("DATAHORAALTINI", "01/01/1900, 11:00:00"), filtro_simples("DATAHORAALTFIM", "01/01/2027, 14:00:00")]},
-        {"nome": "staging_empresas", "id": "m2_geral_empresas", "filtros": [filtro_simples("DATAHORAALTINI", "01/01/2022, 11:00:00"), filtro_simples("DATAHORAALTFIM", "01/01/2027, 14:00:00")]},
+        {"nome": "staging_filiais", "id": "m2_geral_filiais", "filtros": [filtro_simples("DATAHORAALTINI", "01/01/1900, 11:00:00"), filtro_simples("DATAHORAALTFIM", "01/01/2027, 14:00:00")], "incremental": alt_hora, "chave": ["idfilial"]},
+        {"nome": "staging_empresas", "id": "m2_geral_empresas", "filtros": [filtro_simples("DATAHORAALTINI", "01/01/2022, 11:00:00"), filtro_simples("DATAHORAALTFIM", "01/01/2027, 14:00:00")], "incremental": alt_hora, "chave": ["idempresa"]},
         {"nome": "staging_expedicao", "id": "m2_vendas_extracao_de_dados__saida_expedicao", "filtros": [filtro_simples("data1", "01/01/1900"), filtro_simples("data2", "01/01/2027")]},
-        {"nome": "staging_clientesfornecedores", "id": "m2_geral_clientes__fornecedores", "filtros": [filtro_simples("DATAHORAALTERACAOINI", "01/01/1900"), filtro_simples("DATAHORAALTERACAOFIM", "01/01/2027")]},
-        {"nome": "staging_almoxarifados", "id": "m2_estoque_almoxarifados", "filtros": [filtro_simples("DATAHORAALTINI", "01/01/1900"), filtro_simples("DATAHORAALTFIM", "01/01/2027")]},
+        {"nome": "staging_clientesfornecedores", "id": "m2_geral_clientes__fornecedores", "filtros": [filtro_simples("DATAHORAALTERACAOINI", "01/01/1900"), filtro_simples("DATAHORAALTERACAOFIM", "01/01/2027")], "incremental": alt, "chave": ["idclifor"]},
+        {"nome": "staging_almoxarifados", "id": "m2_estoque_almoxarifados", "filtros": [filtro_simples("DATAHORAALTINI", "01/01/1900"), filtro_simples("DATAHORAALTFIM", "01/01/2027")], "incremental": alt_hora, "chave": ["idalmox"]},
     ]
 
-    for t in tarefas:
-        df = buscar_dados_api(t["id"], t["nome"], t["filtros"], params_fixos)
-        save_to_postgres(df, t["nome"])
-
+    def extrair(t):
+        if replay:
+            # Última carga completa + deltas posteriores, da raw zone, na mesma sequência em que chegaram
+            historico = RAW.historico(t["id"])
+            if not historico:
+                logger.warning(f"{t['nome']}: nada na raw zone para replay.")
+            for particao, arquivos in historico:
+                persistir(t, RAW.ler_df(arquivos), particao == "delta", landing=False)
+            return
+
+        filtros = t["filtros"]
+        incremental = t.get("incremental")
+        watermark = ler_watermark(engine, DB_Schema, t["id"]) if incremental and not full_refresh else None
+
+        if watermark:
+            # Delta: troca só o início do intervalo pelo watermark (inclusivo; o merge absorve repetidos)
+            _, filtro_ini, formato = incremental
+            filtros = [filtro_simples(filtro_ini, watermark.strftime(formato)) if f["Nome"] == filtro_ini else f for f in filtros]
+            logger.info(f"{t['nome']}: delta desde {watermark:%d/%m/%Y %H:%M:%S}.")
+
+        persistir(t, buscar_dados_api(t["id"], t["nome"], filtros), bool(watermark))
+
+    def persistir(t, df, delta, landing=True):
+        incremental = t.get("incremental")
+        if df is None or df.empty:
+            if delta:
+                logger.info(f"{t['nome']}: sem alterações desde o último watermark.")
+            else:
+                save_to_postgres(df, t["nome"])
+            return
+
+        post_sql = None
+        if incremental:
+            if all(k in df.columns for k in t["chave"]):
+                novo_watermark = calcular_watermark(df, incremental[0])
+                if novo_watermark:
+                    post_sql = [(watermark_upsert(DB_Schema), (t["id"], incremental[0], novo_watermark))]
+            else:
+                # Sem a chave natural não há merge seguro: não grava watermark e segue com carga completa
+                logger.warning(f"{t['nome']}: chave {t['chave']} ausente na resposta. Mantendo carga completa.")
+
+        if delta:
+            save_to_postgres(df, t["nome"], if_exists="merge", keys=t["chave"], post_sql=post_sql,
+                             manifest=(t["id"], "delta"), landing=landing)
+        elif t.get("chave") and all(k in df.columns for k in t["chave"]):
+            # Carga completa = retrato: merge removendo as chaves que sumiram
+            save_to_postgres(df, t["nome"], if_exists="merge", keys=t["chave"], delete_missing=True,
+                             post_sql=post_sql, manifest=(t["id"], "full"), landing=landing)
+        else:
+            save_to_postgres(df, t["nome"], post_sql=post_sql, manifest=(t["id"], "full"), landing=landing)
+
+    def extrair_medido(t):
+        with medir("extract", t["id"], tabela=t["nome"]):
+            extrair(t)
+
+    executar_em_paralelo(tarefas, extrair_medido)
+
+def lotes_fonte(replay, identificacao, nome_arquivo, backend_filters=None, extra_params=None, particao="full"):
+    """Lotes direto da API ou, em replay, da última versão da partição na raw zone."""
+    if replay:
+        return RAW.ler(RAW.ultima(identificacao, particao))
+    return CLIENT.iter_batches(identificacao, nome_arquivo, backend_filters, extra_params)
+
+@medido("extract_complexas")
 def task_extract_complexas(**context):
-    # Requisições
+    replay = replay_solicitado(context)
+
+    # Requisições (o merge com delete_missing trata a resposta como retrato completo: o início do período
+    # não pode subir sem apagar da staging as requisições anteriores a ele)
     filtros_req = [
         {"Nome": "IDFILIAL", "Valor": [333, 339, 340, 381, 389, 336, 387, 520, 404, 558, 578, 341, 390, 345, 344, 346, 335, 334, 342, 343], "Operador": 1},
         {"Nome": "DATA", "Valor": "01/01/2010,01/01/2027", "Operador": 8, "TipoPeriodoData": 5},
@@ -157,8 +268,13 @@ def task_extract_complexas(**context):
         {"Nome": "quebra", "Valor": 1},
         {"Nome": "FILTROSWHERE", "Valor": " AND IDEMPRESA = 211"},
     ]
-    df_req = buscar_dados_api("m2_estoque_requisicao_de_materiais", "staging_requisicoes", filtros_req)
-    save_to_postgres(df_req, "staging_requisicoes")
+    with medir("extract", "m2_estoque_requisicao_de_materiais", tabela="staging_requisicoes"):
+        save_stream_to_postgres(
+            lotes_fonte(replay, "m2_estoque_requisicao_de_materiais", "staging_requisicoes", filtros_req),
+            "staging_requisicoes",
+            if_exists="merge", keys=["idreqmat", "iditem"], delete_missing=True,
+            manifest=("m2_estoque_requisicao_de_materiais", "full"), landing=not replay,
+        )
 
     # Atendimentos
     filtros_atend = [{"Nome": "FILTROSWHERE", "Valor": ("WHERE IDEMPRESA = 211 "
@@ -167,10 +283,15 @@ def task_extract_complexas(**context):
             "AND DATA_ATEND BETWEEN '01/01/1900' AND '01/01/2900'")}]
     params_atend = {"NomeOrganizacao": "SETUP SERVICOS ESPECIALIZADOS LTDA", "Parametros": json.dumps([{"Nome": "usecellmerging", "Valor": True}, {"Nome": "quebra", "Valor": 0}])}
     
-    df_atend = buscar_dados_api("m2_estoque_atendimentos_de_requisicao", "staging_atendimentodereq", filtros_atend, params_atend)
-    save_to_postgres(df_atend, "staging_atendimentodereq")
+    with medir("extract", "m2_estoque_atendimentos_de_requisicao", tabela="staging_atendimentodereq"):
+        save_stream_to_postgres(
+            lotes_fonte(replay, "m2_estoque_atendimentos_de_requisicao", "staging_atendimentodereq", filtros_atend, params_atend),
+            "staging_atendimentodereq",
+            manifest=("m2_estoque_atendimentos_de_requisicao", "full"), landing=not replay,
+        )
 
 
+@medido("extract_custos")
 def task_extract_custos(**context):
     grupos = {
         "ctfm": [342, 343],
@@ -183,16 +304,21 @@ def task_extract_custos(**context):
     target_table = "raw_custos_grupos"
     data_ref = datetime.now(ZoneInfo("America/Sao_Paulo")).strftime("%d/%m/%Y")
 
+    replay = replay_solicitado(context)
+
+    # Grupos já carregados hoje: uma consulta no manifesto para todos os grupos (replay recarrega todos)
+    carregados_hoje = set() if replay else particoes_carregadas(engine, DB_Schema, "m2_estoque_custos", desde=datetime.now().date())
+
+    # codigoitem de cada grupo recarregado (antes e depois da troca) entra na fila da gold_ultimos_custos
+    with engine.connect() as conn:
+        col_item = conn.execute(text(
+            "SELECT column_name FROM information_schema.columns "
+            "WHERE table_schema = :s AND table_name = :t AND lower(column_name) = 'codigoitem'"
+        ), {"s": DB_Schema, "t": target_table}).scalar()
+    expr_item = f'r."{col_item}"' if col_item else "(SELECT v FROM jsonb_each_text(to_jsonb(r)) AS j(c, v) WHERE lower(c) = 'codigoitem')"
+
     for grupo, ids in grupos.items():
-        # Check já carregado
-        query_check = f"SELECT 1 FROM {DB_Schema}.{target_table} WHERE _grupo_origem = '{grupo}' AND data_carga::date = CURRENT_DATE LIMIT 1"
-        try:
-            with engine.connect() as conn:
-                loaded = conn.execute(text(query_check)).scalar()
-        except:
-            loaded = False
-        
-        if loaded:
+        if grupo in carregados_hoje:
             logger.info(f"Grupo {grupo} já carregado hoje. Pulando.")
             continue
             
@@ -203,17 +329,28 @@ def task_extract_custos(**context):
             {"Nome": "data", "Valor": data_ref},
         ]
         
-        df = buscar_dados_api("m2_estoque_custos", f"custos_{grupo}", filtros)
-        if df is not None and not df.empty:
-            df["_grupo_origem"] = grupo
-            df["data_carga"] = datetime.now()
-            
-            with engine.begin() as conn:
-                conn.execute(text(f"DELETE FROM {DB_Schema}.{target_table} WHERE _grupo_origem = '{grupo}'"))
-            
-            df.to_sql(target_table, engine, schema=DB_Schema, if_exists="append", index=False)
+        def lotes_custos(grupo=grupo, filtros=filtros):
+            if replay:
+                # A raw zone já guarda os lotes com _grupo_origem e data_carga
+                yield from lotes_fonte(replay, "m2_estoque_custos", None, particao=grupo)
+                return
+            data_carga = datetime.now()
+            for lote in CLIENT.iter_batches("m2_estoque_custos", f"custos_{grupo}", filtros):
+                for registro in lote:
+                    registro["_grupo_origem"] = grupo
+                    registro["data_carga"] = data_carga
+                yield lote
+
+        # Fila de pendentes + DELETE do grupo + COPY na mesma transação (só acontece se vier algum registro)
+        itens_grupo = marcar_pendentes_sql(DB_Schema, "gold_ultimos_custos",
+                                           f"SELECT {expr_item} FROM {DB_Schema}.{target_table} r WHERE r._grupo_origem = '{grupo}'")
+        with medir("extract", "m2_estoque_custos", tabela=target_table, grupo=grupo):
+            salvos = save_stream_to_postgres(lotes_custos(), target_table, if_exists="append", pre_sql=[
+                itens_grupo,
+                f"DELETE FROM {DB_Schema}.{target_table} WHERE _grupo_origem = '{grupo}'"
+            ], post_sql=[(itens_grupo, None)], manifest=("m2_estoque_custos", grupo), landing=not replay)
+        if salvos:
             logger.info(f"Grupo {grupo} salvo.")
-            time.sleep(60) # Cooldown
 
     # Snapshot
     try:
@@ -221,34 +358,36 @@ def task_extract_custos(**context):
             conn.execute(text(f"DROP VIEW IF EXISTS {DB_Schema}.staging_custos_raw CASCADE"))
     except: pass
 
+    # Snapshot por merge: a tabela (e o que depende dela) não é mais derrubada a cada carga
+    raw_conn = engine.raw_connection()
     try:
-        with engine.begin() as conn:
-            conn.execute(text(f"DROP TABLE IF EXISTS {DB_Schema}.staging_custos_raw CASCADE"))
-    except: pass
-    
-    with engine.begin() as conn:
-        conn.execute(text(f"CREATE TABLE {DB_Schema}.staging_custos_raw AS SELECT * FROM {DB_Schema}.raw_custos_grupos"))
-        logger.info("Snapshot Custos criado.")
-
+        cur = raw_conn.cursor()
+        merge_select(cur, DB_Schema, "staging_custos_raw", f"SELECT * FROM {DB_Schema}.raw_custos_grupos")
+        raw_conn.commit()
+    finally:
+        raw_conn.close()
+    logger.info("Snapshot Custos criado.")
+
+@medido("extract_estoque")
 def task_extract_estoque(**context):
-    data_atual = datetime.strptime("01/01/2026", "%d/%m/%Y")
-    data_fim = datetime.now()
+    data_inicio = datetime.strptime("01/01/2026", "%d/%m/%Y").date()
+    data_fim = datetime.now().date()
     target_table = "staging_estoque_diario"
+    identificacao = "m2_estoque_saldo_de_estoque"
+    replay = replay_solicitado(context)
+
+    # Dias já gravados (manifesto) ficam de fora: retomar após uma falha não rebusca nada que foi commitado
+    semear_manifest(engine, DB_Schema, identificacao, target_table, "data_referencia")
+    pendentes = dias_pendentes(engine, DB_Schema, identificacao, data_inicio, data_fim)
+    if not pendentes:
+        logger.info("Estoque diário em dia. Nada a buscar.")
+        return
+    logger.info(f"Estoque diário: {len(pendentes)} dias pendentes.")
+
+    def extrair_dia(dia):
+        data_br = dia.strftime("%d/%m/%Y")
+        data_iso = dia.strftime("%Y-%m-%d")
 
-    while data_atual <= data_fim:
-        data_br = data_atual.strftime("%d/%m/%Y")
-        data_iso = data_atual.strftime("%Y-%m-%d")
-        
-        try:
-            with engine.connect() as conn:
-                exists = conn.execute(text(f"SELECT 1 FROM {DB_Schema}.{target_table} WHERE data_referencia = '{data_iso}' LIMIT 1")).scalar()
-        except:
-            exists = False
-            
-        if exists:
-            data_atual += timedelta(days=1)
-            continue
-            
         filtros = [
             {"Nome": "ADDATA", "Valor": data_br},
             {"Nome": "ANQUEBRA", "Valor": 0},
@@ -256,80 +395,60 @@ def task_extract_estoque(**context):
             {"Nome": "FILTROSREGISTROSATIVO", "Valor": " AND ITEM.ATIVO = 1 AND ALMOX.ATIVO = 1 AND ITEMALMOX.ATIVO = 1"},
             {"Nome": "FILTROSWHERE", "Valor": " AND EXISTS(SELECT 1 FROM USE_USUARIOS_FILIAIS UFILIAIS WHERE UFILIAIS.IDEMPRESA = T.IDEMPRESA AND UFILIAIS.IDFILIAL = T.IDFILIAL AND UFILIAIS.IDUSUARIO = 7332) AND T.IDFILIAL in (333)"},
         ]
-        
-        df = buscar_dados_api("m2_estoque_saldo_de_estoque", f"estoque_{data_iso}", filtros)
-        if df is not None and not df.empty:
-            df["data_referencia"] = data_iso
-            with engine.begin() as conn:
-                conn.execute(text(f"DELETE FROM {DB_Schema}.{target_table} WHERE data_referencia = '{data_iso}'"))
-            df.to_sql(target_table, engine, schema=DB_Schema, if_exists="append", index=False)
+
+        def lotes():
+            if replay:
+                yield from lotes_fonte(replay, identificacao, None, particao=data_iso)
+                return
+            for lote in CLIENT.iter_batches(identificacao, f"estoque_{data_iso}", filtros):
+                for registro in lote:
+                    registro["data_referencia"] = data_iso
+                yield lote
+
+        # Cada dia é uma transação: DELETE do dia + COPY
+        total = save_stream_to_postgres(lotes(), target_table, if_exists="append", pre_sql=[
+            f"DELETE FROM {DB_Schema}.{target_table} WHERE data_referencia = '{data_iso}'"
+        ], manifest=(identificacao, data_iso), landing=not replay)
+        if total:
             logger.info(f"Estoque {data_iso} salvo.")
-            
-        data_atual += timedelta(days=1)
-        time.sleep(1)
+        return total
+
+    # Primeira carga: cria a tabela em série, antes de abrir o pool (evita CREATE TABLE concorrente)
+    with engine.connect() as conn:
+        tabela_existe = conn.execute(text("SELECT to_regclass(:t)"), {"t": f"{DB_Schema}.{target_table}"}).scalar()
+    # Uma linha de métrica para todos os dias (o pool herda o escopo)
+    with medir("extract", identificacao, tabela=target_table, dias=len(pendentes)):
+        while pendentes and not tabela_existe:
+            tabela_existe = extrair_dia(pendentes.pop(0))
+
+        executar_em_paralelo(pendentes, extrair_dia, nome=lambda d: f"estoque_{d:%Y-%m-%d}")
 
 
 # ================= TASKS SILVER / GOLD =================
 
+@medido("run_silver_analytics")
 def task_run_analytics(**context):
     try:
-        import sys
-        # Adiciona o diretório Tools ao path se não estiver lá
-        if TOOLS_DIR not in sys.path:
-            sys.path.append(TOOLS_DIR)
-        
-        from type_analytics import TypeInferenceEngine # type: ignore
-        
-        engine_silver = create_engine(DB_URL)
-        analytics = TypeInferenceEngine(engine=engine_silver, schema=DB_Schema)
+        analytics = TypeInferenceEngine(engine=engine, schema=DB_Schema, run_id=context.get("run_id") or RUN_LOCAL)
         analytics.process_tables()
     except Exception as e:
         logger.error(f"Erro TypeAnalytics: {e}")
         # Não falha a DAG, apenas loga
         pass
 
+@medido("materialize_gold")
 def task_materialize_gold(**context):
-    # Logica de Gold SQLs complexos
-    sqls = [
-        # Gold genérico
-        """
-        DO $$ DECLARE r RECORD; gold_tbl TEXT; BEGIN
-            FOR r IN SELECT table_name FROM information_schema.tables WHERE table_schema = 'useall' AND table_name LIKE 'silver_%' LOOP
-                gold_tbl := replace(r.table_name, 'silver_', 'gold_');
-                EXECUTE format('DROP TABLE IF EXISTS useall.%I CASCADE; CREATE TABLE useall.%I AS SELECT * FROM useall.%I;', gold_tbl, gold_tbl, r.table_name);
-            END LOOP;
-        END $$;
-        """,
-        # View Custos
-        """CREATE OR REPLACE VIEW useall.vw_ultimos_custos AS SELECT * FROM (SELECT gc.*, ROW_NUMBER() OVER (PARTITION BY codigoitem ORDER BY datacusto DESC) AS rn FROM useall.gold_custos gc WHERE ultimocusto <> 0) t WHERE rn = 1;""",
-        # Gold Filiais
-        """DROP TABLE IF EXISTS useall.gold_filiais CASCADE; CREATE TABLE useall.gold_filiais AS SELECT *, CASE WHEN idfilial IN (393, 336, 337, 558, 387) THEN 'RS' WHEN idfilial = 520 THEN 'BA' WHEN idfilial = 404 THEN 'DF' WHEN idfilial IN (342, 343, 381, 389, 334, 335, 339, 333, 341, 578, 390, 379, 344, 345, 346, 338) THEN 'SC' ELSE '*NOVA' END AS uf FROM useall.silver_filiais;""",
-        # Gold Atendimentos
-        """DROP TABLE IF EXISTS useall.gold_atendimentodereq CASCADE; CREATE TABLE useall.gold_atendimentodereq AS SELECT *, idreqmat::text || '-' || iditem::text AS py_idreqitem, iditem::text || '-' || TO_CHAR(data_atend::date, 'YYYYMMDD') AS py_iddataitem FROM useall.silver_atendimentodereq;""",
-        # Gold Estoque
-        """DROP TABLE IF EXISTS useall.gold_estoque CASCADE; CREATE TABLE useall.gold_estoque AS SELECT e.*, c.ultimocusto, CASE WHEN e.estoquemin IS NOT NULL AND e.estoquemax IS NOT NULL AND e.estoquemin > e.estoquemax THEN 'PARAMETRO_INVALIDO' WHEN e.saldodisponivel < 0 THEN 'INCONSISTENTE' WHEN e.estoquemin IS NULL OR e.estoquemin = 0 THEN 'SEM_MINIMO' WHEN e.estoquemin > 0 AND e.saldodisponivel = 0 THEN 'RUPTURA' WHEN e.estoquemin > 0 AND e.saldodisponivel > 0 AND e.saldodisponivel < e.estoquemin THEN 'CRITICO' WHEN e.estoquemax IS NOT NULL AND e.saldodisponivel > e.estoquemax THEN 'EXCESSO' WHEN e.saldodisponivel >= e.estoquemin AND (e.estoquemax IS NULL OR e.saldodisponivel <= e.estoquemax) THEN 'ADEQUADO' ELSE 'NAO_CLASSIFICADO' END AS py_status_estoque, CASE WHEN e.estoquemin IS NOT NULL AND e.estoquemax IS NOT NULL AND e.estoquemin > e.estoquemax THEN 0 WHEN e.estoquemin IS NULL OR e.estoquemin = 0 THEN 0 WHEN e.saldodisponivel < e.estoquemin THEN (e.estoquemin - GREATEST(e.saldodisponivel, 0)) * COALESCE(c.ultimocusto, 0) WHEN e.estoquemax IS NOT NULL AND e.saldodisponivel > e.estoquemax THEN -1 * (e.saldodisponivel - e.estoquemax) * COALESCE(c.ultimocusto, 0) ELSE 0 END AS valor_impacto_estoque FROM useall.silver_estoque e LEFT JOIN useall.vw_ultimos_custos c ON c.codigoitem = e.iditem;""",
-        # Gold Requisicoes
-        """DROP TABLE IF EXISTS useall.gold_requisicoes CASCADE; CREATE TABLE useall.gold_requisicoes AS SELECT r.*, CASE status::int WHEN 0 THEN 'Digitado' WHEN 1 THEN 'Aberto' WHEN 3 THEN 'Cancelado' WHEN 10 THEN 'Parcial' WHEN 11 THEN 'Atendido' ELSE 'Desconhecido' END AS py_desc_status, CASE WHEN r.quantcancel = r.quant THEN 'CANCELADO TOTAL' WHEN r.quantsubst = r.quant THEN 'SUBSTITUIDO TOTAL' WHEN r.quantatend = 0 AND r.saldo > 0 THEN 'NÃO ATENDIDA' WHEN r.quantatend = r.quant THEN 'ATENDIDO' WHEN r.quantatend > r.quant THEN 'ATENDIDO A MAIS' WHEN r.quantatend < r.quant AND r.quantatend > 0 THEN 'ATENDIDA PARCIAL' ELSE 'INDEFINIDO' END AS py_status_item, CASE WHEN r.quantatend > 0 THEN 'SIM' ELSE 'NÃO' END AS py_gera_atend, r.idreqmat::text || '-' || r.iditem::text AS py_idreqitem, COALESCE(ati.max_dataatend_item, atr.max_dataatend_req) AS py_data_ult_atend FROM useall.silver_requisicoes r LEFT JOIN (SELECT py_idreqitem, MAX(data_atend) AS max_dataatend_item FROM useall.gold_atendimentodereq GROUP BY py_idreqitem) ati ON ati.py_idreqitem = (r.idreqmat::text || '-' || r.iditem::text) LEFT JOIN (SELECT idreqmat, MAX(data_atend) AS max_dataatend_req FROM useall.gold_atendimentodereq GROUP BY idreqmat) atr ON atr.idreqmat = r.idreqmat;""",
-        # Gold Estoque Diario
-        """DROP TABLE IF EXISTS useall.gold_estoque_diario CASCADE; CREATE TABLE useall.gold_estoque_diario AS SELECT *, CONCAT(iditem, '-', TO_CHAR(data_referencia::date, 'YYYYMMDD')) AS py_iddataitem FROM useall.silver_estoque_diario WHERE desc_almox = 'MERC. MATRIZ';"""
-    ]
-    
-    with engine.begin() as conn:
-        for s in sqls:
-            conn.execute(text(s))
+    # Declarações em useall_gold.GOLD_STEPS; cada tabela é aplicada por merge na chave natural
+    materializar_gold(engine, DB_Schema, completo=full_refresh_solicitado(context))
     logger.info("Camada Gold materializada.")
+    if os.getenv("USEALL_CONFERIR_CUSTOS", "0").lower() in ("1", "true", "sim"):
+        # Roda a janela completa de novo: só para validar a gold_ultimos_custos, não em toda execução
+        em_transacao(engine, lambda cur: conferir_ultimos_custos(cur, DB_Schema))
 
+@medido("dim_calendario")
 def task_dim_calendario(**context):
-    sql = """
-    CREATE TABLE IF NOT EXISTS useall.dim_calendario (data DATE PRIMARY KEY, ano INT, mes INT, dia INT, ano_mes TEXT, ano_mes_atual TEXT, ano_mes_ordem INT, nome_mes TEXT, nome_mes_abrev TEXT, nome_dia TEXT, nome_dia_abrev TEXT, dia_semana INT, semana_iso INT, ano_iso INT, trimestre INT, dia_mes_abr TEXT, is_fim_de_semana BOOLEAN, is_feriado BOOLEAN, nome_feriado TEXT);
-    
-    INSERT INTO useall.dim_calendario (data, ano, mes, dia, ano_mes, ano_mes_atual, ano_mes_ordem, nome_mes, nome_mes_abrev, nome_dia, nome_dia_abrev, dia_semana, semana_iso, ano_iso, trimestre, dia_mes_abr, is_fim_de_semana, is_feriado, nome_feriado)
-    SELECT DISTINCT d::date, EXTRACT(YEAR FROM d)::int, EXTRACT(MONTH FROM d)::int, EXTRACT(DAY FROM d)::int, TO_CHAR(d, 'YYYY/MM'), CASE WHEN EXTRACT(YEAR FROM d) = EXTRACT(YEAR FROM CURRENT_DATE) AND EXTRACT(MONTH FROM d) = EXTRACT(MONTH FROM CURRENT_DATE) THEN 'Mês Atual' ELSE TO_CHAR(d, 'YYYY/MM') END, (EXTRACT(YEAR FROM d) * 100 + EXTRACT(MONTH FROM d))::int, CASE EXTRACT(MONTH FROM d) WHEN 1 THEN 'Janeiro' WHEN 2 THEN 'Fevereiro' WHEN 3 THEN 'Março' WHEN 4 THEN 'Abril' WHEN 5 THEN 'Maio' WHEN 6 THEN 'Junho' WHEN 7 THEN 'Julho' WHEN 8 THEN 'Agosto' WHEN 9 THEN 'Setembro' WHEN 10 THEN 'Outubro' WHEN 11 THEN 'Novembro' WHEN 12 THEN 'Dezembro' END, CASE EXTRACT(MONTH FROM d) WHEN 1 THEN 'Jan' WHEN 2 THEN 'Fev' WHEN 3 THEN 'Mar' WHEN 4 THEN 'Abr' WHEN 5 THEN 'Mai' WHEN 6 THEN 'Jun' WHEN 7 THEN 'Jul' WHEN 8 THEN 'Ago' WHEN 9 THEN 'Set' WHEN 10 THEN 'Out' WHEN 11 THEN 'Nov' WHEN 12 THEN 'Dez' END, CASE EXTRACT(ISODOW FROM d) WHEN 1 THEN 'Segunda-feira' WHEN 2 THEN 'Terça-feira' WHEN 3 THEN 'Quarta-feira' WHEN 4 THEN 'Quinta-feira' WHEN 5 THEN 'Sexta-feira' WHEN 6 THEN 'Sábado' WHEN 7 THEN 'Domingo' END, CASE EXTRACT(ISODOW FROM d) WHEN 1 THEN 'Seg' WHEN 2 THEN 'Ter' WHEN 3 THEN 'Qua' WHEN 4 THEN 'Qui' WHEN 5 THEN 'Sex' WHEN 6 THEN 'Sáb' WHEN 7 THEN 'Dom' END, EXTRACT(ISODOW FROM d)::int, EXTRACT(WEEK FROM d)::int, EXTRACT(ISOYEAR FROM d)::int, EXTRACT(QUARTER FROM d)::int, TO_CHAR(d, 'DD/MM'), EXTRACT(ISODOW FROM d) IN (6,7), FALSE, NULL
-    FROM (SELECT DISTINCT data::date AS d FROM useall.gold_requisicoes WHERE data IS NOT NULL) x
-    ON CONFLICT (data) DO NOTHING;
-    """
-    with engine.begin() as conn:
-        conn.execute(text(sql))
+    # Intervalo fixo via generate_series (USEALL_CALENDARIO_*); não varre a gold_requisicoes
+    atualizar_calendario(engine, DB_Schema)
     logger.info("Dim Calendario atualizada.")
 
 
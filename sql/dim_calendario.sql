@@ -1,4 +1,25 @@
+# ---------------- INTERVALO ----------------
+# Calendário contínuo, gerado uma vez por generate_series (não varre a gold_requisicoes).
+# Feriados nacionais: useall.dim_feriados, preenchida aqui (e pelo pipeline) com useall_calendario.feriados_nacionais
+# antes de gerar os dias, para o calendário não nascer sem feriados.
+# Mesmo intervalo do pipeline (USEALL_CALENDARIO_INICIO / USEALL_CALENDARIO_ANOS_FUTUROS), sem datas fixas aqui.
+from useall_calendario import intervalo_calendario, feriados_nacionais
+inicio_calendario, fim_calendario = intervalo_calendario()
+params_calendario = {"inicio": inicio_calendario, "fim": fim_calendario}
+params_feriados = [
+    {"data": d, "nome": n}
+    for ano in range(inicio_calendario.year, fim_calendario.year + 1)
+    for d, n in feriados_nacionais(ano)
+]
+
 # ---------------- SQL ----------------
+sql_create_dim_feriados = text("""
+CREATE TABLE IF NOT EXISTS useall.dim_feriados (
+    data DATE PRIMARY KEY,
+    nome TEXT NOT NULL
+);
+""")
+
 sql_create_dim_calendario = text("""
 CREATE TABLE IF NOT EXISTS useall.dim_calendario (
     data DATE PRIMARY KEY,
@@ -59,7 +80,7 @@ INSERT INTO useall.dim_calendario (
     is_feriado,
     nome_feriado
 )
-SELECT DISTINCT
+SELECT
     d::date AS data,
 
     EXTRACT(YEAR FROM d)::int AS ano,
@@ -135,18 +156,34 @@ SELECT DISTINCT
     TO_CHAR(d, 'DD/MM') AS dia_mes_abr,
 
     EXTRACT(ISODOW FROM d) IN (6,7) AS is_fim_de_semana,
-    FALSE AS is_feriado,
-    NULL AS nome_feriado
-FROM (
-    SELECT DISTINCT data::date AS d
-    FROM useall.gold_requisicoes
-    WHERE data IS NOT NULL
-) x
+    f.data IS NOT NULL AS is_feriado,
+    f.nome AS nome_feriado
+FROM generate_series(CAST(:inicio AS date), CAST(:fim AS date), interval '1 day') AS d
+LEFT JOIN useall.dim_feriados f ON f.data = d::date
 ON CONFLICT (data) DO NOTHING;
 """)
 
+# DO NOTHING: feriados cadastrados à mão (estaduais, municipais) prevalecem
+sql_insere_feriados = text("""
+INSERT INTO useall.dim_feriados (data, nome)
+VALUES (:data, :nome)
+ON CONFLICT (data) DO NOTHING;
+""")
+
+# Dias gerados antes do feriado existir em dim_feriados
+sql_marca_feriados = text("""
+UPDATE useall.dim_calendario c
+SET is_feriado = TRUE, nome_feriado = f.nome
+FROM useall.dim_feriados f
+WHERE f.data = c.data
+  AND (c.is_feriado IS NOT TRUE OR c.nome_feriado IS DISTINCT FROM f.nome);
+""")
+
 # ---------------- EXECUÇÃO ----------------
 with engine.begin() as conn:
+    conn.execute(sql_create_dim_feriados)
     conn.execute(sql_create_dim_calendario)
     conn.execute(sql_create_indices)
-    conn.execute(sql_atualiza_calendario)
\ No newline at end of file
+    conn.execute(sql_insere_feriados, params_feriados)
+    conn.execute(sql_atualiza_calendario, params_calendario)
+    conn.execute(sql_marca_feriados)
\ No newline at end of file
@@ -0,0 +1,38 @@
+-- Benchmark das chaves de join da gold_requisicoes: texto concatenado (antes) x chave tipada (depois).
+-- Roda sobre as tabelas reais do schema useall:  psql -f sql/simulations/chaves_tipadas_explain.sql
+-- Referência medida num Postgres 16 local (binários do pacote Python pgserver, 1 vCPU Xeon, configuração
+-- padrão: work_mem 4MB), não no servidor de produção. Dados sintéticos: 1M silver_requisicoes,
+-- 500k gold_atendimentodereq, índices da gold criados pelo useall_gold; mediana de 4 execuções após 1 de aquecimento:
+--   antes  (py_idreqitem texto): 4469 ms. HashAggregate na string (9 batches, 23 MB em disco)
+--                                + Hash Join montando a string para cada uma das 1M linhas.
+--   depois ((idreqmat, iditem)):  3789 ms. GroupAggregate lendo o índice (idreqmat, iditem), sem spill,
+--                                + Hash Join em dois bigint.
+-- Os tempos variam entre execuções nessa máquina; rode no banco real antes de comparar números absolutos.
+
+\timing on
+
+\echo '== ANTES: join por py_idreqitem (texto) =='
+EXPLAIN (ANALYZE, BUFFERS, COSTS OFF)
+SELECT r.*,
+       r.idreqmat::text || '-' || r.iditem::text AS py_idreqitem,
+       COALESCE(ati.max_dataatend_item, atr.max_dataatend_req) AS py_data_ult_atend
+FROM useall.silver_requisicoes r
+LEFT JOIN (SELECT py_idreqitem, MAX(data_atend) AS max_dataatend_item
+           FROM useall.gold_atendimentodereq GROUP BY py_idreqitem) ati
+       ON ati.py_idreqitem = (r.idreqmat::text || '-' || r.iditem::text)
+LEFT JOIN (SELECT idreqmat, MAX(data_atend) AS max_dataatend_req
+           FROM useall.gold_atendimentodereq GROUP BY idreqmat) atr
+       ON atr.idreqmat = r.idreqmat;
+
+\echo '== DEPOIS: join por (idreqmat, iditem) =='
+EXPLAIN (ANALYZE, BUFFERS, COSTS OFF)
+SELECT r.*,
+       r.idreqmat::text || '-' || r.iditem::text AS py_idreqitem,
+       COALESCE(ati.max_dataatend_item, atr.max_dataatend_req) AS py_data_ult_atend
+FROM useall.silver_requisicoes r
+LEFT JOIN (SELECT idreqmat, iditem, MAX(data_atend) AS max_dataatend_item
+           FROM useall.gold_atendimentodereq GROUP BY idreqmat, iditem) ati
+       ON ati.idreqmat = r.idreqmat AND ati.iditem = r.iditem
+LEFT JOIN (SELECT idreqmat, MAX(data_atend) AS max_dataatend_req
+           FROM useall.gold_atendimentodereq GROUP BY idreqmat) atr
+       ON atr.idreqmat = r.idreqmat;
@@ -0,0 +1,17 @@
+-- gold_ultimos_custos x definição antiga da vw_ultimos_custos (ROW_NUMBER sobre toda a gold_custos).
+-- Esperado: as três primeiras colunas em 0. Em empate na maior datacusto as duas formas escolhem uma
+-- linha qualquer, por isso a tabela é comparada com todas as empatadas (RANK = 1).
+WITH janela AS (
+    SELECT * FROM (SELECT gc.*, ROW_NUMBER() OVER (PARTITION BY codigoitem ORDER BY datacusto DESC) AS rn
+                   FROM useall.gold_custos gc WHERE ultimocusto <> 0) t WHERE rn = 1
+), topo AS (
+    SELECT * FROM (SELECT gc.*, RANK() OVER (PARTITION BY codigoitem ORDER BY datacusto DESC) AS rn
+                   FROM useall.gold_custos gc WHERE ultimocusto <> 0) t WHERE rn = 1
+), tabela AS (
+    SELECT *, 1::bigint AS rn FROM useall.gold_ultimos_custos
+)
+SELECT
+    (SELECT count(*) FROM (SELECT * FROM tabela EXCEPT ALL SELECT * FROM topo) f)                          AS fora_do_topo,
+    (SELECT count(*) FROM (SELECT codigoitem FROM janela EXCEPT SELECT codigoitem FROM tabela) j)          AS itens_so_janela,
+    (SELECT count(*) FROM (SELECT codigoitem FROM tabela EXCEPT SELECT codigoitem FROM janela) t)          AS itens_so_tabela,
+    (SELECT count(*) FROM (SELECT codigoitem FROM topo GROUP BY codigoitem HAVING count(*) > 1) e)         AS empates;